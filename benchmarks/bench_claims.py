@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Benchmark claim splitting on EPO style claim blobs.
+#
+# Usage: python benchmarks/bench_claims.py [number_of_claims] [repeats]
+import sys
+import timeit
+
+from patentdata.xmlparser import XMLDoc
+from patentdata.models.lib.utils_claimset import (
+    clean_data, regex_extract_claims, nltk_extract_claims
+)
+
+
+def epo_claims_xml(number_of_claims):
+    """ Build claims XML in the format returned by the OPS claims
+    endpoint. """
+    claims = ["<claim-text>1. A method of processing data comprising: "
+              "receiving a request; and sending a response.</claim-text>"]
+    for num in range(2, number_of_claims + 1):
+        claims.append(
+            "<claim-text>{0}. The method of claim {1}, wherein the "
+            "request comprises a header.</claim-text>".format(
+                num, num - 1
+            )
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<ops:world-patent-data xmlns:ops="http://ops.epo.org">'
+        '<ftxt:fulltext-documents xmlns:ftxt="http://www.epo.org/fulltext">'
+        '<ftxt:fulltext-document><claims lang="EN"><claim>'
+        '{0}</claim></claims></ftxt:fulltext-document>'
+        '</ftxt:fulltext-documents></ops:world-patent-data>'
+    ).format("\n".join(claims))
+
+
+def main(number_of_claims=50, repeats=20):
+    description = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<description><p>A description.</p></description>'
+    )
+    blob = XMLDoc(description, epo_claims_xml(number_of_claims)).claim_text()
+    print("Claim blob: {0} claims, {1} characters".format(
+        number_of_claims, len(blob)))
+    for name, func in [
+        ("regex_extract_claims", regex_extract_claims),
+        ("nltk_extract_claims", nltk_extract_claims),
+        ("clean_data", clean_data)
+    ]:
+        seconds = timeit.timeit(lambda: func(blob), number=repeats)
+        print("{0:<22} {1:8.2f} ms per claimset".format(
+            name, seconds / repeats * 1000))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
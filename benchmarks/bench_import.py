@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Benchmark package import times in fresh interpreters.
+#
+# Usage: python benchmarks/bench_import.py [repeats]
+import os
+import subprocess
+import sys
+
+# Modules timed, and heavy dependencies each should not load at import
+MODULES = [
+    "patentdata.corpus",
+    "patentdata.xmlparser",
+    "patentdata.models",
+    "patentdata.patentqueries"
+]
+LAZY_DEPENDENCIES = ["nltk", "bs4"]
+
+
+def import_time(module):
+    """ Return seconds to import module in a new interpreter and the lazy
+    dependencies it loaded. """
+    code = (
+        "import sys, time; start = time.perf_counter(); "
+        "import {0}; elapsed = time.perf_counter() - start; "
+        "print(elapsed, *[m for m in {1!r} if m in sys.modules])"
+    ).format(module, LAZY_DEPENDENCIES)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output(
+        [sys.executable, "-c", code], cwd=root
+    ).decode().split()
+    return float(output[0]), output[1:]
+
+
+def main(repeats=5):
+    for module in MODULES:
+        timings = list()
+        for _ in range(repeats):
+            seconds, loaded = import_time(module)
+            timings.append(seconds)
+        print("{0:<26} {1:8.1f} ms (best of {2}){3}".format(
+            module, min(timings) * 1000, repeats,
+            "  loads " + ", ".join(loaded) if loaded else ""
+        ))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
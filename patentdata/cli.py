@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+""" Command line interface for indexing and processing patent archives.
+
+Run ``patentdata --help`` for the list of commands.
+"""
+import argparse
+import sys
+import time
+
+import patentdata.utils as utils
+from patentdata.corpus import USPublications, USGrants, shards
+from patentdata.corpus.export import (
+    document_record, export_jsonl, export_dataset
+)
+from patentdata.xmlparser import XMLDoc
+
+
+def get_datasource(args):
+    """ Open the data source selected by the command line arguments. """
+    if args.grants:
+        return USGrants(args.path, shard=getattr(args, 'shard', None))
+    return USPublications(args.path, shard=getattr(args, 'shard', None))
+
+
+def get_filters(args):
+    """ Return data source filters from the command line arguments. """
+    return {
+        'classification': args.classification or None,
+        'sample_size': args.sample_size
+    }
+
+
+def archive_count(datasource):
+    """ Return the number of archives that will be indexed. """
+    return len([
+        f for f in datasource.first_level_files
+        if "SUPP" not in f and shards.in_shard(f, datasource.shard)
+    ])
+
+
+def index(args):
+    """ Index archive files. """
+    datasource = get_datasource(args)
+    progress = utils.ProgressReporter(
+        archive_count(datasource), args.interval
+    )
+    datasource.index(
+        args.full_text, progress, args.batch_size, args.processes
+    )
+    return progress.summary()
+
+
+def classify(args):
+    """ Store classifications for indexed publications. """
+    if args.grants:
+        raise SystemExit("Grant classifications are stored by index")
+    datasource = get_datasource(args)
+    progress = utils.ProgressReporter(interval=args.interval)
+    datasource.process_classifications(
+        args.years, progress, args.batch_size, args.processes
+    )
+    return progress.summary()
+
+
+def sample(args):
+    """ Print a random sample of indexed publication numbers. """
+    datasource = get_datasource(args)
+    for (pub_no,) in datasource.select_files(
+        "pub_no", args.classification or None, sample_size=args.size
+    ):
+        print(pub_no)
+
+
+def export(args):
+    """ Export document metadata and text. """
+    datasource = get_datasource(args)
+    filters = get_filters(args)
+    progress = utils.ProgressReporter(interval=args.interval)
+    progress.start(args.output, datasource.count(**filters))
+    if args.format == 'jsonl':
+        written = export_jsonl(
+            datasource, args.output, not args.no_text, args.processes,
+            args.batch_size, progress, **filters
+        )
+    else:
+        written = export_dataset(
+            datasource, args.output, args.format, not args.no_text,
+            args.processes, args.batch_size, progress, **filters
+        )
+    progress.finish()
+    print("{0} documents written to {1}".format(written, args.output))
+    return progress.summary()
+
+
+def bench(args):
+    """ Time reading, parsing and building documents for a sample. """
+    datasource = get_datasource(args)
+    filters = get_filters(args)
+    start = time.time()
+    filedata = list(datasource.iter_filedata(**filters))
+    timings = [('read', time.time() - start)]
+    nbytes = sum(len(data) for _, data in filedata)
+
+    start = time.time()
+    list(utils.parallel_map(
+        document_record, filedata, args.processes,
+        max(1, args.batch_size // 10)
+    ))
+    timings.append(('parse', time.time() - start))
+
+    start = time.time()
+    for _, data in filedata:
+        XMLDoc(data).to_patentdoc()
+    timings.append(('patentdoc', time.time() - start))
+
+    print("{0} documents, {1:.2f} MB".format(len(filedata), nbytes / 1e6))
+    results = dict()
+    for stage, seconds in timings:
+        seconds = max(seconds, 1e-9)
+        results[stage] = {
+            'seconds': seconds,
+            'docs_per_sec': len(filedata) / seconds,
+            'mb_per_sec': nbytes / seconds / 1e6
+        }
+        print("{0:>10}: {1:8.2f} docs/s {2:8.2f} MB/s".format(
+            stage, results[stage]['docs_per_sec'],
+            results[stage]['mb_per_sec']
+        ))
+    return results
+
+
+def build_parser():
+    """ Return the argument parser for the command line interface. """
+    parser = argparse.ArgumentParser(
+        prog="patentdata",
+        description="Index and process USPTO bulk patent archives."
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("path", help="directory holding the archives")
+    common.add_argument(
+        "--grants", action="store_true",
+        help="use granted patents rather than publications"
+    )
+    common.add_argument(
+        "--processes", type=int, default=None,
+        help="worker processes (default: all CPUs)"
+    )
+    common.add_argument(
+        "--batch-size", type=int, default=100,
+        help="documents per batch or transaction"
+    )
+    common.add_argument(
+        "--interval", type=float, default=5.0,
+        help="seconds between progress reports"
+    )
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument(
+        "--classification", nargs="*", default=None,
+        help="classification filter, e.g. G 06 F"
+    )
+    filters.add_argument(
+        "--sample-size", type=int, default=None,
+        help="limit to a random sample of documents"
+    )
+
+    command = subparsers.add_parser(
+        "index", parents=[common], help="index archive files"
+    )
+    command.add_argument(
+        "--shard", default=None,
+        help="only index shard k of n archives, e.g. 3/8"
+    )
+    command.add_argument(
+        "--full-text", action="store_true",
+        help="also build the full text search index"
+    )
+    command.set_defaults(function=index)
+
+    command = subparsers.add_parser(
+        "classify", parents=[common],
+        help="store classifications of indexed publications"
+    )
+    command.add_argument(
+        "--years", type=int, nargs="*", default=None,
+        help="only process these years"
+    )
+    command.set_defaults(function=classify)
+
+    command = subparsers.add_parser(
+        "sample", parents=[common],
+        help="print a random sample of publication numbers"
+    )
+    command.add_argument(
+        "--classification", nargs="*", default=None,
+        help="classification filter, e.g. G 06 F"
+    )
+    command.add_argument(
+        "--size", type=int, default=10, help="number of publications"
+    )
+    command.set_defaults(function=sample)
+
+    command = subparsers.add_parser(
+        "export", parents=[common, filters],
+        help="export document metadata and text"
+    )
+    command.add_argument(
+        "output", help="file to write, or directory for a dataset"
+    )
+    command.add_argument(
+        "--format", choices=["jsonl", "parquet", "arrow"], default="jsonl",
+        help="JSON lines, or a Parquet or Arrow dataset partitioned by "
+        "year and section that is added to on later runs"
+    )
+    command.add_argument(
+        "--no-text", action="store_true",
+        help="only export metadata, not abstract, claims or description"
+    )
+    command.set_defaults(function=export)
+
+    command = subparsers.add_parser(
+        "bench", parents=[common, filters],
+        help="time reading and parsing a sample of documents"
+    )
+    command.set_defaults(function=bench, sample_size=100)
+    return parser
+
+
+def main(argv=None):
+    """ Run the command line interface. """
+    args = build_parser().parse_args(argv)
+    args.function(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
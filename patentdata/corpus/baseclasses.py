@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
 # Import abstract class functions
 from abc import ABCMeta, abstractmethod
+import random
+import threading
+
+from patentdata.corpus.textindex import TextIndex, classification_clause
+
+# Maximum publication numbers bound into a single IN (...) query
+IN_CHUNK_SIZE = 500
 
 
 class BasePatentDataSource(metaclass=ABCMeta):
@@ -20,6 +27,19 @@ class BasePatentDataSource(metaclass=ABCMeta):
         sample_size limits results to a random sample of size sample_size"""
         pass
 
+    def count(
+        self, classification=None, publication_numbers=None, sample_size=None
+    ):
+        """ Return the number of documents patentdoc_generator would
+        provide for the same arguments, or None if this cannot be known
+        without fetching the documents. """
+        if publication_numbers is None:
+            return None
+        number = len(publication_numbers)
+        if sample_size:
+            number = min(number, sample_size)
+        return number
+
 
 class LocalDataSource(BasePatentDataSource):
     """ Abstract class for files stored locally. """
@@ -38,3 +58,127 @@ class LocalDataSource(BasePatentDataSource):
 
         This may be faster than returning the whole patent docs."""
         pass
+
+    def index_text(self, processes=None, batch_size=100):
+        """ Add documents that are not yet in the full text index. """
+        raise NotImplementedError(
+            "{0} does not support full text indexing".format(
+                type(self).__name__
+            )
+        )
+
+    @property
+    def c(self):
+        """ Cursor on conn for the calling thread, so result sets of a
+        prefetching thread and the caller's thread do not mix. """
+        # setdefault is atomic, so threads share one threading.local
+        cursors = self.__dict__.setdefault('_cursors', threading.local())
+        try:
+            return cursors.cursor
+        except AttributeError:
+            cursors.cursor = self.conn.cursor()
+            return cursors.cursor
+
+    def count(
+        self, classification=None, publication_numbers=None, sample_size=None
+    ):
+        """ Return the number of indexed publications matching a
+        classification of form ["G", "06"] or in publication_numbers,
+        without reading any files. """
+        if publication_numbers is not None:
+            publication_numbers = list(publication_numbers)
+            number = 0
+            for i in range(0, len(publication_numbers), IN_CHUNK_SIZE):
+                chunk = publication_numbers[i:i + IN_CHUNK_SIZE]
+                number += self.conn.execute(
+                    "SELECT COUNT(*) FROM files WHERE pub_no IN ({0})".format(
+                        ", ".join("?" * len(chunk))
+                    ),
+                    chunk
+                ).fetchone()[0]
+        else:
+            clause, params = classification_clause(classification)
+            query_string = "SELECT COUNT(*) FROM files"
+            if clause:
+                query_string += " WHERE " + clause
+            number = self.conn.execute(query_string, params).fetchone()[0]
+        if sample_size:
+            number = min(number, sample_size)
+        return number
+
+    def select_files(
+        self, columns, classification=None, publication_numbers=None,
+        sample_size=None
+    ):
+        """ Return rows of columns from the files table for publications
+        matching a classification of form ["G", "06"] or in
+        publication_numbers, randomly sampled down to sample_size.
+
+        :param columns: comma separated column names
+        :type columns: str
+        :return: list of tuples
+        """
+        query_string = "SELECT {0} FROM files".format(columns)
+        if publication_numbers:
+            publication_numbers = list(publication_numbers)
+            if sample_size and len(publication_numbers) > sample_size:
+                publication_numbers = random.sample(
+                    publication_numbers, sample_size
+                )
+            records = list()
+            for i in range(0, len(publication_numbers), IN_CHUNK_SIZE):
+                chunk = publication_numbers[i:i + IN_CHUNK_SIZE]
+                records += self.conn.execute(
+                    query_string + " WHERE pub_no IN ({0})".format(
+                        ", ".join("?" * len(chunk))
+                    ),
+                    chunk
+                ).fetchall()
+            return records
+        clause, params = classification_clause(classification)
+        if clause:
+            query_string += " WHERE " + clause
+        if sample_size:
+            query_string += " ORDER BY RANDOM() LIMIT ?"
+            params.append(sample_size)
+        return self.conn.execute(query_string, params).fetchall()
+
+    def iter_filedata(
+        self, classification=None, publication_numbers=None,
+        sample_size=None, skip=None
+    ):
+        """ Return a generator of (pub_no, filedata) tuples for raw XML,
+        limited as for select_files. Publication numbers in the skip
+        set are not read. """
+        raise NotImplementedError(
+            "{0} does not support reading raw file data".format(
+                type(self).__name__
+            )
+        )
+
+    @property
+    def text_index(self):
+        """ Full text index of claims, paragraphs and documents
+        stored in fileindexes.db. """
+        try:
+            return self._text_index
+        except AttributeError:
+            self._text_index = TextIndex(self.conn)
+            return self._text_index
+
+    def search(self, query, limit=10, classification=None):
+        """ Return publication numbers matching a full text query,
+        best match first. Run index_text() first to build the index.
+
+        Results can be passed to patentdoc_generator as
+        publication_numbers.
+
+        :param query: FTS5 query string, e.g. 'siderail AND bed'
+        :type query: str
+        :param limit: maximum number of results
+        :type limit: int
+        :param classification: optional filter of form ["G", "06"]
+        :type classification: list
+        :return: list of publication numbers
+        """
+        return self.text_index.search(query, limit, classification)
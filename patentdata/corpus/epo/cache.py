@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# On-disk cache of EPO OPS responses
+import sqlite3
+import threading
+import time
+import zlib
+
+DAY = 24 * 60 * 60
+
+# Seconds before a cached response is fetched again; None never expires
+DEFAULT_TTLS = {
+    'description': 90 * DAY,
+    'claims': 90 * DAY,
+    'biblio': 30 * DAY,
+    'application-biblio': 30 * DAY,
+    'register-biblio': 7 * DAY,
+    'number': None
+}
+
+# Default cache size limit of 1 GB of compressed responses
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+
+class ResponseCache:
+    """ Store OPS response text in SQLite keyed by endpoint and number.
+
+    Responses are zlib compressed. Entries older than the TTL of their
+    endpoint are treated as missing, and the least recently used entries
+    are removed once the cache is larger than max_bytes.
+    """
+
+    def __init__(
+        self, path="opscache.db", ttls=None, max_bytes=DEFAULT_MAX_BYTES,
+        level=6
+    ):
+        """ Open or create a cache.
+
+        :param path: SQLite database file
+        :type path: str
+        :param ttls: seconds each endpoint's responses are kept, updating
+        DEFAULT_TTLS
+        :type ttls: dict
+        :param max_bytes: limit on the compressed size of all responses
+        :type max_bytes: int
+        :param level: zlib compression level
+        :type level: int
+        :return: None
+        """
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_bytes = max_bytes
+        self.level = level
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # Used from fetcher threads as well as the creating thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'endpoint TEXT, number TEXT, data BLOB, size INTEGER, '
+            'stored REAL, accessed REAL, PRIMARY KEY (endpoint, number))'
+        )
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed '
+            'ON responses (accessed)'
+        )
+        self.conn.commit()
+        self.size = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()[0]
+
+    def expired(self, endpoint, stored):
+        """ Check if a response stored at time stored has expired. """
+        ttl = self.ttls.get(endpoint)
+        return ttl is not None and time.time() - stored > ttl
+
+    def get(self, endpoint, number):
+        """ Return cached response text, or None if missing or expired.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT data, stored FROM responses '
+                'WHERE endpoint = ? AND number = ?',
+                (endpoint, number)
+            ).fetchone()
+            if row is None or self.expired(endpoint, row[1]):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute(
+                'UPDATE responses SET accessed = ? '
+                'WHERE endpoint = ? AND number = ?',
+                (time.time(), endpoint, number)
+            )
+            self.conn.commit()
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def set(self, endpoint, number, text):
+        """ Store response text, evicting old entries if needed. """
+        data = zlib.compress(text.encode('utf-8'), self.level)
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute(
+                'SELECT size FROM responses '
+                'WHERE endpoint = ? AND number = ?',
+                (endpoint, number)
+            ).fetchone()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(endpoint, number, data, size, stored, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (endpoint, number, data, len(data), now, now)
+            )
+            self.size += len(data) - (old[0] if old else 0)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """ Remove least recently used entries until within max_bytes.
+        Does not commit. """
+        if self.max_bytes is None or self.size <= self.max_bytes:
+            return
+        rows = self.conn.execute(
+            'SELECT endpoint, number, size FROM responses '
+            'ORDER BY accessed'
+        )
+        evict = list()
+        for endpoint, number, size in rows:
+            if self.size <= self.max_bytes:
+                break
+            evict.append((endpoint, number))
+            self.size -= size
+        self.conn.executemany(
+            'DELETE FROM responses WHERE endpoint = ? AND number = ?', evict
+        )
+        self.evictions += len(evict)
+
+    def fetch(self, endpoint, number, function):
+        """ Return cached text for endpoint and number, otherwise call
+        function and cache any text it returns. """
+        text = self.get(endpoint, number)
+        if text is None:
+            text = function()
+            if text:
+                self.set(endpoint, number, text)
+        return text
+
+    def clear(self, endpoint=None):
+        """ Remove all entries, or those of one endpoint. """
+        with self.lock:
+            if endpoint is None:
+                self.conn.execute('DELETE FROM responses')
+            else:
+                self.conn.execute(
+                    'DELETE FROM responses WHERE endpoint = ?', (endpoint,)
+                )
+            self.conn.commit()
+            self.size = self.conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses'
+            ).fetchone()[0]
+
+    def stats(self):
+        """ Return a dictionary of cache statistics. """
+        with self.lock:
+            entries = self.conn.execute(
+                'SELECT COUNT(*) FROM responses'
+            ).fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': self.size
+        }
+
+    def close(self):
+        """ Close the database connection. """
+        self.conn.close()
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# Concurrent retrieval of full text documents from EPO OPS
+import re
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import epo_ops
+
+from patentdata.xmlparser import XMLDoc, XMLRegisterData
+
+# Requests per minute assumed for each OPS throttling service until a
+# response reports the actual limits
+DEFAULT_LIMITS = {
+    'images': 200,
+    'inpadoc': 60,
+    'other': 200,
+    'retrieval': 200,
+    'search': 30
+}
+
+# Slow down as the service traffic light changes
+COLOUR_FACTORS = {'green': 1.0, 'yellow': 2.0, 'red': 4.0}
+
+# Slow down as overall OPS load increases
+STATE_FACTORS = {'idle': 1.0, 'busy': 1.5, 'overloaded': 3.0}
+
+# Endpoints fetched for each document
+ENDPOINTS = ['description', 'claims', 'biblio']
+
+# epo_ops 1.0 merged RegisteredClient into Client
+OPSClient = getattr(epo_ops, 'RegisteredClient', epo_ops.Client)
+
+THROTTLE_SERVICE_RE = re.compile(r'(\w+)=(\w+):(\d+)')
+THROTTLE_STATE_RE = re.compile(r'^\s*(\w+)')
+
+
+def parse_throttling_control(header):
+    """ Parse an OPS X-Throttling-Control header, e.g.
+    "idle (images=green:200, retrieval=green:200, search=green:30)".
+
+    :return: (system state, {service: (colour, requests per minute)})
+    """
+    state = THROTTLE_STATE_RE.match(header)
+    services = {
+        service: (colour.lower(), int(limit))
+        for service, colour, limit in THROTTLE_SERVICE_RE.findall(header)
+    }
+    return (state.group(1).lower() if state else None), services
+
+
+def service_for_url(url):
+    """ Return the OPS throttling service that a request URL counts
+    against. """
+    if 'published-data/images' in url:
+        return 'images'
+    if 'published-data/search' in url:
+        return 'search'
+    if 'published-data' in url:
+        return 'retrieval'
+    if '/family' in url or '/legal' in url:
+        return 'inpadoc'
+    return 'other'
+
+
+class RateLimiter:
+    """ Space out requests to each OPS throttling service.
+
+    Each call to wait() reserves the next start time for a service, so
+    requests from many threads are spread evenly within the limit.
+    Limits and slow down factors are updated from the throttling
+    headers of each response; a black light pauses the service for the
+    Retry-After period.
+    """
+
+    def __init__(self, limits=None):
+        """ Initialise limiter.
+
+        :param limits: requests per minute for each service, used until
+        responses report the limits
+        :type limits: dict
+        """
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.colours = dict()
+        self.state = 'idle'
+        self.next_start = dict()
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    def interval(self, service):
+        """ Return the seconds between requests to service. """
+        limit = self.limits.get(service) or DEFAULT_LIMITS['other']
+        return (
+            60.0 / limit *
+            COLOUR_FACTORS.get(self.colours.get(service), 1.0) *
+            STATE_FACTORS.get(self.state, 1.0)
+        )
+
+    def wait(self, service):
+        """ Block until a request to service may be made. """
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start.get(service, now))
+            self.next_start[service] = start + self.interval(service)
+            self.waited += start - now
+        if start > now:
+            time.sleep(start - now)
+
+    def update(self, headers, service=None):
+        """ Adapt limits to the throttling headers of a response. """
+        header = headers.get('X-Throttling-Control')
+        if not header:
+            return
+        state, services = parse_throttling_control(header)
+        with self.lock:
+            if state:
+                self.state = state
+            for name, (colour, limit) in services.items():
+                self.colours[name] = colour
+                if limit:
+                    self.limits[name] = limit
+            if service and self.colours.get(service) == 'black':
+                # Retry-After is in milliseconds
+                retry = int(headers.get('Retry-After', 60000)) / 1000.0
+                self.next_start[service] = max(
+                    self.next_start.get(service, 0),
+                    time.monotonic() + retry
+                )
+
+
+class ConcurrentFetcher:
+    """ Fetch OPS full text for many documents using a pool of threads.
+
+    epo_ops clients are not thread safe, so each thread has its own
+    client without middlewares; a shared RateLimiter keeps the combined
+    request rate within the OPS quotas.
+    """
+
+    def __init__(
+        self, key, secret, workers=4, limiter=None, service_url=None,
+        auth_url=None, cache=None, accept_type='xml'
+    ):
+        """ Initialise fetcher.
+
+        :param key: OPS consumer key
+        :param secret: OPS consumer secret
+        :param workers: number of concurrent requests
+        :type workers: int
+        :param limiter: shared rate limiter
+        :type limiter: RateLimiter
+        :param service_url: alternative OPS rest-services URL, e.g. of a
+        test server
+        :param auth_url: alternative OPS access token URL
+        :param cache: cache of response text
+        :type cache: ResponseCache
+        :param accept_type: response format, 'xml' or 'json'
+        :type accept_type: str
+        :return: None
+        """
+        self.key = key
+        self.secret = secret
+        self.workers = workers
+        self.limiter = limiter or RateLimiter()
+        self.service_url = service_url
+        self.auth_url = auth_url
+        self.cache = cache
+        self.accept_type = accept_type
+        self.local = threading.local()
+
+    def client(self):
+        """ Return the OPS client for the current thread. """
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = OPSClient(
+                key=self.key,
+                secret=self.secret,
+                accept_type=self.accept_type,
+                middlewares=[]
+            )
+            if self.service_url:
+                client.__service_url_prefix__ = self.service_url
+            if self.auth_url:
+                client.__auth_url__ = self.auth_url
+            self.local.client = client
+        return client
+
+    def request(self, service, method, *args, **kwargs):
+        """ Call an epo_ops client method within the rate limits.
+
+        :param service: throttling service the request counts against
+        :type service: str
+        :param method: name of the epo_ops.Client method
+        :type method: str
+        :return: requests.Response
+        """
+        self.limiter.wait(service)
+        try:
+            response = getattr(self.client(), method)(*args, **kwargs)
+        except Exception as e:
+            response = getattr(e, 'response', None)
+            if response is not None:
+                self.limiter.update(response.headers, service)
+            raise
+        self.limiter.update(response.headers, service)
+        return response
+
+    def published_data(self, publication_number, endpoint):
+        """ Return response text for a published data endpoint. """
+        def fetch():
+            return self.request(
+                'retrieval', 'published_data',
+                reference_type='publication',
+                input=epo_ops.models.Epodoc(publication_number),
+                endpoint=endpoint
+            ).text
+        if self.cache is None:
+            return fetch()
+        return self.cache.fetch(endpoint, publication_number, fetch)
+
+    def iter_responses(self, publication_numbers, endpoints=None):
+        """ Fetch endpoints for each publication number concurrently.
+
+        Yields as soon as all endpoints of a number have completed, so
+        results are not in the order of publication_numbers. Repeated
+        numbers are fetched and yielded once.
+
+        :param endpoints: published data endpoints to fetch
+        :type endpoints: list of str
+        :return: generator of (number, {endpoint: text or None})
+        """
+        endpoints = endpoints or ENDPOINTS
+        numbers = iter(dict.fromkeys(publication_numbers))
+        # Limit how many documents are in flight at once
+        max_pending = self.workers * 2
+        pending = dict()
+        results = dict()
+        with ThreadPoolExecutor(self.workers) as pool:
+
+            def submit_next():
+                for number in numbers:
+                    results[number] = dict()
+                    for endpoint in endpoints:
+                        future = pool.submit(
+                            self.published_data, number, endpoint
+                        )
+                        pending[future] = (number, endpoint)
+                    return True
+                return False
+
+            while len(results) < max_pending and submit_next():
+                pass
+            try:
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        number, endpoint = pending.pop(future)
+                        try:
+                            results[number][endpoint] = future.result()
+                        except Exception:
+                            results[number][endpoint] = None
+                        if len(results[number]) == len(endpoints):
+                            yield number, results.pop(number)
+                            submit_next()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def iter_patentdocs(self, publication_numbers):
+        """ Yield PatentDoc objects as their text is retrieved.
+
+        Numbers whose description or claims cannot be retrieved are
+        skipped with a warning.
+        """
+        for number, texts in self.iter_responses(publication_numbers):
+            patentdoc = build_patentdoc(number, texts)
+            if patentdoc is None:
+                warnings.warn(
+                    "Full text document not available: {0}".format(number)
+                )
+            else:
+                yield patentdoc
+
+
+def build_patentdoc(number, texts):
+    """ Build a PatentDoc from description, claims and biblio
+    response text, or return None if the full text is missing. """
+    if not texts.get('description') or not texts.get('claims'):
+        return None
+    patentdoc = XMLDoc(texts['description'], texts['claims']).to_patentdoc()
+    patentdoc.number = number
+    if texts.get('biblio'):
+        title = XMLRegisterData(texts['biblio']).get_title()
+        patentdoc.title = title or patentdoc.title
+    return patentdoc
@@ -6,37 +6,86 @@ import epo_ops
 
 # EPOOPSCorpus imports
 from patentdata.corpus.baseclasses import BasePatentDataSource
+from patentdata.corpus.epo.cache import ResponseCache
+from patentdata.corpus.epo.fetcher import ConcurrentFetcher, OPSClient
+from patentdata.corpus.epo.resolver import (
+    NumberResolver, error_status, is_not_found
+)
 
 from patentdata.xmlparser import (
-    XMLDoc, XMLRegisterData, get_epodoc, extract_pub_no
+    XMLDoc, XMLRegisterData, get_epodoc, extract_pub_no,
+    split_exchange_documents, epodoc_number
 )
 
+from collections import deque
+import logging
 import random
 import warnings
 
+# Most numbers OPS accepts in one published-data request
+OPS_BATCH_SIZE = 100
+
+# Statuses of a bulk request failing because of some of its numbers
+NUMBER_ERROR_STATUSES = (400, 404)
+
 
 class EPOOPS(BasePatentDataSource):
-    def __init__(self, EPOOPS_C_KEY, EPOOPS_SECRET_KEY):
+    def __init__(
+        self, EPOOPS_C_KEY, EPOOPS_SECRET_KEY, workers=4, cache=None
+    ):
         """
         Intialise EPO OPS client
-        Load Dogpile if it exists - if not just use Throttler
+        Without a cache load Dogpile if it exists - if not just use
+        Throttler
+
+        :param workers: concurrent requests made by patentdoc_generator
+        :type workers: int
+        :param cache: response cache, or path of its database file
+        :type cache: ResponseCache or str
         """
-        try:
+        self.key = EPOOPS_C_KEY
+        self.secret = EPOOPS_SECRET_KEY
+        self.workers = workers
+        self._fetcher = None
+        if isinstance(cache, str):
+            cache = ResponseCache(cache)
+        self.cache = cache
+        # Application, Epodoc and WO numbers already looked up
+        self.resolver = NumberResolver()
+        # epo_ops only provides Dogpile if dogpile.cache is installed
+        if cache is None and hasattr(epo_ops.middlewares, 'Dogpile'):
             middlewares = [
                 epo_ops.middlewares.Dogpile(),
                 epo_ops.middlewares.Throttler(),
             ]
-        except:
+        else:
             middlewares = [
                 epo_ops.middlewares.Throttler()
             ]
 
-        self.registered_client = epo_ops.RegisteredClient(
+        self.registered_client = OPSClient(
             key=EPOOPS_C_KEY,
             secret=EPOOPS_SECRET_KEY,
             accept_type='xml',
             middlewares=middlewares)
 
+    def _request(self, endpoint, number, function):
+        """
+        Return response text for endpoint and number, using the cache
+        if there is one.
+
+        :param endpoint: cache key, e.g. "claims" or "register-biblio"
+        :type endpoint: str
+        :param number: number the request is for
+        :type number: str
+        :param function: makes the request and returns its text
+        :type function: callable
+        :return: response data as string
+        """
+        if self.cache is None:
+            return function()
+        return self.cache.fetch(endpoint, number, function)
+
     def _get_text(self, texttype, publication_number):
         """
         Abstract method to get text for both description and claims.
@@ -51,25 +100,27 @@ class EPOOPS(BasePatentDataSource):
             raise TypeError("testtype needs to be 'description' or 'claims'")
 
         try:
-            text = self.registered_client.published_data(
-                reference_type='publication',
-                input=epo_ops.models.Epodoc(publication_number),
-                endpoint=texttype).text
+            text = self._request(
+                texttype, publication_number,
+                lambda: self.registered_client.published_data(
+                    reference_type='publication',
+                    input=epo_ops.models.Epodoc(publication_number),
+                    endpoint=texttype).text
+            )
         except:
             # Try to retrieve claims for corresponding PCT application
             try:
-                # Get publication number of any corresponding PCT appln.
-                register_data = self.registered_client.register(
-                    reference_type='publication',
-                    input=epo_ops.models.Epodoc(publication_number),
-                    constituents=['biblio']).text
-                parsed_data = XMLRegisterData(register_data)
-                wo_publication_no = parsed_data.get_publication_no("WO")
+                wo_publication_no = self.get_wo_publication_no(
+                    publication_number
+                )
                 if wo_publication_no:
-                    text = self.registered_client.published_data(
-                        reference_type='publication',
-                        input=epo_ops.models.Epodoc(wo_publication_no),
-                        endpoint=texttype).text
+                    text = self._request(
+                        texttype, wo_publication_no,
+                        lambda: self.registered_client.published_data(
+                            reference_type='publication',
+                            input=epo_ops.models.Epodoc(wo_publication_no),
+                            endpoint=texttype).text
+                    )
                 else:
                     text = None
             except:
@@ -78,6 +129,31 @@ class EPOOPS(BasePatentDataSource):
             warnings.warn("Error: Not able to retrieve data")
         return text
 
+    def get_wo_publication_no(self, publication_number):
+        """ Get the publication number of any PCT application
+        corresponding to a publication, from the register.
+
+        :param publication_number: publication number including countrycode
+        :type publication_number: str
+        :return: WO publication number as string, or None
+        """
+        def lookup():
+            try:
+                register_data = self._request(
+                    'register-biblio', publication_number,
+                    lambda: self.registered_client.register(
+                        reference_type='publication',
+                        input=epo_ops.models.Epodoc(publication_number),
+                        constituents=['biblio']).text
+                )
+            except Exception as e:
+                # Other errors are raised so they are not remembered
+                if is_not_found(e):
+                    return None
+                raise
+            return XMLRegisterData(register_data).get_publication_no("WO")
+        return self.resolver.get(('WO', publication_number), lookup)
+
     def get_description(
         self, number, numbertype='publication', countrycode=None
     ):
@@ -154,11 +230,14 @@ class EPOOPS(BasePatentDataSource):
         else:
             epodoc_number = epo_ops.models.Epodoc(number)
 
-        biblio_data = self.registered_client.published_data(
+        biblio_data = self._request(
+            'biblio', epodoc_number.number,
+            lambda: self.registered_client.published_data(
                 reference_type='publication',
                 input=epodoc_number,
                 endpoint='biblio'
                 ).text
+        )
         return XMLRegisterData(biblio_data).get_citations()
 
     def get_doc(self, publication_number):
@@ -180,6 +259,13 @@ class EPOOPS(BasePatentDataSource):
 
     def convert_number(self, application_number, countrycode):
         """ Get a Epodoc number for the application. """
+        return self.resolver.get(
+            ('epodoc', countrycode, application_number),
+            lambda: self._convert_number(application_number, countrycode)
+        )
+
+    def _convert_number(self, application_number, countrycode):
+        """ Request the Epodoc number for the application. """
         # Use the convert number with original number
         # reference_type='application'
         appln_no = epo_ops.models.Original(
@@ -187,79 +273,273 @@ class EPOOPS(BasePatentDataSource):
             countrycode
         )
         output_format = 'epodoc'
-        doc_no = self.registered_client.number(
+        doc_no = self._request(
+            'number', countrycode + application_number,
+            lambda: self.registered_client.number(
                 'application',
                 appln_no,
                 output_format
             ).text
+        )
         parsed_doc_no = get_epodoc(doc_no)
         return parsed_doc_no
 
     def get_publication_no(self, application_number, countrycode):
         """ Get publication numbers for an application.
 
+        Results, including applications without a publication, are
+        remembered so repeated calls do not make further requests.
+
         :param application_no: appln. number in original or Epodoc format
         :type application_no: str
         :param countrycode: two letter string with countrycode
         :type countrycode: str
         :return: Epodoc object
         """
+        return self.resolver.get(
+            ('publication', countrycode, application_number),
+            lambda: self._lookup_publication_no(
+                application_number, countrycode
+            )
+        )
+
+    def _lookup_publication_no(self, application_number, countrycode):
+        """ Request the publication number for an application. """
         # Convert number to a publication number
         try:
             # Assume number is passed as Epodoc
-            biblio_data = self.registered_client.published_data(
-                reference_type='application',
-                input=epo_ops.models.Epodoc(application_number),
-                endpoint='biblio'
-                ).text
+            biblio_data = self._request(
+                'application-biblio', application_number,
+                lambda: self.registered_client.published_data(
+                    reference_type='application',
+                    input=epo_ops.models.Epodoc(application_number),
+                    endpoint='biblio'
+                    ).text
+            )
+        except Exception as e:
+            # Other errors are raised so they are not remembered
+            if is_not_found(e):
+                return self._converted_publication_no(
+                    application_number, countrycode
+                )
+            raise
+        return self._publication_epodoc(biblio_data)
 
-            pub_details = extract_pub_no(biblio_data)
-            return epo_ops.models.Epodoc(
-                pub_details['number'],
-                date=pub_details['date']
+    def _converted_publication_no(self, application_number, countrycode):
+        """ Request the publication number for an application after
+        converting the number to Epodoc format. """
+        try:
+            epo_doc_no = self.convert_number(
+                application_number,
+                countrycode
                 )
+            if not epo_doc_no:
+                return None
+            biblio_data = self._request(
+                'application-biblio', epo_doc_no,
+                lambda: self.registered_client.published_data(
+                    reference_type='application',
+                    input=epo_ops.models.Epodoc(epo_doc_no),
+                    endpoint='biblio'
+                    ).text
+            )
         except Exception as e:
-            if "404" in e.args[0]:
-                # Try to convert number to Epodoc first
+            if is_not_found(e):
+                return None
+            raise
+        return self._publication_epodoc(biblio_data)
+
+    def _publication_epodoc(self, biblio_data):
+        """ Return the publication Epodoc object of an application biblio
+        response, or None if the application has no publication. """
+        pub_details = extract_pub_no(biblio_data)
+        if not pub_details:
+            return None
+        return epo_ops.models.Epodoc(
+            pub_details['number'],
+            date=pub_details['date']
+        )
+
+    def get_biblio_many(
+        self, numbers, reference_type='publication',
+        batch_size=OPS_BATCH_SIZE, retries=1
+    ):
+        """ Get bibliographic data for many documents.
+
+        Numbers are requested batch_size at a time and the combined
+        response split back into one XMLRegisterData per document. If a
+        request fails because of a bad or unknown number its batch is
+        split in half and each half requested again, so only the failing
+        members end up missing; they are logged. Other errors, such as
+        throttling or authentication failures, are raised. Numbers
+        absent from a successful response are requested again together,
+        up to retries times.
+
+        :param numbers: Epodoc numbers
+        :type numbers: list of str
+        :param reference_type: "publication" or "application"
+        :type reference_type: str
+        :param batch_size: numbers per request, at most OPS_BATCH_SIZE
+        :type batch_size: int
+        :param retries: times to request again numbers missing from a
+        response
+        :type retries: int
+        :return: dictionary of number to XMLRegisterData or None
+        """
+        endpoint = (
+            'biblio' if reference_type == 'publication'
+            else 'application-biblio'
+        )
+        results = dict()
+        todo = list()
+        for number in dict.fromkeys(numbers):
+            cached = (
+                self.cache.get(endpoint, number) if self.cache else None
+            )
+            if cached:
+                results[number] = XMLRegisterData(cached)
+            else:
+                todo.append(number)
+
+        for attempt in range(retries + 1):
+            missing = list()
+            batches = deque(
+                todo[i:i + batch_size]
+                for i in range(0, len(todo), batch_size)
+            )
+            while batches:
+                batch = batches.popleft()
                 try:
-                    epo_doc_no = self.convert_number(
-                        application_number,
-                        countrycode
-                        )
                     biblio_data = self.registered_client.published_data(
-                        reference_type='application',
-                        input=epo_ops.models.Epodoc(epo_doc_no),
+                        reference_type=reference_type,
+                        input=[epo_ops.models.Epodoc(n) for n in batch],
                         endpoint='biblio'
                         ).text
-
-                    pub_details = extract_pub_no(biblio_data)
-                    return epo_ops.models.Epodoc(
-                        pub_details['number'],
-                        date=pub_details['date']
-                    )
                 except Exception as e:
-                    return None
-            else:
-                return None
+                    if error_status(e) not in NUMBER_ERROR_STATUSES:
+                        raise
+                    if len(batch) > 1:
+                        middle = len(batch) // 2
+                        batches.extend([batch[:middle], batch[middle:]])
+                    else:
+                        logging.warning(
+                            "No {0} data for {1}: {2}".format(
+                                endpoint, batch[0], e
+                            )
+                        )
+                    continue
+                documents = split_exchange_documents(
+                    biblio_data, reference_type
+                )
+                for number in batch:
+                    document = documents.get(epodoc_number(number))
+                    if document is not None:
+                        results[number] = document
+                        if self.cache:
+                            self.cache.set(
+                                endpoint, number, str(document.soup)
+                            )
+                    else:
+                        missing.append(number)
+            todo = missing
+        if todo:
+            logging.warning("No {0} data in responses for {1}".format(
+                endpoint, ", ".join(todo)
+            ))
+        return {number: results.get(number) for number in numbers}
+
+    def get_citations_many(self, publication_numbers):
+        """ Get citations for many publications.
+
+        :param publication_numbers: Epodoc publication numbers
+        :type publication_numbers: list of str
+        :return: dictionary of publication number to list of citations,
+        empty if the publication's data could not be retrieved
+        """
+        return {
+            number: biblio.get_citations() if biblio else []
+            for number, biblio in self.get_biblio_many(
+                publication_numbers
+            ).items()
+        }
+
+    def resolve_many(self, application_numbers, countrycode):
+        """ Get publication numbers for many applications.
+
+        Applications not already resolved are requested with
+        get_biblio_many, assuming Epodoc format. Any not found that way
+        are then looked up one by one, converting the number first.
 
+        :param application_numbers: appln. numbers in original or
+        Epodoc format
+        :type application_numbers: list of str
+        :param countrycode: two letter string with countrycode
+        :type countrycode: str
+        :return: dictionary of application number to Epodoc object or
+        None
+        """
+        def key(number):
+            return ('publication', countrycode, number)
 
+        unresolved = [
+            number for number in application_numbers
+            if not self.resolver.known(key(number))
+        ]
+        biblio = self.get_biblio_many(unresolved, 'application', retries=0)
+        for number, register_data in biblio.items():
+            pub_details = (
+                register_data.get_publication_details()
+                if register_data else None
+            )
+            if pub_details:
+                self.resolver.set(key(number), epo_ops.models.Epodoc(
+                    pub_details['number'],
+                    date=pub_details['date']
+                ))
+            else:
+                self.resolver.get(
+                    key(number),
+                    lambda: self._converted_publication_no(
+                        number, countrycode
+                    )
+                )
+        return {
+            number: self.get_publication_no(number, countrycode)
+            for number in application_numbers
+        }
 
     def get_patentdoc(self, publication_number):
         """ Get PatentDoc object for publication number. """
         return self.get_doc(publication_number).to_patentdoc()
 
+    @property
+    def fetcher(self):
+        """ Concurrent fetcher used to generate documents. """
+        if self._fetcher is None:
+            self._fetcher = ConcurrentFetcher(
+                self.key, self.secret, self.workers, cache=self.cache
+            )
+        return self._fetcher
+
     def patentdoc_generator(self, publication_numbers=None, sample_size=None):
-        """ Get generator for PatentDoc objects. """
-        if not publication_numbers:
-            pass
-            # Need to determine set of valid publication numbers and to iterate
-        else:
-            if sample_size and len(publication_numbers) > sample_size:
-                # Randomly sample down to sample_size
-                publication_numbers = random.sample(
-                    publication_numbers,
-                    sample_size
-                )
+        """ Get generator for PatentDoc objects.
 
-            for publication_number in publication_numbers:
-                yield self.get_patentdoc(publication_number)
+        Description, claims and bibliographic data are requested
+        concurrently, so documents are yielded in the order they are
+        retrieved rather than the order of publication_numbers.
+        """
+        if not publication_numbers:
+            # OPS cannot list every publication
+            warnings.warn(
+                "publication_numbers are needed to generate documents"
+            )
+            return
+        publication_numbers = list(publication_numbers)
+        if sample_size and len(publication_numbers) > sample_size:
+            # Randomly sample down to sample_size
+            publication_numbers = random.sample(
+                publication_numbers,
+                sample_size
+            )
+        for patentdoc in self.fetcher.iter_patentdocs(publication_numbers):
+            yield patentdoc
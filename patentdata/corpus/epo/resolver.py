@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# In-process memo of EPO OPS number conversions
+import threading
+import time
+
+# Seconds before a number that could not be resolved is tried again
+NEGATIVE_TTL = 60 * 60
+
+
+def error_status(error):
+    """ Return the HTTP status code of a failed OPS request, or None if
+    there was no response. """
+    response = getattr(error, 'response', None)
+    return None if response is None else response.status_code
+
+
+def is_not_found(error):
+    """ Check if a request failed because OPS has no such document. """
+    return error_status(error) == 404
+
+
+class NumberResolver:
+    """ Remember the results of number lookups, such as application to
+    publication number, so each is only requested once.
+
+    Lookups that find nothing are remembered for negative_ttl seconds,
+    so unknown numbers do not cost a request on every call either.
+    """
+
+    def __init__(self, negative_ttl=NEGATIVE_TTL):
+        """ Initialise resolver.
+
+        :param negative_ttl: seconds to remember failed lookups; None
+        remembers them for the life of the resolver
+        :type negative_ttl: int
+        :return: None
+        """
+        self.negative_ttl = negative_ttl
+        self.results = dict()
+        self.failures = dict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def known(self, key):
+        """ Check if a result, or a recent failure, is held for key. """
+        with self.lock:
+            return self._known(key)
+
+    def _known(self, key):
+        if key in self.results:
+            return True
+        failed = self.failures.get(key)
+        if failed is None:
+            return False
+        if (
+            self.negative_ttl is not None and
+            time.monotonic() - failed > self.negative_ttl
+        ):
+            del self.failures[key]
+            return False
+        return True
+
+    def get(self, key, function):
+        """ Return the result for key, calling function to look it up
+        if it is not known. function returns None if nothing is found.
+        Exceptions raised by function are not remembered.
+        """
+        with self.lock:
+            if self._known(key):
+                self.hits += 1
+                return self.results.get(key)
+            self.misses += 1
+        value = function()
+        self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        """ Store a lookup result; None records a failed lookup. """
+        with self.lock:
+            if value is None:
+                self.results.pop(key, None)
+                self.failures[key] = time.monotonic()
+            else:
+                self.failures.pop(key, None)
+                self.results[key] = value
+
+    def clear(self):
+        """ Forget all results. """
+        with self.lock:
+            self.results.clear()
+            self.failures.clear()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Run many EPO OPS bibliographic searches with paging and checkpoints
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import patentdata.utils as utils
+from patentdata.corpus.epo.resolver import is_not_found
+
+# Most results OPS returns per search request
+SEARCH_PAGE_SIZE = 100
+
+# OPS does not return results beyond this position
+SEARCH_MAX_RESULTS = 2000
+
+
+def parse_search_page(results_json):
+    """ Extract the total result count and publication numbers from a
+    JSON search response.
+
+    :return: (total results as int, list of publication numbers)
+    """
+    search = results_json['ops:world-patent-data']['ops:biblio-search']
+    total_results = int(utils.safeget(search, '@total-result-count') or 0)
+    number_objects = utils.safeget(
+        search, 'ops:search-result', 'ops:publication-reference'
+    )
+    numbers = list()
+    if number_objects:
+        numbers = [
+            utils.safeget(result, 'document-id', 'country', '$') +
+            utils.safeget(result, 'document-id', 'doc-number', '$')
+            for result in utils.check_list(number_objects)
+        ]
+    return total_results, numbers
+
+
+class SearchRunner:
+    """ Run OPS searches concurrently, writing each result as a line of
+    JSON as soon as it completes.
+
+    Searches are paged through to their full result count (up to the
+    OPS limit of SEARCH_MAX_RESULTS). The key of each completed search
+    is appended to a checkpoint file, so a rerun after an interruption
+    skips searches that are already written.
+    """
+
+    def __init__(
+        self, fetcher, output, checkpoint=None, workers=4,
+        page_size=SEARCH_PAGE_SIZE, max_results=SEARCH_MAX_RESULTS
+    ):
+        """ Initialise runner.
+
+        :param fetcher: makes rate limited requests; its clients should
+        accept JSON
+        :type fetcher: ConcurrentFetcher
+        :param output: JSON lines file results are appended to
+        :type output: str
+        :param checkpoint: file of completed search keys, by default
+        output with ".done" appended
+        :type checkpoint: str
+        :param workers: searches run at once
+        :type workers: int
+        :return: None
+        """
+        self.fetcher = fetcher
+        self.output = output
+        self.checkpoint = checkpoint or output + ".done"
+        self.workers = workers
+        self.page_size = page_size
+        self.max_results = max_results
+
+    def completed(self):
+        """ Return the set of search keys already written. """
+        if not os.path.exists(self.checkpoint):
+            return set()
+        with open(self.checkpoint, encoding="utf8") as f:
+            return set(json.loads(line) for line in f if line.strip())
+
+    def search(self, cql):
+        """ Return all results for a search.
+
+        OPS answers a search without results with a 404, giving
+        total_results of 0. A first page without search results raises
+        KeyError; an unexpected later page raises ValueError so the
+        search is not recorded as empty.
+
+        :param cql: OPS search string
+        :type cql: str
+        :return: dictionary of total_results, numbers and the raw_data
+        of each page
+        """
+        numbers = list()
+        pages = list()
+        begin = 1
+        total_results = None
+        while total_results is None or begin <= min(
+            total_results, self.max_results
+        ):
+            end = begin + self.page_size - 1
+            try:
+                response = self.fetcher.request(
+                    'search', 'published_data_search', cql,
+                    range_begin=begin, range_end=end
+                )
+            except Exception as e:
+                if not is_not_found(e):
+                    raise
+                # No results, or none beyond those already retrieved
+                if total_results is None:
+                    total_results = 0
+                break
+            results_json = response.json()
+            try:
+                total_results, page_numbers = parse_search_page(
+                    results_json
+                )
+            except KeyError:
+                if not pages:
+                    raise
+                raise ValueError(
+                    "No search results in page from {0} for {1}".format(
+                        begin, cql
+                    )
+                )
+            pages.append(results_json)
+            numbers.extend(page_numbers)
+            if not page_numbers:
+                break
+            begin = end + 1
+        return {
+            "total_results": total_results,
+            "numbers": numbers,
+            "raw_data": pages
+        }
+
+    def _search_record(self, key, cql, fields):
+        """ Run a search and return its record for the output. """
+        try:
+            results = self.search(cql)
+        except KeyError:
+            # Response without search results
+            results = {"total_results": "", "numbers": "", "raw_data": None}
+        record = dict(fields)
+        record.update(results)
+        return key, record
+
+    def run(self, queries):
+        """ Run searches not already completed.
+
+        :param queries: (key, cql, fields) tuples, where key identifies
+        the search in the checkpoint and fields are added to its record
+        :type queries: iterable of tuples
+        :return: number of searches written
+        """
+        done = self.completed()
+        pending = [query for query in queries if query[0] not in done]
+        written = 0
+        with ThreadPoolExecutor(self.workers) as pool, \
+                open(self.output, 'a', encoding="utf8") as output, \
+                open(self.checkpoint, 'a', encoding="utf8") as checkpoint:
+            futures = {
+                pool.submit(self._search_record, *query): query[0]
+                for query in pending
+            }
+            for future in as_completed(futures):
+                try:
+                    key, record = future.result()
+                except Exception:
+                    # Not checkpointed, so retried on the next run
+                    logging.exception(
+                        "Search failed: {0}".format(futures[future])
+                    )
+                    continue
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+                checkpoint.write(json.dumps(key) + "\n")
+                checkpoint.flush()
+                written += 1
+                logging.info("Total results for {0}: {1}".format(
+                    key, record["total_results"]
+                ))
+        return written
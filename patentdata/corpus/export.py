@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# Export document metadata and text from a local data source
+import datetime
+import json
+import logging
+import os
+import uuid
+
+import patentdata.utils as utils
+from patentdata.corpus.textindex import CLASS_FIELDS
+from patentdata.xmlparser import XMLDoc
+
+# Fields of each exported record, in order
+RECORD_FIELDS = [
+    'pub_no', 'date', 'year', 'kind', 'title', 'abstract'
+] + CLASS_FIELDS + [
+    'claim_count', 'paragraph_count', 'claims', 'description'
+]
+
+# Fields dropped when exporting metadata only
+TEXT_FIELDS = ['abstract', 'claims', 'description']
+
+# Columns used to partition datasets, as year=2006/section=A/
+PARTITION_FIELDS = ['year', 'section']
+
+# pyarrow dataset format names and file extensions
+DATASET_FORMATS = {
+    'parquet': ('parquet', 'parquet'),
+    'arrow': ('ipc', 'arrow')
+}
+
+
+def document_record(item):
+    """ Parse (pub_no, filedata) into a dictionary of RECORD_FIELDS,
+    or None if the XML cannot be parsed.
+
+    Module level so it can be run in worker processes.
+    """
+    pub_no, filedata = item
+    try:
+        xmldoc = XMLDoc(filedata)
+        details = xmldoc.publication_details() or {}
+        classifications = xmldoc.classifications()
+        classification = (
+            classifications[0] if classifications else [None] * 5
+        )
+        paragraphs = xmldoc.paragraph_list()
+        date = details.get('date')
+        record = {
+            'pub_no': pub_no,
+            'date': date.date().isoformat() if date else None,
+            'year': date.year if date else None,
+            'kind': details.get('kind'),
+            'title': xmldoc.title(),
+            'abstract': xmldoc.abstract(),
+            'claim_count': len(xmldoc.claim_list()),
+            'paragraph_count': len(paragraphs),
+            'claims': xmldoc.claim_text(),
+            'description': "\n".join(p['text'] for p in paragraphs)
+        }
+        record.update(zip(CLASS_FIELDS, classification))
+        return record
+    except Exception:
+        logging.exception("Exception exporting: {0}".format(pub_no))
+        return None
+
+
+def export_records(
+    datasource, processes=None, batch_size=100, progress=None, skip=None,
+    **filters
+):
+    """ Generator of document records from a local data source, parsed
+    across a pool of worker processes.
+
+    :param datasource: e.g. USPublications
+    :type datasource: LocalDataSource
+    :param processes: number of worker processes, None for all CPUs
+    :type processes: int
+    :param progress: reporter updated as documents are parsed
+    :type progress: utils.ProgressReporter
+    :param skip: publication numbers not to export
+    :type skip: set
+    :param filters: classification, publication_numbers and sample_size
+    :return: generator of dictionaries
+    """
+    filedata_iter = datasource.iter_filedata(skip=skip, **filters)
+    results = utils.parallel_map(
+        document_record, filedata_iter, processes, max(1, batch_size // 10)
+    )
+    for record in results:
+        if progress:
+            progress.update()
+        if record is not None:
+            yield record
+
+
+def export_jsonl(
+    datasource, output, text=True, processes=None, batch_size=100,
+    progress=None, **filters
+):
+    """ Write one JSON object per document to output.
+
+    :param output: path of the file to write
+    :type output: str
+    :param text: include abstract, claims and description text
+    :type text: bool
+    :return: number of documents written
+    """
+    written = 0
+    with open(output, 'w', encoding='utf-8') as f:
+        for record in export_records(
+            datasource, processes, batch_size, progress, **filters
+        ):
+            if not text:
+                for field in TEXT_FIELDS:
+                    record.pop(field)
+            f.write(json.dumps(record) + "\n")
+            written += 1
+    return written
+
+
+def import_pyarrow():
+    """ Import pyarrow, which is only needed for dataset exports. """
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError(
+            "pyarrow is required to export Parquet or Arrow datasets: "
+            "pip install patentdata[parquet]"
+        )
+    return pyarrow
+
+
+def record_schema(text=True):
+    """ Return the Arrow schema for exported records.
+
+    :param text: include abstract, claims and description columns
+    :type text: bool
+    """
+    pa = import_pyarrow()
+    types = {
+        'date': pa.date32(),
+        'year': pa.int32(),
+        'claim_count': pa.int32(),
+        'paragraph_count': pa.int32()
+    }
+    return pa.schema([
+        (field, types.get(field, pa.string())) for field in RECORD_FIELDS
+        if text or field not in TEXT_FIELDS
+    ])
+
+
+def exported_pub_nos(output, dataset_format='parquet'):
+    """ Return the set of publication numbers already in the dataset at
+    output. """
+    pa = import_pyarrow()
+    if not os.path.isdir(output) or not os.listdir(output):
+        return set()
+    dataset = pa.dataset.dataset(
+        output, format=DATASET_FORMATS[dataset_format][0],
+        partitioning='hive'
+    )
+    return set(dataset.to_table(columns=['pub_no']).column(0).to_pylist())
+
+
+def export_dataset(
+    datasource, output, dataset_format='parquet', text=True,
+    processes=None, batch_size=1000, progress=None, **filters
+):
+    """
+    Write document records as a Parquet or Arrow IPC dataset in
+    directory output, partitioned by year and section.
+
+    Publications already in the dataset are not read again, so later
+    runs only add new documents. Each run writes new files alongside
+    the existing ones, so use the same text setting for every run.
+
+    :param output: dataset directory
+    :type output: str
+    :param dataset_format: 'parquet' or 'arrow'
+    :type dataset_format: str
+    :param text: include abstract, claims and description text
+    :type text: bool
+    :param batch_size: records held in memory per written batch
+    :type batch_size: int
+    :return: number of documents written
+    """
+    if dataset_format not in DATASET_FORMATS:
+        raise ValueError(
+            "dataset_format should be one of: {0}".format(
+                ", ".join(sorted(DATASET_FORMATS))
+            )
+        )
+    pa = import_pyarrow()
+    file_format, extension = DATASET_FORMATS[dataset_format]
+    schema = record_schema(text)
+    skip = exported_pub_nos(output, dataset_format)
+    run = uuid.uuid4().hex[:8]
+    written = 0
+    batch = list()
+
+    def write(batch, number):
+        table = pa.Table.from_pylist(batch, schema=schema)
+        pa.dataset.write_dataset(
+            table, output, format=file_format,
+            partitioning=PARTITION_FIELDS, partitioning_flavor='hive',
+            basename_template='part-{0}-{1}-{{i}}.{2}'.format(
+                run, number, extension
+            ),
+            existing_data_behavior='overwrite_or_ignore'
+        )
+
+    for record in export_records(
+        datasource, processes, batch_size, progress, skip, **filters
+    ):
+        if record['date']:
+            record['date'] = datetime.date.fromisoformat(record['date'])
+        if not text:
+            for field in TEXT_FIELDS:
+                record.pop(field)
+        batch.append(record)
+        if len(batch) >= batch_size:
+            write(batch, written)
+            written += len(batch)
+            batch = list()
+    if batch:
+        write(batch, written)
+        written += len(batch)
+    return written
+
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Split indexing of archives across machines and merge the results
+import glob
+import os
+import sqlite3
+import zlib
+
+from patentdata.corpus.textindex import TextIndex
+
+INDEX_DB = 'fileindexes.db'
+
+# Indexes created on the merged files table
+FILES_INDEXES = {
+    'files_filename': 'filename',
+    'files_classification': 'section, class, subclass, maingroup, subgroup',
+    'files_year': 'year'
+}
+
+
+def parse_shard(spec):
+    """ Parse a shard spec such as "3/8" (the third of eight shards).
+
+    :param spec: "k/n" string, (k, n) tuple or None
+    :return: (k, n) tuple of ints, or None if spec is None
+    """
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        try:
+            k, n = [int(part) for part in spec.split('/')]
+        except ValueError:
+            raise ValueError(
+                "Shard should be of the form k/n, e.g. 3/8: {0}".format(spec)
+            )
+    else:
+        k, n = spec
+    if n < 1 or not 1 <= k <= n:
+        raise ValueError("Shard {0}/{1} is out of range".format(k, n))
+    return k, n
+
+
+def shard_db_name(shard):
+    """ Return the index database filename for a shard. """
+    if shard is None:
+        return INDEX_DB
+    k, n = shard
+    return 'fileindexes.shard-{0}-of-{1}.db'.format(k, n)
+
+
+def in_shard(filename, shard):
+    """ Check if an archive belongs to a shard.
+
+    Archives are assigned by a hash of their path relative to the data
+    directory, so every machine agrees without coordination.
+    """
+    if shard is None:
+        return True
+    k, n = shard
+    key = filename.replace(os.sep, '/').encode('utf-8')
+    return zlib.crc32(key) % n == k - 1
+
+
+def shard_files(path):
+    """ Return shard database paths found in path. """
+    return sorted(glob.glob(os.path.join(path, 'fileindexes.shard-*.db')))
+
+
+def table_columns(conn, table, schema='main'):
+    """ Return column names of a table, or an empty list if it does not
+    exist. """
+    return [
+        row[1] for row in conn.execute(
+            'PRAGMA {0}.table_info({1})'.format(schema, table)
+        ).fetchall()
+    ]
+
+
+def merge_shards(path, shards=None, output=INDEX_DB):
+    """
+    Merge per-shard index databases into the canonical index.
+
+    Rows of each shard's files table are added to the output files
+    table, keeping the first row seen for a pub_no. Full text index
+    entries are merged the same way. Indexes are then rebuilt and
+    statistics refreshed.
+
+    :param path: data directory holding the shard databases
+    :type path: str
+    :param shards: shard database paths; defaults to all in path
+    :type shards: list of str
+    :param output: filename of the merged database in path
+    :type output: str
+    :return: number of files rows added
+    """
+    if shards is None:
+        shards = shard_files(path)
+    conn = sqlite3.connect(os.path.join(path, output))
+    added = 0
+    try:
+        for shard in shards:
+            conn.execute('ATTACH DATABASE ? AS shard', (shard,))
+            try:
+                added += merge_shard(conn)
+                conn.commit()
+            finally:
+                conn.execute('DETACH DATABASE shard')
+        if table_columns(conn, 'files'):
+            for name, columns in FILES_INDEXES.items():
+                conn.execute(
+                    'CREATE INDEX IF NOT EXISTS {0} ON files ({1})'.format(
+                        name, columns
+                    )
+                )
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+    return added
+
+
+def merge_shard(conn, schema='shard'):
+    """ Copy rows from an attached shard database. Does not commit.
+
+    :return: number of files rows added
+    """
+    shard_columns = table_columns(conn, 'files', schema)
+    if not shard_columns:
+        return 0
+    if not table_columns(conn, 'files'):
+        # Create the files table with the same definition as the shard
+        create_sql = conn.execute(
+            "SELECT sql FROM {0}.sqlite_master "
+            "WHERE type = 'table' AND name = 'files'".format(schema)
+        ).fetchone()[0]
+        conn.execute(create_sql)
+    main_columns = table_columns(conn, 'files')
+    columns = ", ".join(c for c in shard_columns if c in main_columns)
+    before = conn.total_changes
+    conn.execute(
+        'INSERT OR IGNORE INTO files ({0}) '
+        'SELECT {0} FROM {1}.files'.format(columns, schema)
+    )
+    added = conn.total_changes - before
+
+    # Full text index tables, if the shard built them
+    for table, fts_columns in [
+        ('units', 'pub_no, unit_type, number, text'),
+        ('documents', 'pub_no, title, abstract, claims, description')
+    ]:
+        if not table_columns(conn, table + '_indexed', schema):
+            continue
+        TextIndex(conn)
+        conn.execute((
+            'INSERT INTO {0} ({1}) SELECT {1} FROM {2}.{0} '
+            'WHERE pub_no NOT IN (SELECT pub_no FROM main.{0}_indexed)'
+        ).format(table, fts_columns, schema))
+        conn.execute(
+            'INSERT OR IGNORE INTO {0}_indexed (pub_no) '
+            'SELECT pub_no FROM {1}.{0}_indexed'.format(table, schema)
+        )
+    return added
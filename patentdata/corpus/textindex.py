@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# Full text indexes stored as SQLite FTS5 tables in fileindexes.db
+from multiprocessing import Pool
+
+from patentdata.xmlparser import XMLDoc
+
+# Column names for classification filtering in the files table
+CLASS_FIELDS = ['section', 'class', 'subclass', 'maingroup', 'subgroup']
+
+# BM25 weights for pub_no, title, abstract, claims, description
+SEARCH_WEIGHTS = (0.0, 10.0, 5.0, 2.0, 1.0)
+
+
+def fts_phrase(term):
+    """ Quote term as an FTS5 phrase so punctuation is not read as
+    query syntax. """
+    return '"{0}"'.format(term.replace('"', '""'))
+
+
+def classification_clause(classification):
+    """ Build a parameterised filter on the files table for a
+    classification of the form ["G", "06"].
+
+    :return: (clause, params) tuple; clause is empty if no filter
+    """
+    clauses, params = list(), list()
+    for field, value in zip(CLASS_FIELDS, classification or []):
+        if not value:
+            break
+        clauses.append("files.{0} = ?".format(field))
+        params.append(value)
+    return " AND ".join(clauses), params
+
+
+def document_fields(item):
+    """ Parse (key, filedata) into (key, title, abstract, claims,
+    description) for the documents table.
+
+    Module level so it can be run in worker processes.
+    """
+    key, filedata = item
+    if not filedata:
+        return key, None
+    try:
+        xmldoc = XMLDoc(filedata)
+        return key, (
+            xmldoc.title() or "",
+            xmldoc.abstract() or "",
+            xmldoc.claim_text(),
+            "\n".join(p['text'] for p in xmldoc.paragraph_list())
+        )
+    except Exception:
+        return key, None
+
+
+class TextIndex:
+    """ Inverted index of claims and paragraphs across a corpus.
+
+    Each claim and description paragraph of an added PatentDoc is
+    stored as a row in an FTS5 table so that "which documents / claims
+    mention X" is an index lookup rather than a parse of every file.
+    """
+
+    def __init__(self, conn):
+        """ Create index tables if they don't exist.
+
+        :param conn: open connection, e.g. USPublications.conn
+        :type conn: sqlite3.Connection
+        :return: None
+        """
+        self.conn = conn
+        self.c = conn.cursor()
+        self.c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS units USING fts5
+                (
+                    pub_no UNINDEXED,
+                    unit_type UNINDEXED,
+                    number UNINDEXED,
+                    text
+                )
+                ''')
+        self.c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS documents USING fts5
+                (
+                    pub_no UNINDEXED,
+                    title,
+                    abstract,
+                    claims,
+                    description
+                )
+                ''')
+        # FTS5 UNINDEXED columns cannot be looked up efficiently
+        # so keep a record of the documents already added
+        for table in ['units_indexed', 'documents_indexed']:
+            self.c.execute('''
+                CREATE TABLE IF NOT EXISTS {0}
+                    (
+                        pub_no TEXT PRIMARY KEY
+                    )
+                    '''.format(table))
+        self.conn.commit()
+
+    def __contains__(self, pub_no):
+        self.c.execute(
+            'SELECT 1 FROM units_indexed WHERE pub_no=?', (pub_no,)
+        )
+        return self.c.fetchone() is not None
+
+    def add_patentdoc(self, patentdoc, commit=True):
+        """ Add claims and paragraphs of a PatentDoc to the index.
+
+        Documents that are already indexed are skipped.
+
+        :return: True if the document was added
+        """
+        pub_no = patentdoc.number
+        if not pub_no or pub_no in self:
+            return False
+        rows = list()
+        if patentdoc.claimset is not None:
+            rows += [
+                (pub_no, 'claim', claim.number, claim.text)
+                for claim in patentdoc.claimset.units
+            ]
+        if patentdoc.description is not None:
+            rows += [
+                (pub_no, 'paragraph', para.number, para.text)
+                for para in patentdoc.description.units
+            ]
+        self.c.executemany(
+            'INSERT INTO units (pub_no, unit_type, number, text) '
+            'VALUES (?,?,?,?)',
+            rows
+        )
+        self.c.execute(
+            'INSERT INTO units_indexed (pub_no) VALUES (?)', (pub_no,)
+        )
+        if commit:
+            self.conn.commit()
+        return True
+
+    def add_patentdocs(self, patentdocs, batch_size=100):
+        """ Add an iterable of PatentDoc objects, e.g. the output of
+        patentdoc_generator(), committing every batch_size documents.
+
+        :return: number of documents added
+        """
+        added = 0
+        for patentdoc in patentdocs:
+            if patentdoc and self.add_patentdoc(patentdoc, commit=False):
+                added += 1
+                if added % batch_size == 0:
+                    self.conn.commit()
+        self.conn.commit()
+        return added
+
+    def units_with(self, term, unit_type=None):
+        """ Return (pub_no, unit_type, number) for each claim or
+        paragraph containing term.
+
+        :param term: word or phrase to look up
+        :type term: str
+        :param unit_type: 'claim' or 'paragraph' to limit results
+        :type unit_type: str
+        :return: list of tuples
+        """
+        query_string = (
+            'SELECT pub_no, unit_type, number FROM units '
+            'WHERE units MATCH ?'
+        )
+        params = [fts_phrase(term)]
+        if unit_type:
+            query_string += ' AND unit_type = ?'
+            params.append(unit_type)
+        return self.c.execute(query_string, params).fetchall()
+
+    def documents_with(self, term, unit_type=None):
+        """ Return sorted publication numbers of documents where term
+        appears in a claim or paragraph. """
+        return sorted(set(
+            pub_no for pub_no, _, _ in self.units_with(term, unit_type)
+        ))
+
+    def add_document(self, pub_no, fields):
+        """ Add (title, abstract, claims, description) fields for a
+        publication to the documents table. Does not commit. """
+        self.c.execute(
+            'INSERT OR IGNORE INTO documents_indexed (pub_no) VALUES (?)',
+            (pub_no,)
+        )
+        # Only insert text the first time pub_no is seen
+        if self.c.rowcount:
+            self.c.execute(
+                'INSERT INTO documents '
+                '(pub_no, title, abstract, claims, description) '
+                'VALUES (?,?,?,?,?)',
+                [pub_no] + list(fields)
+            )
+
+    def build(self, filedata_iter, processes=None, batch_size=100):
+        """ Populate the documents table from (pub_no, filedata) pairs,
+        parsing XML across a pool of worker processes.
+
+        Progress is committed every batch_size documents so an
+        interrupted build can be restarted; callers should only pass
+        publications not yet in documents_indexed. Documents that cannot
+        be parsed are recorded there too, so they are not parsed again.
+
+        :param filedata_iter: iterable of (pub_no, filedata) tuples
+        :param processes: number of worker processes; 1 parses in
+        this process, None uses all CPUs
+        :type processes: int
+        :return: number of documents added
+        """
+        added = 0
+        if processes == 1:
+            pool = None
+            results = map(document_fields, filedata_iter)
+        else:
+            pool = Pool(processes)
+            chunksize = max(1, batch_size // 10)
+            results = pool.imap(document_fields, filedata_iter, chunksize)
+        try:
+            for processed, (pub_no, fields) in enumerate(results, 1):
+                if fields is None:
+                    self.c.execute(
+                        'INSERT OR IGNORE INTO documents_indexed (pub_no) '
+                        'VALUES (?)',
+                        (pub_no,)
+                    )
+                else:
+                    self.add_document(pub_no, fields)
+                    added += 1
+                if processed % batch_size == 0:
+                    self.conn.commit()
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+        self.conn.commit()
+        return added
+
+    def search(self, query, limit=10, classification=None):
+        """ Search titles, abstracts, claims and descriptions.
+
+        :param query: FTS5 query string, e.g. 'siderail AND bed'
+        :type query: str
+        :param limit: maximum number of results
+        :type limit: int
+        :param classification: optional filter of form ["G", "06"]
+        :type classification: list
+        :return: list of publication numbers, best match first
+        """
+        join, where = '', ''
+        clause, params = classification_clause(classification)
+        if clause:
+            join = 'JOIN files ON files.pub_no = documents.pub_no'
+            where = 'AND ' + clause
+        query_string = (
+            'SELECT documents.pub_no FROM documents {0} '
+            'WHERE documents MATCH ? {1} '
+            'ORDER BY bm25(documents, {2}) LIMIT ?'
+        ).format(join, where, ", ".join(str(w) for w in SEARCH_WEIGHTS))
+        return [
+            row[0] for row in self.c.execute(
+                query_string, [query] + params + [limit]
+            ).fetchall()
+        ]
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 
+from patentdata.corpus import shards
 from patentdata.corpus.baseclasses import LocalDataSource
 import patentdata.utils as utils
 from patentdata.xmlparser import XMLDoc
 
 import zipfile
 import os
+from contextlib import closing
 import sqlite3
 
 
@@ -69,14 +71,54 @@ def get_xml_by_line_offset(zip_file, start_offset):
         return b''.join(data_buffer)
 
 
+def grant_record(item):
+    """ Return (row, size) for the files table from a (filename,
+    start_offset, filedata) tuple; row is None for documents without
+    publication details.
+
+    Module level so it can be run in worker processes.
+    """
+    filename, sl, filedata = item
+    xml_doc = XMLDoc(filedata)
+    # Use XMLDoc publication_details() to get
+    # publication number and other details
+    # May as well get classifications here as well
+    # May need to skip D, P and RE publications
+    pub_details = xml_doc.publication_details()
+    if not pub_details:
+        return None, len(filedata)
+    classifications = xml_doc.classifications()
+    data = [
+                pub_details['full_number'],
+                'US',
+                pub_details['date'].year,
+                pub_details['short_number'],
+                pub_details['kind'],
+                filename,
+                sl
+            ]
+    if classifications:
+        data += classifications[0]
+    else:
+        data += [None, None, None, None, None]
+    return data, len(filedata)
+
+
 class USGrants(LocalDataSource):
     """ Model for US granted patent data. """
 
-    def __init__(self, path):
-        """ Object initialisation. """
+    def __init__(self, path, shard=None):
+        """ Object initialisation.
+
+        :param shard: "k/n" to index only the k-th of n shards of the
+        archives into fileindexes.shard-k-of-n.db; merge the shards
+        with patentdata.corpus.shards.merge_shards
+        :type shard: str
+        """
 
         self.exten = (".zip", ".tar")
         self.path = path
+        self.shard = shards.parse_shard(shard)
         if not os.path.isdir(path):
             print("Invalid path")
             # Raise custom exception here
@@ -84,8 +126,12 @@ class USGrants(LocalDataSource):
         self.first_level_files = utils.get_files(self.path, self.exten)
 
         # Connect to DB to store file data
-        self.conn = sqlite3.connect(os.path.join(self.path, 'fileindexes.db'))
-        self.c = self.conn.cursor()
+        # Generators may be run in a prefetching thread, so each thread
+        # uses its own cursor from self.c
+        self.conn = sqlite3.connect(
+            os.path.join(self.path, shards.shard_db_name(self.shard)),
+            check_same_thread=False
+        )
         # Create indexes table if it doesn't exist
         self.c.execute('''
             CREATE TABLE IF NOT EXISTS files
@@ -128,8 +174,31 @@ class USGrants(LocalDataSource):
                 ) as z:
             return XMLDoc(get_xml_by_line_offset(z, offset))
 
-    def index(self):
-        """ Generate metadata for individual publications. """
+    def read_archive_data(self, filename):
+        """ Generator of (filename, start_offset, filedata) for each
+        document in a large XML file in a Zip. """
+        with zipfile.ZipFile(
+                    os.path.join(self.path, filename), 'r'
+                ) as z:
+            for sl, el, filedata in separated_xml_with_lines(z):
+                yield filename, sl, filedata
+
+    def index(
+        self, full_text=False, progress=None, batch_size=1000, processes=None
+    ):
+        """ Generate metadata for individual publications.
+
+        If full_text is true also build the full text index used by
+        search().
+
+        :param progress: reporter updated for each archive
+        :type progress: utils.ProgressReporter
+        :param batch_size: rows stored per transaction
+        :type batch_size: int
+        :param processes: number of worker processes parsing XML;
+        None uses all CPUs
+        :type processes: int
+        """
 
         print("Getting archive file list - may take a while!\n")
         # set query string for later
@@ -147,47 +216,154 @@ class USGrants(LocalDataSource):
             filtered_files = [
                 f for f in self.first_level_files
                 if subdirectory in os.path.split(f) and "SUPP" not in f
+                and shards.in_shard(f, self.shard)
             ]
             for filename in filtered_files:
-                print("Processing file: {0}".format(filename))
+                if progress:
+                    progress.start(filename)
+                else:
+                    print("Processing file: {0}".format(filename))
                 params = []
-                i = 0
-                for sl, el, xml_doc in self.read_archive_file(filename):
-                    # Use XMLDoc publication_details() to get
-                    # publication number and other details
-                    # May as well get classifications here as well
-                    # May need to skip D, P and RE publications
-                    pub_details = xml_doc.publication_details()
-                    classifications = xml_doc.classifications()
-                    if pub_details:
-                        data = [
-                                    pub_details['full_number'],
-                                    'US',
-                                    pub_details['date'].year,
-                                    pub_details['short_number'],
-                                    pub_details['kind'],
-                                    filename,
-                                    sl
-                                ]
-                        if classifications:
-                            data += classifications[0]
-                        else:
-                            data += [None, None, None, None, None]
-                        params.append(data)
-
-                    if (len(params) % 1000) == 0:
-                        i += 1000
-                        self.c.executemany(query_string, params)
-                        self.conn.commit()
+                # Decompress in a background thread and parse in workers
+                with closing(utils.ReadAhead(
+                    self.read_archive_data(filename),
+                    sizeof=lambda item: len(item[2])
+                )) as reader:
+                    records = utils.parallel_map(
+                        grant_record, reader, processes,
+                        max(1, batch_size // 100)
+                    )
+                    for data, nbytes in records:
+                        if progress:
+                            progress.update(1, nbytes)
+                        if data:
+                            params.append(data)
+
+                        if len(params) >= batch_size:
+                            self.c.executemany(query_string, params)
+                            self.conn.commit()
+                            params = []
+                if params:
+                    self.c.executemany(query_string, params)
+                    self.conn.commit()
+                if progress:
+                    progress.finish()
+        if full_text:
+            self.index_text(processes, batch_size)
+
+    def iter_read(
+        self, filelist, depth=8, max_bytes=utils.READ_AHEAD_BYTES
+    ):
+        """ Read file data for a set of publications in filelist with
+        (id, filename, start_offset) entries.
+
+        Each archive is read once, in order, in a background thread so
+        decompression overlaps with work on earlier documents. Returns
+        a ReadAhead iterator of id, filedata tuples, or a generator if
+        depth is 0. """
+        if not depth:
+            return self._read_files(filelist)
+        return utils.ReadAhead(
+            self._read_files(filelist), depth, max_bytes,
+            utils.filedata_size
+        )
+
+    def _read_files(self, filelist):
+        """ Generator of (id, filedata) for entries in filelist. """
+        filename_groups = dict()
+        for pub_id, filename, start_offset in filelist:
+            filename_groups.setdefault(filename, dict())[start_offset] = pub_id
+        for filename, offsets in filename_groups.items():
+            with zipfile.ZipFile(
+                        os.path.join(self.path, filename), 'r'
+                    ) as z:
+                for sl, el, filedata in separated_xml_with_lines(z):
+                    if sl in offsets:
+                        yield offsets[sl], filedata
+
+    def index_text(self, processes=None, batch_size=100):
+        """ Add publications to the full text index used by search().
+
+        Publications already in the index are skipped so indexing can
+        be interrupted and restarted.
+
+        :param processes: number of worker processes, None for all CPUs
+        :type processes: int
+        :param batch_size: documents per committed transaction
+        :type batch_size: int
+        :return: number of documents added
+        """
+        text_index = self.text_index
+        records = self.c.execute(
+            "SELECT pub_no, filename, start_offset FROM files "
+            "WHERE pub_no NOT IN (SELECT pub_no FROM documents_indexed)"
+        ).fetchall()
+        with closing(self.iter_read(records)) as reader:
+            return text_index.build(reader, processes, batch_size)
+
+    def get_records(
+        self, classification=None, publication_numbers=None, sample_size=None
+    ):
+        """ Return (pub_no, filename, start_offset) records for
+        publications matching a classification of form ["G", "06"] or
+        in publication_numbers, randomly sampled down to sample_size. """
+        return self.select_files(
+            "pub_no, filename, start_offset",
+            classification, publication_numbers, sample_size
+        )
+
+    def iter_filedata(
+        self, classification=None, publication_numbers=None,
+        sample_size=None, skip=None
+    ):
+        """ Generator of (pub_no, filedata) tuples, skipping publication
+        numbers in skip. """
+        skip = skip or set()
+        records = [
+            record for record in self.get_records(
+                classification, publication_numbers, sample_size
+            )
+            if record[0] not in skip
+        ]
+        with closing(self.iter_read(records)) as filereader:
+            for pub_no, filedata in filereader:
+                yield pub_no, filedata
 
     def get_patentdoc(self, publication_number):
         """ Return a Patent Doc object corresponding
         to a publication number. """
-        pass
+        result = self.conn.execute(
+            'SELECT filename, start_offset FROM files WHERE pub_no=?',
+            (publication_number,)
+        ).fetchone()
+        if result:
+            return self.read_by_offset(*result).to_patentdoc()
+        return None
+
+    def xmldoc_generator(
+        self, classification=None, publication_numbers=None, sample_size=None
+    ):
+        """ Generator to return XML Doc objects, limited to a
+        classification of form ["G", "06"] or to publication_numbers
+        and randomly sampled down to sample_size. Each archive is
+        read once. """
+        records = self.get_records(
+            classification, publication_numbers, sample_size
+        )
+        # Closing stops the read ahead thread if iteration ends early
+        with closing(self.iter_read(records)) as filereader:
+            for _, filedata in filereader:
+                yield XMLDoc(filedata)
 
-    def patentdoc_generator(self, publication_numbers=None, sample_size=None):
+    def patentdoc_generator(
+        self, classification=None, publication_numbers=None, sample_size=None
+    ):
         """ Return a generator that provides Patent Doc objects.
         publication_numbers is a list or iterator that provides a
         limiting group of publication numbers.
         sample_size limits results to a random sample of size sample_size"""
-        pass
+        xmldoc_gen = self.xmldoc_generator(
+            classification, publication_numbers, sample_size
+        )
+        for xmldoc in xmldoc_gen:
+            yield xmldoc.to_patentdoc()
@@ -5,7 +5,10 @@ import os
 import logging
 import re
 import random
+from collections import Counter
+from contextlib import closing
 
+from patentdata.corpus import shards
 from patentdata.corpus.baseclasses import LocalDataSource
 
 # Libraries for Zip file processing
@@ -21,12 +24,13 @@ import patentdata.utils as utils
 import sqlite3
 
 from patentdata.xmlparser import XMLDoc
+from patentdata.models.patentcorpus import PatentCorpus
 
 # == IMPORTS END ======================================================#
 
-# Configure logging
+# Configure logging - the log file is only created when first written
 logging.basicConfig(
-    filename="processing_class.log",
+    handlers=[logging.FileHandler("processing_class.log", delay=True)],
     format='%(asctime)s %(message)s'
 )
 
@@ -92,6 +96,17 @@ def filedata_generator(path, filename, entries):
                         yield pub_id, None
 
 
+def filedata_classifications(item):
+    """ Return (id, classifications, size) for an (id, filedata) tuple.
+
+    Module level so it can be run in worker processes.
+    """
+    pub_id, filedata = item
+    if not filedata:
+        return pub_id, [], 0
+    return pub_id, XMLDoc(filedata).classifications(), len(filedata)
+
+
 def group_filenames(filelist):
     """ Group entries in the form (id, filename, name) by filename. """
     filename_groups = dict()
@@ -135,10 +150,17 @@ class USPublications(LocalDataSource):
     Creates a new corpus object that simplifies processing of
     patent archive
     """
-    def __init__(self, path):
+    def __init__(self, path, shard=None):
+        """ Open the archive directory at path.
 
+        :param shard: "k/n" to index only the k-th of n shards of the
+        archives into fileindexes.shard-k-of-n.db; merge the shards
+        with patentdata.corpus.shards.merge_shards
+        :type shard: str
+        """
         self.exten = (".zip", ".tar")
         self.path = path
+        self.shard = shards.parse_shard(shard)
         if not os.path.isdir(path):
             print("Invalid path")
             # Raise custom exception here
@@ -149,8 +171,12 @@ class USPublications(LocalDataSource):
         # Get upper level zip/tar files in path
         self.first_level_files = utils.get_files(self.path, self.exten)
         # Connect to DB to store file data
-        self.conn = sqlite3.connect(os.path.join(self.path, 'fileindexes.db'))
-        self.c = self.conn.cursor()
+        # Generators may be run in a prefetching thread, so each thread
+        # uses its own cursor from self.c
+        self.conn = sqlite3.connect(
+            os.path.join(self.path, shards.shard_db_name(self.shard)),
+            check_same_thread=False
+        )
         # Create indexes table if it doesn't exist
         self.c.execute('''
             CREATE TABLE IF NOT EXISTS files
@@ -175,8 +201,22 @@ class USPublications(LocalDataSource):
     def __del__(self):
         self.conn.close()
 
-    def index(self):
-        """ Generate a list of lower level archive files. """
+    def index(
+        self, full_text=False, progress=None, batch_size=1000, processes=None
+    ):
+        """ Generate a list of lower level archive files.
+
+        If full_text is true also build the full text index used by
+        search(), parsing across processes workers.
+
+        :param progress: reporter updated for each archive
+        :type progress: utils.ProgressReporter
+        :param batch_size: rows stored per transaction
+        :type batch_size: int
+        :param processes: number of worker processes building the full
+        text index; None uses all CPUs
+        :type processes: int
+        """
 
         print("Getting archive file list - may take a few minutes\n")
         # Iterate through subdirs as so? >
@@ -185,10 +225,16 @@ class USPublications(LocalDataSource):
             filtered_files = [
                 f for f in self.first_level_files
                 if subdirectory in os.path.split(f) and "SUPP" not in f
+                and shards.in_shard(f, self.shard)
             ]
             for filename in filtered_files:
-                names = self.get_archive_names(filename)
-                for name in names:
+                members = self.get_archive_members(filename)
+                if progress:
+                    progress.start(filename, len(members))
+                stored = 0
+                for name, size in members:
+                    if progress:
+                        progress.update(1, size)
                     match = self.PUB_FORMAT.search(name)
                     if match and name.lower().endswith(self.exten):
                         data = (
@@ -207,28 +253,70 @@ class USPublications(LocalDataSource):
                             'VALUES (?,?,?,?,?,?,?)'),
                             data
                         )
+                        stored += 1
+                        if stored % batch_size == 0:
+                            self.conn.commit()
                 self.conn.commit()
+                if progress:
+                    progress.finish()
+        if full_text:
+            self.index_text(processes, batch_size)
+
+    def index_text(self, processes=None, batch_size=100):
+        """ Add publications to the full text index used by search().
+
+        Files are read with iter_read and parsed across a pool of
+        worker processes. Publications already in the index are
+        skipped so indexing can be interrupted and restarted.
+
+        :param processes: number of worker processes, None for all CPUs
+        :type processes: int
+        :param batch_size: documents per committed transaction
+        :type batch_size: int
+        :return: number of documents added
+        """
+        text_index = self.text_index
+        records = self.c.execute(
+            "SELECT ROWID, filename, name, pub_no FROM files "
+            "WHERE pub_no NOT IN (SELECT pub_no FROM documents_indexed)"
+        ).fetchall()
+        pub_nos = {rowid: pub_no for rowid, _, _, pub_no in records}
+        filelist = [
+            (rowid, filename, name) for rowid, filename, name, _ in records
+        ]
+        with closing(self.iter_read(filelist)) as reader:
+            filedata_iter = (
+                (pub_nos[rowid], filedata)
+                for rowid, filedata in reader
+                if rowid is not None
+            )
+            return text_index.build(filedata_iter, processes, batch_size)
 
     def get_archive_names(self, filename):
         """ Return names of files within archive having filename. """
+        return [name for name, _ in self.get_archive_members(filename)]
+
+    def get_archive_members(self, filename):
+        """ Return (name, size in bytes) of files within archive having
+        filename. """
+        members = []
         try:
             if filename.lower().endswith(".zip"):
                 with zipfile.ZipFile(
                     os.path.join(self.path, filename), "r"
                 ) as z:
-                    names = z.namelist()
+                    members = [(i.filename, i.file_size) for i in z.infolist()]
             elif filename.lower().endswith(".tar"):
                 with tarfile.TarFile(
                     os.path.join(self.path, filename), "r"
                 ) as t:
-                    names = t.getnames()
+                    members = [(m.name, m.size) for m in t.getmembers()]
         except Exception:
             logging.exception(
                 "Exception opening file:" +
                 str(os.path.join(self.path, filename))
             )
-            names = []
-        return names
+        return members
 
     def process_archive_names(self, names):
         """ Return a dictionary of 'pub_no':'filename' entries. """
@@ -281,10 +369,32 @@ class USPublications(LocalDataSource):
         else:
             return False
 
-    def iter_read(self, filelist):
+    def iter_read(
+        self, filelist, depth=8, max_bytes=utils.READ_AHEAD_BYTES
+    ):
         """ Read file data for a set of files
-        in filelist with (id, filename, name) entries. """
+        in filelist with (id, filename, name) entries.
+
+        Files are read and decompressed in a background thread while
+        the caller works on earlier files. The returned ReadAhead
+        iterator provides metrics() on how reading kept up.
+
+        :param depth: maximum files read ahead; 0 reads in the
+        calling thread
+        :type depth: int
+        :param max_bytes: maximum bytes of file data read ahead
+        :type max_bytes: int
+        :return: iterator of (id, filedata) tuples
+        """
+        if not depth:
+            return self._read_files(filelist)
+        return utils.ReadAhead(
+            self._read_files(filelist), depth, max_bytes,
+            utils.filedata_size
+        )
 
+    def _read_files(self, filelist):
+        """ Generator of (id, filedata) for entries in filelist. """
         if not filelist:
             yield None, None
 
@@ -342,30 +452,57 @@ class USPublications(LocalDataSource):
         no entry, it and its remaining entries are not filtered.
         """
         records = self.get_records(classification, sample_size)
-        filegenerator = self.iter_read(records)
-        # Iterate through records and return XMLDocs
-        for _, filedata in filegenerator:
-            if filedata:
-                yield XMLDoc(filedata)
+        # Closing stops the read ahead thread if iteration ends early
+        with closing(self.iter_read(records)) as filegenerator:
+            # Iterate through records and return XMLDocs
+            for _, filedata in filegenerator:
+                if filedata:
+                    yield XMLDoc(filedata)
+
+    def iter_filedata(
+        self, classification=None, publication_numbers=None,
+        sample_size=None, skip=None
+    ):
+        """ Generator of (pub_no, filedata) tuples for publications
+        matching a classification of form ["G", "06"] or in
+        publication_numbers, randomly sampled down to sample_size.
+        Publication numbers in skip are not read. """
+        skip = skip or set()
+        records = self.select_files(
+            "ROWID, filename, name, pub_no",
+            classification, publication_numbers, sample_size
+        )
+        pub_nos = {
+            rowid: pub_no for rowid, _, _, pub_no in records
+            if pub_no not in skip
+        }
+        filelist = [
+            (rowid, filename, name) for rowid, filename, name, _ in records
+            if rowid in pub_nos
+        ]
+        if not filelist:
+            return
+        with closing(self.iter_read(filelist)) as filereader:
+            for rowid, filedata in filereader:
+                if filedata:
+                    yield pub_nos[rowid], filedata
 
     def search_files(self, publication_number):
         """ Return upper and lower level paths for publication.
             Returns None if no match."""
-        self.c.execute(
+        return self.conn.execute(
             'SELECT filename, name FROM files WHERE pub_no=?',
             (publication_number,)
-        )
-        return self.c.fetchone()
+        ).fetchone()
 
     def get_patentcorpus(self, indexes, number_of_docs):
-        """ Get a random sample of documents having a total number_of_docs."""
-        """ Indexes is a list of relevant patent indexes. """
-        pass
-        """if len(indexes) > number_of_docs:
-            indexes = random.sample(indexes, number_of_docs)
-        return m.PatentCorpus(
-            [self.get_doc(i).to_patentdoc() for i in indexes]
-            )"""
+        """ Get a random sample of documents having a total number_of_docs.
+        Indexes is a list of relevant publication numbers. """
+        return PatentCorpus(
+            datasource=self,
+            publication_numbers=indexes,
+            sample_size=number_of_docs
+        )
 
     def get_classification(self, filedata):
         """ Return patent classifications as a list of 5 items."""
@@ -396,12 +533,21 @@ class USPublications(LocalDataSource):
             print("Error saving classifications")
             return False
 
-    def process_classifications(self, yearlist=None):
+    def process_classifications(
+        self, yearlist=None, progress=None, batch_size=100, processes=1
+    ):
         """ Iterate through publications and store classifications in DB.
 
         :param yearlist: list of years as integers,
         e.g. [2001, 2010, 2013] - if supplied will only process
         these years
+        :param progress: reporter updated for each archive
+        :type progress: utils.ProgressReporter
+        :param batch_size: classifications stored per transaction
+        :type batch_size: int
+        :param processes: number of worker processes parsing XML;
+        None uses all CPUs
+        :type processes: int
         """
         # Select distinct years in DB
         years = self.c.execute('SELECT DISTINCT year FROM files').fetchall()
@@ -428,29 +574,36 @@ class USPublications(LocalDataSource):
                     section IS NULL
                 """
             records = self.c.execute(query_string, (year,)).fetchall()
-            # filelist = [(f, n) for r, f, n in records]
-            filereader = self.iter_read(records)
+            archives = {rowid: filename for rowid, filename, _ in records}
+            archive_sizes = Counter(archives.values())
+            archive = None
             params = []
             i = 0
-            for rowid, filedata in filereader:
-                # print("RID:{0}; Len FD:{1}".format(rowid, len(filedata)))
-                # print(XMLDoc(filedata).title())
-                # print(XMLDoc(filedata).soup)
-                if filedata:
-                    classifications = self.get_classification(filedata)
-
-                    # print(rowid, classifications)
+            with closing(self.iter_read(records)) as filereader:
+                results = utils.parallel_map(
+                    filedata_classifications, filereader, processes,
+                    max(1, batch_size // 10)
+                )
+                for rowid, classifications, nbytes in results:
+                    if progress and rowid in archives:
+                        if archives[rowid] != archive:
+                            archive = archives[rowid]
+                            progress.start(archive, archive_sizes[archive])
+                        progress.update(1, nbytes)
                     if len(classifications) > 0:
                         # For speed up batch updates to DB in transactions
                         params.append(classifications[0] + [rowid])
 
-                        if (len(params) % 100) == 0:
-                            i += 100
-                            print(i, classifications[0])
+                        if len(params) >= batch_size:
+                            i += len(params)
+                            if not progress:
+                                print(i, classifications[0])
                             self.store_many(params)
                             params = []
             if params:
                 self.store_many(params)
+        if progress:
+            progress.finish()
 
     def get_patentdoc(self, publication_number):
         """ Return a PatentDoc object for a given publication number."""
@@ -496,10 +649,10 @@ class USPublications(LocalDataSource):
                 )
                 records = self.c.execute(query_string).fetchall()
 
-            filereader = self.iter_read(records)
-            for _, filedata in filereader:
-                if filedata:
-                    yield XMLDoc(filedata)
+            with closing(self.iter_read(records)) as filereader:
+                for _, filedata in filereader:
+                    if filedata:
+                        yield XMLDoc(filedata)
 
 
 
@@ -518,9 +671,11 @@ class USPublications(LocalDataSource):
             records = self.c.execute(
                     query_string, publication_numbers).fetchall()"""
             for publication_number in publication_numbers:
-                result = self.get_patentdoc(publication_number)
+                result = self.search_files(publication_number)
                 if result:
-                    yield result
+                    filedata = self.read_archive_file(*result)
+                    if filedata:
+                        yield XMLDoc(filedata)
         # If a classification is supplied
         if classification:
             filegenerator = self.iter_filter_xml(classification, sample_size)
@@ -1,14 +1,28 @@
 import os
 import json
+import zlib
 from datetime import datetime
 
+# zstandard compresses better and faster if it is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import patentdata.utils as utils
+
 # Define name and path for SQLite3 DB
 db_name = "patentcache.db"
-db_path = os.path.join(os.getcwd(), db_name)
+# Set with configure(), otherwise db_name in the working directory
+db_path = None
+
+# Codec used for new payloads
+COMPRESSION = "zstd" if zstandard else "zlib"
 
-# Create DB
-from sqlalchemy import create_engine
-engine = create_engine('sqlite:///' + db_path, echo=False)
+# Numbers per get_many query, below the SQLite variable limit
+QUERY_CHUNK_SIZE = 500
+
+from sqlalchemy import inspect, text
 
 # Setup imports
 from sqlalchemy.ext.declarative import declarative_base
@@ -16,7 +30,7 @@ from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship
 
 # Define Class for Excluded Matter Case Details
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, String, Integer, LargeBinary, DateTime
 
 class Base(object):
     """ Extensions to Base class. """
@@ -28,29 +42,150 @@ class Base(object):
 
 Base = declarative_base(cls=Base)
 
-    
+
+def compress(data, codec=COMPRESSION):
+    """ Compress bytes with codec "zstd" or "zlib". """
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return zlib.compress(data)
+
+def decompress(data, codec):
+    """ Decompress bytes compressed with codec. """
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImportError("zstandard is needed to read zstd cache entries")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
 class RegisterCache(Base):
     """ Model for storing a cached register page. """
     # Publication number in EPODOC format
-    pub_no = Column(String(128))
-    
-    raw_response = Column(String)
-    
-    def __init__(self, number, response):
+    pub_no = Column(String(128), unique=True, index=True)
+
+    # Compressed JSON and the codec used
+    payload = Column(LargeBinary)
+    codec = Column(String(8))
+
+    # When the register page was retrieved
+    fetched_at = Column(DateTime)
+
+    def __init__(self, number, response, fetched_at=None):
         self.pub_no = number
-        self.storeresponse(response)
-    
-    def storeresponse(self, data):
-        """ Convert data from JSON to string and store. """
-        self.raw_response = json.dumps(data)
-        
+        self.storeresponse(response, fetched_at)
+
+    def storeresponse(self, data, fetched_at=None):
+        """ Convert data from JSON to compressed bytes and store. """
+        self.codec = COMPRESSION
+        self.payload = compress(json.dumps(data).encode("utf8"), self.codec)
+        self.fetched_at = fetched_at or datetime.utcnow()
+
     def loadresponse(self):
-        """ Load JSON from saved string. """
-        return json.loads(self.raw_response)
-    
-# Create new DB    
-Base.metadata.create_all(engine)
+        """ Load JSON from saved bytes. """
+        return json.loads(decompress(self.payload, self.codec).decode("utf8"))
+
+    def is_expired(self, max_age):
+        """ Check if the page is older than max_age, a timedelta. """
+        if max_age is None:
+            return False
+        return not self.fetched_at or datetime.utcnow() - self.fetched_at > max_age
+
+    @classmethod
+    def get_many(cls, session, pub_nos, max_age=None):
+        """ Load cached JSON for several publication numbers.
+
+        param list pub_nos: publication numbers in EPODOC format
+        param timedelta max_age: ignore pages retrieved longer ago
+        return: dict of publication number to JSON"""
+        pub_nos = list(dict.fromkeys(pub_nos))
+        results = {}
+        for i in range(0, len(pub_nos), QUERY_CHUNK_SIZE):
+            chunk = pub_nos[i:i + QUERY_CHUNK_SIZE]
+            for row in session.query(cls).filter(cls.pub_no.in_(chunk)):
+                if not row.is_expired(max_age):
+                    results[row.pub_no] = row.loadresponse()
+        return results
+
+    @classmethod
+    def store_many(cls, session, responses):
+        """ Add or replace cached JSON for several publication numbers.
+        Does not commit.
+
+        param dict responses: publication number to JSON"""
+        existing = {}
+        numbers = list(responses)
+        for i in range(0, len(numbers), QUERY_CHUNK_SIZE):
+            chunk = numbers[i:i + QUERY_CHUNK_SIZE]
+            for row in session.query(cls).filter(cls.pub_no.in_(chunk)):
+                existing[row.pub_no] = row
+        for number, response in responses.items():
+            if number in existing:
+                existing[number].storeresponse(response)
+            else:
+                session.add(cls(number, response))
 
-# Setup SQLAlchemy session
+
+def migrate(engine):
+    """ Upgrade a registercache table holding uncompressed raw_response
+    text, keeping the latest row for each publication number.
+    return: number of rows migrated"""
+    if "registercache" not in inspect(engine).get_table_names():
+        return 0
+    columns = [c["name"] for c in inspect(engine).get_columns("registercache")]
+    if "payload" in columns:
+        return 0
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE registercache RENAME TO registercache_old"))
+        RegisterCache.__table__.create(conn)
+        rows = conn.execute(text(
+            "SELECT pub_no, raw_response FROM registercache_old "
+            "WHERE id IN (SELECT MAX(id) FROM registercache_old GROUP BY pub_no)"
+        )).fetchall()
+        fetched_at = datetime.utcnow()
+        if rows:
+            conn.execute(RegisterCache.__table__.insert(), [
+                {
+                    "pub_no": pub_no,
+                    "payload": compress((raw_response or "null").encode("utf8")),
+                    "codec": COMPRESSION,
+                    "fetched_at": fetched_at
+                }
+                for pub_no, raw_response in rows
+            ])
+        conn.execute(text("DROP TABLE registercache_old"))
+    return len(rows)
+
+# Engine and sessions are created on first use, so importing this module
+# does not create a database
 from sqlalchemy.orm import sessionmaker
-Session = sessionmaker(bind=engine)
\ No newline at end of file
+_session_factory = None
+_created = set()
+
+def configure(path=None):
+    """ Set the database file, by default db_name in the working directory. """
+    global db_path, _session_factory
+    db_path = path
+    _session_factory = None
+
+def get_engine():
+    """ Return the shared engine, creating the database on first use. """
+    engine = utils.get_engine(db_path or os.path.join(os.getcwd(), db_name))
+    if engine not in _created:
+        # Upgrade any existing cache then create new tables
+        migrate(engine)
+        Base.metadata.create_all(engine)
+        _created.add(engine)
+    return engine
+
+def Session(**kwargs):
+    """ Return a new SQLAlchemy session for the database. """
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = sessionmaker(bind=get_engine())
+    return _session_factory(**kwargs)
+
+def __getattr__(name):
+    # Engine attribute of earlier versions
+    if name == "engine":
+        return get_engine()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
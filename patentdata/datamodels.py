@@ -1,13 +1,12 @@
 import os
 from datetime import datetime
 
+import patentdata.utils as utils
+
 # Define name and path for SQLite3 DB
 db_name = "patentdata.db"
-db_path = os.path.join(os.getcwd(), db_name)
-
-# Create DB
-from sqlalchemy import create_engine
-engine = create_engine('sqlite:///' + db_path, echo=False)
+# Set with configure(), otherwise db_name in the working directory
+db_path = None
 
 # Setup imports
 from sqlalchemy.ext.declarative import declarative_base
@@ -92,9 +91,35 @@ class Classification(Base):
      # Foreign key for associated publication
     pub_id = Column(Integer, ForeignKey('patentpublication.id'))
     
-# Create new DB    
-Base.metadata.create_all(engine)
-
-# Setup SQLAlchemy session
+# Engine and sessions are created on first use, so importing this module
+# does not create a database
 from sqlalchemy.orm import sessionmaker
-Session = sessionmaker(bind=engine)
\ No newline at end of file
+_session_factory = None
+_created = set()
+
+def configure(path=None):
+    """ Set the database file, by default db_name in the working directory. """
+    global db_path, _session_factory
+    db_path = path
+    _session_factory = None
+
+def get_engine():
+    """ Return the shared engine, creating the database on first use. """
+    engine = utils.get_engine(db_path or os.path.join(os.getcwd(), db_name))
+    if engine not in _created:
+        Base.metadata.create_all(engine)
+        _created.add(engine)
+    return engine
+
+def Session(**kwargs):
+    """ Return a new SQLAlchemy session for the database. """
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = sessionmaker(bind=get_engine())
+    return _session_factory(**kwargs)
+
+def __getattr__(name):
+    # Engine attribute of earlier versions
+    if name == "engine":
+        return get_engine()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
@@ -5,3 +5,5 @@ from patentdata.models.patentdoc import PatentDoc
 from patentdata.models.claim import Claim
 from patentdata.models.claimset import Claimset
 from patentdata.models.classification import Classification
+from patentdata.models.tfidf import TfidfMatrix
+from patentdata.models.patentcorpus import PatentCorpus, LazyPatentCorpus
@@ -1,23 +1,71 @@
 # -*- coding: utf-8 -*-
 
-from nltk import word_tokenize, pos_tag
+# nltk is imported when text is first tokenised or tagged
 # Used for frequency counts
 from collections import Counter
 import string
 import re
 
 from patentdata.models.lib.utils import (
-    check_list, remove_non_words, stem, remove_stopwords
+    check_list, remove_non_words, stem, remove_stopwords, get_stopwords
     )
 
 
 class BaseTextBlock:
-    """ Abstract class for a block of text. """
+    """ Abstract class for a block of text.
+
+    Text is either held by the block or, once the owning document has
+    been compacted, read as a (start, end) span of a shared buffer.
+    """
+
+    __slots__ = (
+        '_text', '_buffer', '_start', '_end', 'number',
+        '_words', '_word_set', 'pos', 'word_order'
+    )
 
     def __init__(self, text, number=None):
         self.text = text
         self.number = number
 
+    @classmethod
+    def from_span(cls, buffer, start, end, number=None):
+        """ Create a block as a view of buffer[start:end]. """
+        block = cls("", number)
+        block.set_span(buffer, start, end)
+        return block
+
+    @property
+    def text(self):
+        """ Text of block. """
+        if self._buffer is None:
+            return self._text
+        return self._buffer[self._start:self._end]
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+        self._buffer = None
+        # Tokens of any previous text are out of date
+        for name in ('_words', '_word_set'):
+            try:
+                delattr(self, name)
+            except AttributeError:
+                pass
+
+    def set_span(self, buffer, start, end):
+        """ Make the block a view of buffer[start:end], dropping its own
+        copy of the text. """
+        self._buffer = buffer
+        self._start = start
+        self._end = end
+        self._text = None
+
+    def get_span(self):
+        """ Return (buffer, start, end) locating the block text. """
+        if self._buffer is None:
+            return self._text, 0, len(self._text)
+        return self._buffer, self._start, self._end
+
     def __repr__(self):
         if self.number:
             return "{0} {1}".format(self.number, self.text)
@@ -30,6 +78,7 @@ class BaseTextBlock:
         try:
             return self._words
         except AttributeError:
+            from nltk import word_tokenize
             self._words = word_tokenize(self.text)
             return self._words
 
@@ -57,10 +106,11 @@ class BaseTextBlock:
         # Take out punctuation
         if stopwords:
             # If stopwords = true then remove stopwords
+            eng_stopwords = get_stopwords()
             counter = Counter(
                 [
                     w.lower() for w in self.words
-                    if w.isalpha() and w.lower() not in ENG_STOPWORDS
+                    if w.isalpha() and w.lower() not in eng_stopwords
                 ]
             )
         else:
@@ -74,6 +124,7 @@ class BaseTextBlock:
 
     def set_pos(self):
         """ Get the parts of speech."""
+        from nltk import pos_tag
         pos_list = pos_tag(self.words)
         # Hard set 'comprising' as VBG
         pos_list = [
@@ -83,9 +134,18 @@ class BaseTextBlock:
         self.pos = pos_list
         return self.pos
 
+    @property
+    def word_set(self):
+        """ Set of lowercased tokens, built once for term lookups. """
+        try:
+            return self._word_set
+        except AttributeError:
+            self._word_set = frozenset(w.lower() for w in self.words)
+            return self._word_set
+
     def appears_in(self, term):
         """ Determine if term appears in claim. """
-        return term.lower() in [w.lower() for w in self.words]
+        return term.lower() in self.word_set
 
     def set_word_order(self):
         """ Generate a list of tuples of word, order in claim. """
@@ -94,7 +154,12 @@ class BaseTextBlock:
 
 
 class BaseTextSet:
-    """ Abstract object to model a collection of text blocks. """
+    """ Abstract object to model a collection of text blocks.
+
+    The joined text and indexes derived from the units are cached.
+    Assigning units clears the caches; call invalidate() after
+    changing units in place.
+    """
     def __init__(self, initial_input):
         """
         Initialise a base text set
@@ -106,12 +171,80 @@ class BaseTextSet:
         """
         units = check_list(initial_input)
         self.units = units
-        self.count = len(self.units)
+
+    @property
+    def units(self):
+        """ Text blocks making up the set. """
+        return self.__dict__.get("_units")
+
+    @units.setter
+    def units(self, value):
+        self._units = value
+        self.invalidate()
+
+    @property
+    def count(self):
+        """ Return number of units. """
+        return len(self.units)
+
+    @property
+    def version(self):
+        """ Counter incremented each time cached values are cleared,
+        so owners can tell if text they cached is stale. """
+        return self.__dict__.get("_version", 0)
+
+    def invalidate(self):
+        """ Clear text and indexes cached from the units. """
+        for name in ["_text", "_buffer", "_term_index", "_dependency_graph"]:
+            self.__dict__.pop(name, None)
+        self._version = self.version + 1
 
     @property
     def text(self):
         """ Return unit set as text string. """
-        return "\n".join([u.text for u in self.units])
+        # Subclasses return None from __getattr__ so check __dict__
+        buffer = self.__dict__.get("_buffer")
+        if buffer is not None:
+            return buffer[self._start:self._end]
+        text = self.__dict__.get("_text")
+        if text is None:
+            text = "\n".join([u.text for u in self.units])
+            self._text = text
+        return text
+
+    @property
+    def word_count(self):
+        """ Return number of tokens, using the tokens cached on each
+        unit. """
+        return sum(u.word_count for u in self.units)
+
+    def compact(self, buffer=None, start=0):
+        """ Store the text of all units in one buffer, with each unit
+        a span of it.
+
+        :param buffer: string containing the set text at start;
+        built from the units if not passed
+        :type buffer: str
+        :param start: offset of the set text in buffer
+        :type start: int
+        :return: end offset of the set text in buffer
+        """
+        if buffer is None:
+            buffer = self.text
+            start = 0
+        position = start
+        for unit in self.units:
+            end = position + len(unit.text)
+            unit.set_span(buffer, position, end)
+            # Skip the newline joining units
+            position = end + 1
+        end = max(start, position - 1)
+        # The buffer holds the text so drop the separate copy
+        self.__dict__.pop("_text", None)
+        self._buffer = buffer
+        self._start = start
+        self._end = end
+        return end
 
     @property
     def unfiltered_counter(self):
@@ -132,9 +265,26 @@ class BaseTextSet:
         Stopwords flag sets removal of stopwords."""
         return sum([u.get_word_freq(stopwords) for u in self.units], Counter())
 
+    @property
+    def term_index(self):
+        """ Inverted index of lowercased token to the positions of the
+        units containing it. Built on first access. """
+        # Subclasses return None from __getattr__ so check __dict__
+        index = self.__dict__.get("_term_index")
+        if index is None:
+            index = dict()
+            for position, unit in enumerate(self.units):
+                for token in unit.word_set:
+                    index.setdefault(token, []).append(position)
+            self._term_index = index
+        return index
+
     def appears_in(self, term):
         """ Returns unit string 'term' appears in. """
-        return [u for u in self.units if u.appears_in(term)]
+        return [
+            self.units[position]
+            for position in self.term_index.get(term.lower(), [])
+        ]
 
     def bag_of_words(
         self, clean_non_words=True, clean_stopwords=True, stem_words=True
@@ -142,6 +292,7 @@ class BaseTextSet:
         """ Get an array of all the words in the text set. """
         lowers = self.text.lower()
 
+        from nltk import word_tokenize
         tokens = word_tokenize(lowers)
 
         if clean_non_words:
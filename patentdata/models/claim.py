@@ -1,11 +1,11 @@
 # -*- coding: utf-8 -*-
 
 import re
-import nltk
 from patentdata.models.basemodels import BaseTextBlock
 from patentdata.models.lib.utils_claim import (
-    ends_with, get_number, detect_dependency, detect_category
+    get_number, detect_dependency, detect_category
 )
+from patentdata.models.lib.claim_nlp import get_pipeline
 import warnings
 
 
@@ -17,6 +17,11 @@ def check_claim_class(potential_claim):
 class Claim(BaseTextBlock):
     """ Object to model a patent claim."""
 
+    # word_data, mapping_dict and features are set by callers
+    __slots__ = (
+        'dependency', '_category', 'word_data', 'mapping_dict', 'features'
+    )
+
     def __init__(self, text, number=None, dependency=None):
         """ Initiate claim object with string containing claim text."""
         # Have a 'lazy' flag on this to load some of information when needed?
@@ -73,21 +78,21 @@ class Claim(BaseTextBlock):
             self._category = detect_category(self.text)
             return self._category
 
+    def set_pos(self):
+        """ Get the parts of speech using the shared claim pipeline. """
+        get_pipeline().set_pos([self])
+        return self.pos
+
     def determine_entities(self):
         """ Determines noun entities within a patent claim.
         param: pos - list of tuples from nltk pos tagger"""
-        # Define grammar for chunking
-        grammar = '''
-            NP: {<DT|PRP\$> <VBG> <NN.*>+}
-                {<DT|PRP\$> <NN.*> <POS> <JJ>* <NN.*>+}
-                {<DT|PRP\$>? <JJ>* <NN.*>+ }
-            '''
-        cp = nltk.RegexpParser(grammar)
-        # Or store as part of claim object property?
-
         # Option: split into features / clauses, run over clauses and
         # then re-correlate
-        return cp.parse(self.pos)
+        try:
+            pos = self.pos
+        except AttributeError:
+            pos = self.set_pos()
+        return get_pipeline().chunk(pos)
 
     def print_nps(self):
         # ent_tree = self.determine_entities(self.pos)
@@ -120,56 +125,11 @@ class Claim(BaseTextBlock):
 
     def label_nounphrases(self):
         """ Label noun phrases in the output from pos chunking. """
-        grammar = '''
-            NP: {<DT|PRP\$> <VBG> <NN.*>+}
-                {<DT|PRP\$> <NN.*> <POS> <JJ>* <NN.*>+}
-                {<DT|PRP\$>? <JJ>* <NN.*>+ }
-            '''
-
-        cp = nltk.RegexpParser(grammar)
-        result = cp.parse(self.pos)
-        ptree = nltk.tree.ParentedTree.convert(result)
-        subtrees = ptree.subtrees(filter=lambda x: x.label() == 'NP')
-
-        # build up mapping dict - if not in dict add new entry id+1;
-        # if in dict label using key
-        mapping_dict = {}
-        pos_to_np = {}
-        for st in subtrees:
-            np_string = " ".join(
-                [
-                    leaf[0] for leaf in st.leaves()
-                    if leaf[1] != ("DT" or "PRP$")
-                ]
-            )
-            np_id = mapping_dict.get(np_string, None)
-            if not np_id:
-                # put ends_with here
-                nps = [i[0] for i in mapping_dict.items()]
-                ends_with_list = [
-                    np for np in nps if ends_with(np_string, np)
-                ]
-                if ends_with_list:
-                    np_id = mapping_dict[ends_with_list[0]]
-                else:
-                    np_id = len(mapping_dict)+1
-                    mapping_dict[np_string] = np_id
-            pos_to_np[st.parent_index()] = np_id
-
-        # Label Tree with entities
-        flat_list = []
-        for i in range(0, len(ptree)):
-            # print(i)
-            # Label
-            if isinstance(ptree[i], nltk.tree.Tree):
-                for leaf in ptree[i].leaves():
-                    # Unpack leaf and add label as triple
-                    flat_list.append((leaf[0], leaf[1], pos_to_np.get(i, "")))
-            else:
-                flat_list.append(
-                    (ptree[i][0], ptree[i][1], pos_to_np.get(i, ""))
-                )
-        return (flat_list, mapping_dict)
+        try:
+            pos = self.pos
+        except AttributeError:
+            pos = self.set_pos()
+        return get_pipeline().label_text(self.text, pos)
 
     def json(self):
         """ Provide words as JSON. """
@@ -5,6 +5,7 @@ from patentdata.models.basemodels import BaseTextSet
 from patentdata.models.lib.utils_claimset import (
     check_set_claims, clean_data
 )
+from patentdata.models.lib.dependency_graph import DependencyGraph
 
 
 class Claimset(BaseTextSet):
@@ -30,11 +31,17 @@ class Claimset(BaseTextSet):
         """ Return claim having the passed number. """
         return super(Claimset, self).get_unit(number)
 
-    def claim_tf_idf(self, number):
+    def claim_tf_idf(self, number, tfidf=None):
         """ Calculate term frequency - inverse document frequency statistic
-        for claim 'number' when compared to whole claimset. """
+        for claim 'number' when compared to whole claimset.
+
+        If a TfidfMatrix is passed as tfidf, IDF values are taken from
+        its corpus instead of the claimset. """
         claim = self.get_claim(number)
 
+        if tfidf is not None:
+            return tfidf.claim_tf_idf(claim)
+
         # Need to remove punctuation, numbers and normal english stopwords?
 
         # Calculate term frequencies and normalise
@@ -52,22 +59,40 @@ class Claimset(BaseTextSet):
 
         return tf_idf
 
+    @property
+    def dependency_graph(self):
+        """ Dependency graph of the claims, built on first access. """
+        # __getattr__ returns None for missing attributes so check __dict__
+        graph = self.__dict__.get("_dependency_graph")
+        if graph is None:
+            graph = DependencyGraph(self.units)
+            self._dependency_graph = graph
+        return graph
+
     def independent_claims(self):
         """ Return independent claims. """
-        return [c for c in self.claims if c.dependency == 0]
+        graph = self.dependency_graph
+        return [
+            self.units[graph.index[number]]
+            for number in graph.get_independent()
+        ]
 
     def get_dependent_claims(self, claim):
-        """ Return all claims that ultimately depend on 'claim'."""
-        # claim_number = claim.number
-        pass
+        """ Return all claims that ultimately depend on 'claim'.
+
+        :param claim: Claim object or claim number
+        :return: list of Claim objects
+        """
+        number = getattr(claim, 'number', claim)
+        graph = self.dependency_graph
+        return [
+            self.units[graph.index[n]]
+            for n in graph.get_descendants(number)
+        ]
 
     def get_root_claim_parent(self, claim_number):
         """ If claim is dependent, get independent claim it depends on. """
-        claim = self.get_claim(claim_number)
-        if claim.dependency == 0:
-            return claim.number
-        else:
-            return self.get_root_claim_parent(claim.dependency)
+        return self.dependency_graph.get_root(claim_number)
 
     def print_dependencies(self):
         """ Output dependencies."""
@@ -75,24 +100,10 @@ class Claimset(BaseTextSet):
             print(c.number, c.dependency)
 
     def get_dependency_groups(self):
-        """ Return a list of sublists, where each sublist is a group
-        of claims with common dependency, the independent claim
-        being first in the set. """
-        # Or a tree structure? - this will be recursive for chains of
-        # dependencies
-        # First level will be all claims with dependency = 0 then recursively
-        # navigate dependencies
-        root_list = [
-            (claim.number, self.get_root_claim_parent(claim.number))
-            for claim in self.claims
-            ]
-        claim_groups = {}
-        for n, d in root_list:
-            if d not in claim_groups.keys():
-                claim_groups[d] = []
-            else:
-                claim_groups[d].append(n)
-        return claim_groups
+        """ Return a dictionary of groups of claims with common
+        dependency, keyed by independent claim number, the independent
+        claim being first in each group. """
+        return self.dependency_graph.get_groups()
 
     # to print
     # for k in sorted(claim_groups.keys()):
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from patentdata.models.lib.utils_claim import SuffixTrie
+
+# Grammar for chunking noun phrases in claims
+NP_GRAMMAR = r'''
+    NP: {<DT|PRP\$> <VBG> <NN.*>+}
+        {<DT|PRP\$> <NN.*> <POS> <JJ>* <NN.*>+}
+        {<DT|PRP\$>? <JJ>* <NN.*>+ }
+    '''
+
+
+def text_key(text):
+    """ Return a hash of text used as a cache key. """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def fix_pos(pos_list):
+    """ Hard set 'comprising' as VBG. """
+    return [
+        (word, pos) if word != 'comprising'
+        else ('comprising', 'VBG') for (word, pos) in pos_list
+        ]
+
+
+def label_nounphrases(chunked):
+    """ Label noun phrases in the output from pos chunking.
+
+    :param chunked: chunk tree from the NP grammar
+    :type chunked: nltk.tree.Tree
+    :return: (list of (word, pos, np_id), mapping of np string to id)
+    """
+    from nltk.tree import ParentedTree, Tree
+    ptree = ParentedTree.convert(chunked)
+    subtrees = ptree.subtrees(filter=lambda x: x.label() == 'NP')
+
+    # build up mapping dict - if not in dict add new entry id+1;
+    # if in dict label using key
+    mapping_dict = {}
+    # Noun phrases seen so far for matching on suffixes
+    known_nps = SuffixTrie()
+    pos_to_np = {}
+    for st in subtrees:
+        np_string = " ".join(
+            [
+                leaf[0] for leaf in st.leaves()
+                if leaf[1] != ("DT" or "PRP$")
+            ]
+        )
+        np_id = mapping_dict.get(np_string, None)
+        if not np_id:
+            # Use the first known noun phrase np_string ends with
+            ends_with_np = known_nps.first_suffix(np_string)
+            if ends_with_np is not None:
+                np_id = mapping_dict[ends_with_np]
+            else:
+                np_id = len(mapping_dict)+1
+                mapping_dict[np_string] = np_id
+                known_nps.add(np_string)
+        pos_to_np[st.parent_index()] = np_id
+
+    # Label Tree with entities
+    flat_list = []
+    for i in range(0, len(ptree)):
+        if isinstance(ptree[i], Tree):
+            for leaf in ptree[i].leaves():
+                # Unpack leaf and add label as triple
+                flat_list.append((leaf[0], leaf[1], pos_to_np.get(i, "")))
+        else:
+            flat_list.append(
+                (ptree[i][0], ptree[i][1], pos_to_np.get(i, ""))
+            )
+    return (flat_list, mapping_dict)
+
+
+class ClaimPipeline:
+    """ Part of speech tagging and noun phrase chunking for claims.
+
+    The tagger and compiled chunk grammar are loaded once and reused.
+    Results are cached by a hash of the claim text so repeated claims
+    (e.g. across family members) are only tagged once.
+    """
+
+    def __init__(self, tagger=None, cache_size=10000):
+        """ Initialise pipeline.
+
+        :param tagger: nltk tagger with a tag_sents method; defaults
+        to the averaged perceptron tagger used by nltk.pos_tag
+        :param cache_size: maximum number of cached claim texts
+        :type cache_size: int
+        :return: None
+        """
+        self._tagger = tagger
+        self._custom_tagger = tagger is not None
+        # nltk is only imported once a pipeline is needed
+        from nltk import RegexpParser
+        self.chunker = RegexpParser(NP_GRAMMAR)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    @property
+    def tagger(self):
+        """ Load the tagger on first use. """
+        if self._tagger is None:
+            from nltk.tag import PerceptronTagger
+            self._tagger = PerceptronTagger()
+        return self._tagger
+
+    def _cached(self, key):
+        """ Return cached entry for key, marking it recently used. """
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.move_to_end(key)
+        return entry
+
+    def _store(self, key, entry):
+        """ Store entry, evicting the least recently used. """
+        self.cache[key] = entry
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def tag_texts(self, texts, token_lists=None):
+        """ Return part of speech tags for a batch of texts.
+
+        :param texts: claim texts
+        :type texts: list of str
+        :param token_lists: optional tokens already computed for texts
+        :return: list of lists of (word, pos) tuples
+        """
+        keys = [text_key(text) for text in texts]
+        entries = [self._cached(key) for key in keys]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        if missing:
+            if token_lists is None:
+                from nltk import word_tokenize
+                tokens = [word_tokenize(texts[i]) for i in missing]
+            else:
+                tokens = [token_lists[i] for i in missing]
+            # Equivalent to nltk.pos_tag_sents without reloading the model
+            for i, pos in zip(missing, self.tagger.tag_sents(tokens)):
+                entries[i] = {'pos': fix_pos(pos)}
+                self._store(keys[i], entries[i])
+        return [entry['pos'] for entry in entries]
+
+    def set_pos(self, claims):
+        """ Tag a batch of Claim objects, setting claim.pos. """
+        tagged = self.tag_texts(
+            [claim.text for claim in claims],
+            [claim.words for claim in claims]
+        )
+        for claim, pos in zip(claims, tagged):
+            claim.pos = pos
+        return tagged
+
+    def chunk(self, pos):
+        """ Chunk tagged words into noun phrases. """
+        return self.chunker.parse(pos)
+
+    def label_text(self, text, pos=None):
+        """ Return label_nounphrases output for text, using the cache.
+        Tags in pos are used if given; they are only cached if the text
+        has no cached tags. """
+        key = text_key(text)
+        entry = self._cached(key)
+        if entry is not None and pos is not None and entry['pos'] != pos:
+            return label_nounphrases(self.chunk(pos))
+        if entry is None:
+            if pos is None:
+                pos = self.tag_texts([text])[0]
+            entry = {'pos': pos}
+            self._store(key, entry)
+        if 'labels' not in entry:
+            entry['labels'] = label_nounphrases(self.chunk(entry['pos']))
+        return entry['labels']
+
+    def extract_entities(self, texts, processes=None, chunksize=100):
+        """ Return noun phrase mapping dictionaries for many claim texts.
+
+        With processes other than 1 texts are spread over a pool of
+        worker processes, each loading its own pipeline once.
+
+        :param texts: claim texts
+        :type texts: iterable of str
+        :param processes: number of worker processes, None for all CPUs
+        :type processes: int
+        :return: list of dictionaries of noun phrase to id
+        """
+        if processes == 1:
+            texts = list(texts)
+            self.tag_texts(texts)
+            return [self.label_text(text)[1] for text in texts]
+        # Workers load the default tagger themselves rather than
+        # receiving a pickled copy of the model
+        tagger = self._tagger if self._custom_tagger else None
+        with Pool(
+            processes, initializer=_init_worker, initargs=(tagger,)
+        ) as pool:
+            return pool.map(_worker_entities, texts, chunksize)
+
+
+# Pipeline shared by Claim objects in this process
+_pipeline = None
+
+
+def get_pipeline():
+    """ Return the pipeline shared within this process. """
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = ClaimPipeline()
+    return _pipeline
+
+
+def _init_worker(tagger=None):
+    """ Load a pipeline when a worker process starts. """
+    global _pipeline
+    _pipeline = ClaimPipeline(tagger)
+
+
+def _worker_entities(text):
+    """ Return the noun phrase mapping for text in a worker process. """
+    return get_pipeline().label_text(text)[1]
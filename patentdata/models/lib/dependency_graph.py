@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+from array import array
+from collections import Counter
+
+from patentdata.models.lib.utils_claim import detect_dependency
+
+
+class DependencyGraph:
+    """ Claim dependency graph for a claimset, built once.
+
+    Claims are held by position in parent, root and depth arrays.
+    A dependency must refer to an earlier claim number; missing,
+    self or forward references are recorded in invalid and the claim
+    is treated as independent, so the graph is always acyclic.
+    """
+
+    def __init__(self, claims):
+        """ Build the graph.
+
+        :param claims: Claim objects in claimset order
+        :type claims: list of Claim
+        :return: None
+        """
+        self.numbers = list()
+        self.index = dict()
+        for position, claim in enumerate(claims):
+            number = int(claim.number) if claim.number else position + 1
+            self.numbers.append(number)
+            self.index[number] = position
+
+        size = len(self.numbers)
+        self.parents = array('l', [-1] * size)
+        self.invalid = list()
+        for position, claim in enumerate(claims):
+            dependency = claim.dependency
+            if dependency is None:
+                dependency = detect_dependency(claim.text)
+            dependency = int(dependency)
+            if not dependency:
+                continue
+            number = self.numbers[position]
+            if dependency < number and dependency in self.index:
+                self.parents[position] = self.index[dependency]
+            else:
+                self.invalid.append(number)
+
+        # Parents always have lower numbers, so number order is a
+        # topological order
+        self.order = array('l', sorted(
+            range(size), key=lambda position: self.numbers[position]
+        ))
+        self.roots = array('l', range(size))
+        self.depths = array('l', [0] * size)
+        for position in self.order:
+            parent = self.parents[position]
+            if parent >= 0:
+                self.roots[position] = self.roots[parent]
+                self.depths[position] = self.depths[parent] + 1
+
+        # Children of each claim in CSR form
+        child_counts = [0] * (size + 1)
+        for parent in self.parents:
+            if parent >= 0:
+                child_counts[parent + 1] += 1
+        self.child_indptr = array('l', [0] * (size + 1))
+        for position in range(size):
+            self.child_indptr[position + 1] = (
+                self.child_indptr[position] + child_counts[position + 1]
+            )
+        self.child_indices = array('l', [0] * self.child_indptr[-1])
+        fill = array('l', self.child_indptr[:-1])
+        for position in range(size):
+            parent = self.parents[position]
+            if parent >= 0:
+                self.child_indices[fill[parent]] = position
+                fill[parent] += 1
+
+        # Depth first order with subtree sizes so the descendants of a
+        # claim are a contiguous slice
+        self.preorder = array('l')
+        self.preorder_position = array('l', [0] * size)
+        self.subtree_size = array('l', [1] * size)
+        for position in self.order:
+            if self.parents[position] >= 0:
+                continue
+            stack = [position]
+            while stack:
+                current = stack.pop()
+                self.preorder_position[current] = len(self.preorder)
+                self.preorder.append(current)
+                start = self.child_indptr[current]
+                end = self.child_indptr[current + 1]
+                stack.extend(reversed(self.child_indices[start:end]))
+        for position in reversed(self.preorder):
+            parent = self.parents[position]
+            if parent >= 0:
+                self.subtree_size[parent] += self.subtree_size[position]
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def get_root(self, number):
+        """ Return the number of the independent claim that claim
+        number ultimately depends on. """
+        return self.numbers[self.roots[self.index[number]]]
+
+    def get_parent(self, number):
+        """ Return the number of the claim that claim number directly
+        depends on, or 0 if independent. """
+        parent = self.parents[self.index[number]]
+        return self.numbers[parent] if parent >= 0 else 0
+
+    def get_depth(self, number):
+        """ Return the length of the dependency chain from claim number
+        to its independent claim. """
+        return self.depths[self.index[number]]
+
+    def get_descendants(self, number):
+        """ Return numbers of all claims that ultimately depend on claim
+        number, in depth first order. """
+        position = self.index[number]
+        start = self.preorder_position[position] + 1
+        end = start + self.subtree_size[position] - 1
+        return [self.numbers[p] for p in self.preorder[start:end]]
+
+    def get_independent(self):
+        """ Return numbers of independent claims. """
+        return [
+            self.numbers[position] for position in range(len(self))
+            if self.parents[position] < 0
+        ]
+
+    def get_groups(self):
+        """ Return a dictionary of independent claim number to a list
+        of the claims in its group, the independent claim first. """
+        groups = dict()
+        for position in self.order:
+            root = self.numbers[self.roots[position]]
+            groups.setdefault(root, list()).append(self.numbers[position])
+        return groups
+
+    def statistics(self):
+        """ Return summary statistics of the dependency structure. """
+        size = len(self)
+        return {
+            'claims': size,
+            'independent': len(self.get_independent()),
+            'invalid': len(self.invalid),
+            'max_depth': max(self.depths) if size else 0,
+            'mean_depth': sum(self.depths) / size if size else 0,
+            'depths': Counter(self.depths)
+        }
+
+
+def dependency_statistics(claimsets):
+    """
+    Aggregate dependency statistics over an iterable of claimsets
+    without holding more than one graph in memory.
+
+    :param claimsets: Claimset objects or lists of Claim objects
+    :type claimsets: iterable
+    :return: dictionary of totals and a depth histogram
+    """
+    totals = {
+        'claimsets': 0,
+        'claims': 0,
+        'independent': 0,
+        'invalid': 0,
+        'max_depth': 0,
+        'depths': Counter()
+    }
+    for claimset in claimsets:
+        claims = getattr(claimset, 'units', claimset)
+        stats = DependencyGraph(claims).statistics()
+        totals['claimsets'] += 1
+        for key in ['claims', 'independent', 'invalid']:
+            totals[key] += stats[key]
+        totals['max_depth'] = max(totals['max_depth'], stats['max_depth'])
+        totals['depths'].update(stats['depths'])
+    if totals['claims']:
+        totals['mean_depth'] = sum(
+            depth * count for depth, count in totals['depths'].items()
+        ) / totals['claims']
+    else:
+        totals['mean_depth'] = 0
+    return totals
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from multiprocessing import Pool
+
+# Punkt model loaded once per process
+_tokenizer = None
+
+
+def get_sentence_tokenizer():
+    """ Return the English Punkt sentence tokenizer used by
+    sent_tokenize, loading it on first use. """
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            # nltk 3.8.2 onwards
+            from nltk.tokenize import PunktTokenizer
+            _tokenizer = PunktTokenizer('english')
+        except ImportError:
+            import nltk
+            _tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+    return _tokenizer
+
+
+def sentence_spans(text):
+    """ Return (start, end) offsets of the sentences in text. These
+    give the same sentences as sent_tokenize(text). """
+    return list(get_sentence_tokenizer().span_tokenize(text))
+
+
+def segment_texts(texts, processes=None, chunksize=200):
+    """
+    Return sentence spans for a list of texts.
+
+    :param texts: texts to segment
+    :type texts: list of str
+    :param processes: number of worker processes; 1 segments in this
+    process, None uses all CPUs
+    :type processes: int
+    :param chunksize: texts sent to a worker at a time
+    :type chunksize: int
+    :return: list of lists of (start, end) tuples
+    """
+    if processes == 1:
+        return [sentence_spans(text) for text in texts]
+    with Pool(processes) as pool:
+        return pool.map(sentence_spans, texts, chunksize)
+
+
+def segment_paragraphs(
+    paragraphs, processes=None, chunksize=200, spans_only=False
+):
+    """
+    Segment the sentences of many Paragraph objects in one batch.
+
+    :param paragraphs: Paragraph objects
+    :type paragraphs: list of Paragraph
+    :param spans_only: if true only store sentence offsets rather
+    than building Sentence objects
+    :type spans_only: bool
+    :return: paragraphs
+    """
+    spans = segment_texts(
+        [para.text for para in paragraphs], processes, chunksize
+    )
+    for para, para_spans in zip(paragraphs, spans):
+        para.set_sentence_spans(para_spans, spans_only)
+    return paragraphs
+
+
+def segment_documents(
+    documents, processes=None, chunksize=200, spans_only=False
+):
+    """
+    Segment the description paragraphs of many PatentDoc objects
+    across a single pool of workers.
+
+    :param documents: PatentDoc objects
+    :type documents: list of PatentDoc
+    :return: documents
+    """
+    paragraphs = [
+        para for doc in documents if doc.description is not None
+        for para in doc.description.units
+    ]
+    segment_paragraphs(paragraphs, processes, chunksize, spans_only)
+    return documents
@@ -1,9 +1,29 @@
 # -*- coding: utf-8 -*-
-from nltk.corpus import stopwords
-from nltk.stem.porter import PorterStemmer
+# nltk is imported by the functions that need it, as loading it and its
+# stopword corpus takes seconds
 
-# Extend these stopwords to include patent stopwords
-ENG_STOPWORDS = stopwords.words('english')
+# English stopwords, loaded on first use
+_stopwords = None
+
+
+def get_stopwords():
+    """ Return the set of English stopwords from the nltk corpus. """
+    # Extend these stopwords to include patent stopwords
+    global _stopwords
+    if _stopwords is None:
+        from nltk.corpus import stopwords
+        _stopwords = frozenset(stopwords.words('english'))
+    return _stopwords
+
+
+def __getattr__(name):
+    # ENG_STOPWORDS was a list loaded at import in earlier versions
+    if name == 'ENG_STOPWORDS':
+        from nltk.corpus import stopwords
+        return stopwords.words('english')
+    raise AttributeError(
+        "module {0!r} has no attribute {1!r}".format(__name__, name)
+    )
 
 
 def check_list(listvar):
@@ -33,11 +53,13 @@ def remove_non_words(tokens):
 
 def remove_stopwords(tokens):
     """ Remove stopwords from tokens. """
-    return [w for w in tokens if w not in ENG_STOPWORDS]
+    stopwords = get_stopwords()
+    return [w for w in tokens if w not in stopwords]
 
 
 def stem(tokens):
     """ Stem passed text tokens. """
+    from nltk.stem.porter import PorterStemmer
     stemmer = PorterStemmer()
     return [stemmer.stem(token) for token in tokens]
 
@@ -52,6 +74,7 @@ def stem_split(tokens):
     stem, ending - inserting ending as extra token.
 
     returns: revised (possibly longer) list of tokens. """
+    from nltk.stem.porter import PorterStemmer
     stemmer = PorterStemmer()
     token_list = list()
     for token in tokens:
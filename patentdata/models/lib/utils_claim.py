@@ -1,21 +1,84 @@
 # -*- coding: utf-8 -*-
 import re
 
+# Patterns compiled once at import rather than on every call
+NUMBER_RE = re.compile(r'\d+\.')
+DIGITS_RE = re.compile(r'\d+')
+DEPENDENCY_RE = re.compile(
+    r'(of|to|with|in)?\s(C|c)laims?\s\d+'
+    r'((\sto\s\d+)|(\sor\s(C|c)laim\s\d+))?(,\swherein)?'
+)
+PRECEDING_RE = re.compile(
+    r'\s(preceding|previous)\s(C|c)laims?(,\swherein)?'
+)
+CATEGORY_RE = re.compile(
+    r'(A|An|The)\s([\w-]+\s)*(method|process)\s(of|for)?'
+)
+
+
+class SuffixTrie:
+    """ Trie of reversed strings used to find which of a set of stored
+    strings another string ends with.
+
+    A lookup walks the reversed string once, so checking a string
+    against n stored strings costs its length rather than n pattern
+    matches.
+    """
+
+    def __init__(self, strings=None):
+        self.root = dict()
+        self.count = 0
+        for string in strings or []:
+            self.add(string)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, string):
+        """ Add string to the trie. Strings keep the order in which
+        they were first added. """
+        node = self.root
+        for char in reversed(string):
+            node = node.setdefault(char, dict())
+        # None cannot clash with a character key so marks the end
+        if None not in node:
+            node[None] = (self.count, string)
+            self.count += 1
+
+    def suffixes_of(self, text):
+        """ Return stored strings that text ends with as a list of
+        (order added, string) tuples, shortest first. """
+        found = list()
+        node = self.root
+        if None in node:
+            found.append(node[None])
+        for char in reversed(text):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                found.append(node[None])
+        return found
+
+    def first_suffix(self, text):
+        """ Return the earliest added string that text ends with, or
+        None if there is no match. """
+        found = self.suffixes_of(text)
+        if found:
+            return min(found)[1]
+        return None
+
 
 def ends_with(s1, s2):
     """See if s1 ends with s2."""
-    pattern = re.compile('(' + re.escape(s2) + ')$')
-    located = pattern.search(s1)
-    if located:
-        return True
-    else:
-        return False
+    # Equivalent to searching for '(s2)$', which also matches before
+    # a trailing newline
+    return s1.endswith(s2) or s1.endswith(s2 + "\n")
 
 
 def get_number(text):
     """Extracts the claim number from the text."""
-    p = re.compile(r'\d+\.')
-    located = p.search(text)
+    located = NUMBER_RE.search(text)
     if located:
         # Set claim number as digit before fullstop
         number = int(located.group()[:-1])
@@ -35,20 +98,12 @@ def detect_dependency(text):
     :type text: str
     :return: dependency as int
     """
-    p = re.compile(
-        r'(of|to|with|in)?\s(C|c)laims?\s\d+'
-        r'((\sto\s\d+)|(\sor\s(C|c)laim\s\d+))?(,\swherein)?'
-    )
-    located = p.search(text)
+    located = DEPENDENCY_RE.search(text)
     if located:
-        num = re.compile('\d+')
-        dependency = int(num.search(located.group()).group())
+        dependency = int(DIGITS_RE.search(located.group()).group())
     else:
         # Also check for "preceding claims" or "previous claims" = claim 1
-        pre = re.compile(
-            r'\s(preceding|previous)\s(C|c)laims?(,\swherein)?'
-        )
-        located = pre.search(text)
+        located = PRECEDING_RE.search(text)
         if located:
             dependency = 1
         else:
@@ -66,10 +121,28 @@ def detect_category(text):
     :type text: str
     :return: category as string
     """
-    p = re.compile('(A|An|The)\s([\w-]+\s)*(method|process)\s(of|for)?')
-    located = p.search(text)
+    located = CATEGORY_RE.search(text)
     # Or store as part of claim object property?
     if located:
         return "method"
     else:
         return "system"
+
+
+def analyse_claims(texts):
+    """
+    Determine number, dependency and category for each claim of a
+    claimset in a single pass.
+
+    :param texts: claim texts
+    :type texts: list of str
+    :return: list of dicts with 'number', 'dependency' and 'category'
+    """
+    return [
+        {
+            'number': get_number(text)[0],
+            'dependency': detect_dependency(text),
+            'category': detect_category(text)
+        }
+        for text in texts
+    ]
@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
-from nltk.tokenize import sent_tokenize
 import re
-import operator
 import warnings
 from patentdata.models.claim import check_claim_class, Claim
-from patentdata.models.lib.utils_claim import (
-    get_number, detect_dependency, detect_category
+from patentdata.models.lib.utils_claim import get_number, analyse_claims
+
+# Claim splitting pattern - optional "n. " number then text up to a
+# full stop at the end of a line or of the text
+CLAIM_RE = re.compile(
+    r'((\d+)\s*\.[ |\t])?([A-Z].*?[\.])\s*(\n|$)', re.DOTALL
 )
 
+# Extractors are tried in this order - passed numbering first as it is
+# cheap and preferred, then regex, and only then the slower nltk
+EXTRACTOR_ORDER = ['passed', 'regex', 'nltk']
+# On equal scores prefer passed numbering, then nltk, then regex
+EXTRACTOR_PREFERENCE = ['passed', 'nltk', 'regex']
+
 
 def nltk_extract_claims(text):
     """
@@ -15,11 +23,12 @@ def nltk_extract_claims(text):
     Uses nltk sent_tokenize function in tokenize library
     param string text: string containing several claims
     """
+    from nltk.tokenize import sent_tokenize
     sent_list = sent_tokenize(text)
     # On a test string this returned a list with the claim number
     # and then the claim text as separate items
     claims_list = []
-    for i in range(0, len(sent_list), 2):
+    for i in range(0, len(sent_list) - 1, 2):
         try:
             number = int(sent_list[i].split(".")[0])
         except:
@@ -41,14 +50,12 @@ def regex_extract_claims(text):
     :type text: str
     :return: list of tuples (claim_number, claim_text)
     """
-    claim_r = r'((\d+)\s*\.[ |\t])?([A-Z].*?[\.])\s*\n'
-    matches = re.finditer(claim_r, text, re.DOTALL)
     claimset_list = []
-    for match_num, match in enumerate(matches):
+    for match_num, match in enumerate(CLAIM_RE.finditer(text)):
         match_num = match_num + 1
         claim_text = match.group(3)
         if match.group(2):
-            number = match.group(2)
+            number = int(match.group(2))
         else:
             number = match_num
         claimset_list.append((number, claim_text))
@@ -190,9 +197,10 @@ def check_dependencies(claimset_data):
     """
     category = {}
     try:
-        for number, text in claimset_data:
-            dependency = detect_dependency(text)
-            category[number] = detect_category(text)
+        analysis = analyse_claims([text for _, text in claimset_data])
+        for (number, _), claim_data in zip(claimset_data, analysis):
+            dependency = claim_data['dependency']
+            category[number] = claim_data['category']
             # Check dependency is less than current claim number
             if dependency >= number:
                 return False
@@ -216,37 +224,43 @@ def clean_data(data_in):
     if check_set_claims(data_in):
         return data_in
 
-    claimset_data = {}
     # Generate a string of all data in
     if isinstance(data_in, list):
         string_data_in = '\n'.join(data_in)
-
-        # Check if claimset data has tuples with claim numbers
-        if not check_for_number(data_in):
-            claimset_data['passed'] = get_numbers(data_in)
     else:
         string_data_in = data_in
-        claimset_data['passed'] = []
-
-    # Use regex to split into claims with number
-    claimset_data['regex'] = regex_extract_claims(string_data_in)
-
-    # Use sentence tokenization to split into claims with number
-    claimset_data['nltk'] = nltk_extract_claims(string_data_in)
 
+    extractors = {
+        # Use regex to split into claims with number
+        'regex': lambda: regex_extract_claims(string_data_in),
+        # Use claim numbers in passed list entries
+        'passed': lambda: (
+            get_numbers(data_in)
+            if isinstance(data_in, list) and not check_for_number(data_in)
+            else []
+        ),
+        # Use sentence tokenization to split into claims with number
+        'nltk': lambda: nltk_extract_claims(string_data_in)
+    }
+
+    # Run extractors in order and stop once a candidate passes all
+    # checks - passed numbering is run first so it still wins on a tie
+    claimset_data = {}
     scores = {}
-
-    scores['regex'] = score_claimset(claimset_data['regex'])
-    scores['nltk'] = score_claimset(claimset_data['nltk'])
-    scores['passed'] = score_claimset(claimset_data['passed'])
-
-    sorted_scores = sorted(scores.items(), key=operator.itemgetter(1))
+    for name in EXTRACTOR_ORDER:
+        claimset_data[name] = extractors[name]()
+        scores[name] = score_claimset(claimset_data[name])
+        if scores[name] == 1:
+            break
 
     # Top score
-    top_score = sorted_scores[-1]
-    if top_score[1] < 1:
+    top_name = max(
+        [name for name in EXTRACTOR_PREFERENCE if name in scores],
+        key=lambda name: scores[name]
+    )
+    if scores[top_name] < 1:
         warnings.warn("Some claim checks failed for the claimset")
-    data_out = claimset_data[top_score[0]]
+    data_out = claimset_data[top_name]
 
     claimset_out = [
                 Claim(claimtext, number)
@@ -1,25 +1,155 @@
 # -*- coding: utf-8 -*-
 from collections import Counter
 
-from patentdata.models.specification import PatentDoc
-from patentdata.xmlparser import XMLDoc
+from patentdata.models.patentdoc import PatentDoc
+import patentdata.utils as utils
+
+# Arguments a data source can apply itself when generating documents
+SOURCE_FILTERS = ['classification', 'publication_numbers', 'sample_size']
 
 
 class PatentCorpus:
-    """ Object to model a collection of patent documents. """
-    def __init__(self, documents):
+    """ Object to model a collection of patent documents.
+
+    Documents are either held in a list or read lazily from a data
+    source such as USPublications, USGrants or EPOOPS. Reading from a
+    source happens in a background thread that keeps prefetch documents
+    ready, and filter() passes classification and publication number
+    limits to the source so only matching files are read.
+    """
+    def __init__(
+        self, documents=None, datasource=None, prefetch=8, xml=False,
+        **filters
+    ):
         """ Initialise corpus.
 
         :param documents: list of patent documents
-        :type documents: PatentDoc
-        :return: PatentCorpus object
-
+        :type documents: list of PatentDoc
+        :param datasource: source to read documents from instead
+        :type datasource: BasePatentDataSource
+        :param prefetch: documents read ahead of the consumer; 0 reads
+        in the calling thread
+        :type prefetch: int
+        :param xml: if true iterate over XMLDoc objects from the
+        source's xmldoc_generator rather than parsed PatentDocs
+        :type xml: bool
+        :param filters: classification, publication_numbers and
+        sample_size arguments for the source's generator
+        :return: None
         """
-        for doc in documents:
-            if not isinstance(doc, PatentDoc):
-                raise ValueError("Input must be a list of PatentDoc objects")
+        if documents is not None and datasource is not None:
+            raise ValueError("Pass either documents or a datasource")
+        unknown = set(filters) - set(SOURCE_FILTERS)
+        if unknown:
+            raise TypeError(
+                "Unknown filters: {0}".format(", ".join(sorted(unknown)))
+            )
+        if documents is not None:
+            documents = list(documents)
+            for doc in documents:
+                if not isinstance(doc, PatentDoc):
+                    raise ValueError(
+                        "Input must be a list of PatentDoc objects"
+                    )
+        elif datasource is None:
+            documents = list()
         self.documents = documents
-        return self
+        self.datasource = datasource
+        self.prefetch = prefetch
+        self.xml = xml
+        self.filters = filters
+        # (kind, function) stages applied in order as documents are read
+        self.stages = list()
+
+    def _derive(self, filters=None, stage=None):
+        """ Return a copy of the corpus with more filters or a stage. """
+        corpus = PatentCorpus.__new__(PatentCorpus)
+        corpus.__dict__.update(self.__dict__)
+        corpus.filters = dict(self.filters, **(filters or {}))
+        corpus.stages = self.stages + ([stage] if stage else [])
+        return corpus
+
+    def _source_documents(self):
+        """ Return an iterator over documents before any stages. """
+        if self.datasource is None:
+            return iter(self.documents)
+        if self.xml:
+            generator = self.datasource.xmldoc_generator
+        else:
+            generator = self.datasource.patentdoc_generator
+        # Only pass filters that are set as sources differ in which
+        # arguments they accept
+        kwargs = {
+            key: value for key, value in self.filters.items()
+            if value is not None
+        }
+        return utils.prefetch(generator(**kwargs), self.prefetch)
+
+    def __iter__(self):
+        """ Iterate over documents, reading them lazily from the data
+        source. """
+        for doc in self._source_documents():
+            if doc is None:
+                continue
+            keep = True
+            for kind, function in self.stages:
+                if kind == 'map':
+                    doc = function(doc)
+                elif not function(doc):
+                    keep = False
+                    break
+            if keep:
+                yield doc
+
+    def __len__(self):
+        """ Number of documents, taken from the data source index
+        without reading any documents. """
+        if any(kind == 'filter' for kind, _ in self.stages):
+            raise TypeError("Length is unknown for a corpus with a filter")
+        if self.datasource is None:
+            return len(self.documents)
+        number = self.datasource.count(**self.filters)
+        if number is None:
+            raise TypeError("Length is unknown for this data source")
+        return number
+
+    def map(self, function):
+        """ Return a corpus applying function to each document.
+
+        :param function: called with each document, returning the
+        value to yield in its place
+        :type function: callable
+        :return: PatentCorpus
+        """
+        return self._derive(stage=('map', function))
+
+    def filter(self, function=None, **filters):
+        """ Return a corpus limited to some documents.
+
+        Keyword filters (classification, publication_numbers and
+        sample_size) are applied by the data source when it selects
+        files, so excluded documents are never read. function is
+        applied to each document that is read.
+
+        :param function: called with each document, returning True to
+        keep it
+        :type function: callable
+        :return: PatentCorpus
+        """
+        unknown = set(filters) - set(SOURCE_FILTERS)
+        if unknown:
+            raise TypeError(
+                "Unknown filters: {0}".format(", ".join(sorted(unknown)))
+            )
+        if filters and self.datasource is None:
+            raise ValueError("Keyword filters need a datasource")
+        if filters and self.stages:
+            raise ValueError(
+                "Keyword filters must be applied before map or filter "
+                "functions"
+            )
+        stage = ('filter', function) if function else None
+        return self._derive(filters, stage)
 
     def add_document(self, document):
         """ Add a document to the corpus.
@@ -29,6 +159,8 @@ class PatentCorpus:
         :return: PatentCorpus object
 
         """
+        if self.documents is None:
+            raise ValueError("Cannot add documents to a datasource corpus")
         if not isinstance(document, PatentDoc):
             raise ValueError("Input must be a list of PatentDoc objects")
         self.documents.append(document)
@@ -37,70 +169,25 @@ class PatentCorpus:
     def char_stats(self):
         """ Provide statistics on characters in corpus."""
         sum_counter = Counter()
-        for doc in self.documents:
-            sum_counter += Counter(doc)
+        for doc in self:
+            sum_counter += doc.character_counter
         print(
             "Documents contain {0} unique characters.".format(len(sum_counter))
             )
         return sum_counter
 
-
-# May not need this - functionality handled by USPublications object
-class LazyPatentCorpus:
-    """ Object to model a collection of patent documents that loads
-    each document from file lazily. """
-
-    def init_by_id(self, list_of_ids, id_type):
-        """ Initialise with a list of ids, where id_type is rowid or
-        publication (number)."""
-        # Need to run a query to get list of filename, name entries
-
-        # Then we can call init_by_filenames
-        pass
-
-    def init_by_classification(self, classification, sample_size=None):
-        """ Initialise with a classification of kind ["G", "06"] with
-        one to five entries.
-
-        Sample_size randomly samples to a particular
-        number if supplied.
-
-        If classification is None or an empty list, select a random
-        sample across all classifications."""
-        # Need to run a query to get list of filename, name entries
-
-        # Then we can call init_by_filenames
-        pass
-
-    def init_by_filenames(self, datasource, filelist):
-        """ Initialise with a list of file references of the format
-        (id, filename, name)."""
-        self.datasource = datasource
-        self.filelist = filelist
-
-    @property
-    def documents(self):
-        for _, filedata in self.datasource.iter_read(self.filelist):
-            yield XMLDoc(filedata).to_patentdoc()
-
-    def __iter__(self):
-        """ Iterator to return patent documents. """
-        # This needs to basically run iter_read(filelist) then
-        # wrap the output filedata through XMLDoc(filedata).to_patent
-        pass
-
     def build_token_dict(self):
         """ Iterate through documents to build a dictionary of tokens. """
         # Unfiltered
         total_token_counter = Counter()
-        for doc in self.documents:
+        for doc in self:
             total_token_counter += doc.unfiltered_counter
         self.token_dict = {
             t: i for i, t in enumerate(total_token_counter.keys())
             }
         # Do we want to filter here and UNK rare tokens
+        return self.token_dict
+
 
-    def docs_to_index(self):
-        """ Go through documents replacing tokens with the index in
-        the token dictionary."""
-        pass
+# Earlier name for a corpus read from a data source
+LazyPatentCorpus = PatentCorpus
@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-from nltk import word_tokenize
 import string
 
 
@@ -37,14 +36,48 @@ class PatentDoc:
                 self.classifications
             )
 
+    def _text_key(self):
+        """ Identify the description and claimset text is built from. """
+        return tuple(
+            (id(part), part.version) if part is not None else None
+            for part in [self.description, self.claimset]
+        )
+
     @property
     def text(self):
-        """  Get text of patent document as string. """
+        """  Get text of patent document as string.
+
+        The joined text is cached until the description or claimset is
+        replaced or invalidated.
+        """
+        key = self._text_key()
+        cached = self.__dict__.get("_text_cache")
+        if cached is not None and cached[0] == key:
+            return cached[1]
         if self.description:
             desc_text = self.description.text
         else:
             desc_text = ""
-        return "\n\n".join([desc_text, self.claimset.text])
+        text = "\n\n".join([desc_text, self.claimset.text])
+        self._text_cache = (key, text)
+        return text
+
+    def compact(self):
+        """ Hold the document text as a single buffer.
+
+        Paragraphs and claims become spans of the buffer instead of
+        each holding a copy of their text, and text no longer needs to
+        be joined on access.
+
+        :return: self
+        """
+        buffer = self.text
+        if self.description:
+            claims_start = self.description.compact(buffer, 0) + 2
+        else:
+            claims_start = 2
+        self.claimset.compact(buffer, claims_start)
+        return self
 
     @property
     def unfiltered_counter(self):
@@ -75,7 +108,10 @@ class PatentDoc:
     def reading_time(self, reading_rate=100):
         """ Return estimate for time to read. """
         # Words per minute = between 100 and 200
-        return len(word_tokenize(self.text)) / reading_rate
+        word_count = self.claimset.word_count
+        if self.description:
+            word_count += self.description.word_count
+        return word_count / reading_rate
 
     def bag_of_words(
         self, clean_non_words=True, clean_stopwords=True, stem_words=True
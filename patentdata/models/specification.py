@@ -1,30 +1,59 @@
 # -*- coding: utf-8 -*-
-from nltk import sent_tokenize
 from patentdata.models.basemodels import BaseTextSet, BaseTextBlock
 from patentdata.models.lib.utils import check_list
+from patentdata.models.lib.segmenter import (
+    sentence_spans, segment_paragraphs
+)
 
 
 class Paragraph(BaseTextBlock):
     """ Object to model a paragraph of a patent description. """
 
+    __slots__ = ('_sentence_spans', '_sentences')
+
+    @property
+    def sentence_spans(self):
+        """ (start, end) offsets of sentences, segmented when accessed. """
+        try:
+            return self._sentence_spans
+        except AttributeError:
+            self._sentence_spans = sentence_spans(self.text)
+            return self._sentence_spans
+
+    def set_sentence_spans(self, spans, spans_only=False):
+        """ Store sentence offsets from a batch segmentation. Unless
+        spans_only is true Sentence objects are also built. """
+        self._sentence_spans = spans
+        try:
+            del self._sentences
+        except AttributeError:
+            pass
+        if not spans_only:
+            self.sentences
+
     @property
     def sentences(self):
         """ If sentences have not been segmented, segment when accessed. """
         try:
             return self._sentences
         except AttributeError:
-            self._sentences = [Sentence(s) for s in sent_tokenize(self.text)]
+            # Sentences are views of the same buffer as the paragraph
+            buffer, offset, _ = self.get_span()
+            self._sentences = [
+                Sentence.from_span(buffer, offset + start, offset + end)
+                for start, end in self.sentence_spans
+            ]
             return self._sentences
 
     @property
     def sentence_count(self):
-        return len(self.sentences)
+        return len(self.sentence_spans)
 
 
 class Sentence(BaseTextBlock):
     """ Object to model a sentence of a patent description. """
 
-    pass
+    __slots__ = ()
 
 
 class Description(BaseTextSet):
@@ -70,6 +99,20 @@ class Description(BaseTextSet):
         """ Return count of sentences. """
         return sum([p.sentence_count for p in self.units])
 
+    def segment(self, processes=None, chunksize=200, spans_only=False):
+        """ Segment sentences of all paragraphs in one batch across
+        a pool of worker processes.
+
+        :param processes: number of worker processes; 1 segments in
+        this process, None uses all CPUs
+        :type processes: int
+        :param spans_only: if true only store sentence offsets
+        :type spans_only: bool
+        :return: self
+        """
+        segment_paragraphs(self.units, processes, chunksize, spans_only)
+        return self
+
 
 class Figures:
     """ Object to model a set of patent figures. """
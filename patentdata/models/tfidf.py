@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import math
+from array import array
+from collections import Counter
+
+
+def document_term_counts(document, stopwords=True):
+    """ Return raw term counts across the description and claims
+    of a PatentDoc object.
+
+    :param document: patent document
+    :type document: PatentDoc
+    :param stopwords: if true remove English stopwords
+    :type stopwords: bool
+    :return: Counter of lowercased terms
+    """
+    counter = Counter()
+    for text_set in (document.description, document.claimset):
+        if text_set is None:
+            continue
+        for unit in text_set.units:
+            counter.update(
+                unit.get_word_freq(stopwords=stopwords, normalize=False)
+            )
+    return counter
+
+
+class TfidfMatrix:
+    """ Document-term matrix built incrementally from a stream of
+    PatentDoc objects.
+
+    Raw term counts are held in compressed sparse row (CSR) form -
+    data, indices and indptr arrays - that can be passed straight to
+    scipy.sparse.csr_matrix. Document frequencies are updated as each
+    document is added so IDF values are available at any point.
+    """
+
+    def __init__(self, stopwords=True):
+        """ Initialise an empty matrix.
+
+        :param stopwords: if true remove English stopwords from terms
+        :type stopwords: bool
+        :return: None
+        """
+        self.stopwords = stopwords
+        # Map of term to column and column to term
+        self.vocabulary = dict()
+        self.terms = list()
+        # Number of documents each column appears in
+        self.document_frequency = array('l')
+        # Document number for each row
+        self.doc_ids = list()
+        # CSR arrays of raw counts
+        self.indptr = array('l', [0])
+        self.indices = array('l')
+        self.data = array('d')
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @property
+    def shape(self):
+        """ Return (documents, terms) shape of matrix. """
+        return (len(self.doc_ids), len(self.terms))
+
+    def add_counts(self, counts, doc_id=None):
+        """ Add a row of term counts to the matrix.
+
+        :param counts: mapping of term to count
+        :type counts: dict or Counter
+        :param doc_id: identifier stored for the row
+        :return: row index as int
+        """
+        row = list()
+        for term, count in counts.items():
+            if not count:
+                continue
+            column = self.vocabulary.get(term)
+            if column is None:
+                column = len(self.terms)
+                self.vocabulary[term] = column
+                self.terms.append(term)
+                self.document_frequency.append(0)
+            self.document_frequency[column] += 1
+            row.append((column, count))
+        # Keep column indices sorted within each row
+        row.sort()
+        for column, count in row:
+            self.indices.append(column)
+            self.data.append(count)
+        self.indptr.append(len(self.indices))
+        self.doc_ids.append(doc_id)
+        return len(self.doc_ids) - 1
+
+    def add_document(self, document):
+        """ Add a PatentDoc object to the matrix.
+
+        :param document: patent document
+        :type document: PatentDoc
+        :return: row index as int
+        """
+        return self.add_counts(
+            document_term_counts(document, self.stopwords),
+            document.number
+        )
+
+    def fit(self, documents):
+        """ Add documents from an iterable, e.g. the output of a data
+        source's patentdoc_generator(). None entries are skipped.
+
+        :return: self
+        """
+        for document in documents:
+            if document is not None:
+                self.add_document(document)
+        return self
+
+    def idf(self, term):
+        """ Return the smoothed inverse document frequency of term.
+
+        idf = log((1 + N) / (1 + df)) + 1, so terms that have not been
+        seen get the highest weight rather than a division by zero.
+        """
+        column = self.vocabulary.get(term)
+        df = self.document_frequency[column] if column is not None else 0
+        return math.log((1 + len(self.doc_ids)) / (1 + df)) + 1
+
+    def idf_vector(self):
+        """ Return IDF values for every column as an array. """
+        n_docs = len(self.doc_ids)
+        return array('d', [
+            math.log((1 + n_docs) / (1 + df)) + 1
+            for df in self.document_frequency
+        ])
+
+    def tf_idf(self):
+        """ Return TF-IDF weights as CSR (data, indices, indptr) arrays.
+
+        Term frequencies are normalised by the total count in each
+        document, matching get_word_freq(normalize=True).
+        """
+        idf = self.idf_vector()
+        weights = array('d', self.data)
+        for row in range(len(self.doc_ids)):
+            start, end = self.indptr[row], self.indptr[row + 1]
+            total = sum(self.data[start:end])
+            if not total:
+                continue
+            for i in range(start, end):
+                weights[i] = (self.data[i] / total) * idf[self.indices[i]]
+        return weights, array('l', self.indices), array('l', self.indptr)
+
+    def to_scipy(self, weighted=True):
+        """ Return the matrix as a scipy.sparse.csr_matrix.
+
+        :param weighted: if true return TF-IDF weights, else raw counts
+        :type weighted: bool
+        """
+        try:
+            from scipy.sparse import csr_matrix
+        except ImportError:
+            raise ImportError("scipy is required to build a sparse matrix")
+        if weighted:
+            data, indices, indptr = self.tf_idf()
+        else:
+            data, indices, indptr = self.data, self.indices, self.indptr
+        return csr_matrix((data, indices, indptr), shape=self.shape)
+
+    def document_tf_idf(self, row):
+        """ Return a dictionary of term: TF-IDF weight for a row. """
+        start, end = self.indptr[row], self.indptr[row + 1]
+        total = sum(self.data[start:end])
+        return {
+            self.terms[self.indices[i]]:
+                (self.data[i] / total) * self.idf(self.terms[self.indices[i]])
+            for i in range(start, end)
+        }
+
+    def claim_tf_idf(self, claim):
+        """ Calculate term frequency - inverse document frequency
+        statistics for a claim against the corpus.
+
+        Returns the same structure as Claimset.claim_tf_idf: a list of
+        {'term', 'tf', 'tf_idf'} dictionaries sorted by tf_idf.
+        """
+        word_freqs = claim.get_word_freq(
+            stopwords=self.stopwords, normalize=True
+        )
+        tf_idf = [{
+            'term': key,
+            'tf': word_freqs[key],
+            'tf_idf': word_freqs[key]*self.idf(key)
+            }
+            for key in word_freqs]
+        return sorted(tf_idf, key=lambda k: k['tf_idf'], reverse=True)
@@ -11,15 +11,23 @@ from epo_ops.models import Epodoc
 
 import math
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from sqlalchemy.orm import object_session
 
 # Import helper utilities
-import utils
+import patentdata.utils as utils
 
 # Import database objects to store data
-import datamodels
+import patentdata.datamodels as datamodels
 
 # Import datacache models
-import datacache
+import patentdata.datacache as datacache
+
+from patentdata.corpus.epo.fetcher import ConcurrentFetcher, OPSClient
+from patentdata.corpus.epo.search import SearchRunner
 
 chars_to_delete = [".", "&", ",", "/"]
 chars_to_space = ["+","-"]
@@ -28,60 +36,122 @@ company_stopwords = ["AB", "AS", "AG", "CORPORATION", "CORP", "GMBH", "CO", "COM
                      "KG", "NV", "LIMITED", "LTD", "BV", "INC", "SAS", "OY", "SARL", "PTE", 
                      "SPA", "KK", "LP", "LLC", "EV", "PLC", "VZW", "DD", "DOO", "SNC", "OYJ", "UK"]
 
-# Load country stopwords
-countries = [line.strip().split("|")[1].upper() for line in open("data/countries.txt", 'r')]
+# Directory holding countries.txt and config.ini, relative to the working 
+# directory when they are first needed
+data_dir = "data"
 
-# Upgrade name processing function
-stopwords = company_stopwords + countries
+# Configure logging - the log file is only created when first written
+logging.basicConfig(
+    handlers=[logging.FileHandler('patentdata.log', delay=True)], 
+    level=logging.INFO, format='%(asctime)s %(message)s'
+)
 
-# Configure logging
-logging.basicConfig(filename='patentdata.log', level=logging.INFO, format='%(asctime)s %(message)s')
+_client = None
+_client_lock = threading.Lock()
 
-# Load Key and Secret from config file called "config.ini" 
-parser = configparser.ConfigParser()
-parser.read(os.path.abspath(os.getcwd() + '/data/config.ini'))
-consumer_key = parser.get('Login Parameters', 'C_KEY')
-consumer_secret = parser.get('Login Parameters', 'C_SECRET')
+@lru_cache(maxsize=None)
+def get_countries():
+    """ Load country stopwords. """
+    with open(os.path.join(data_dir, "countries.txt"), 'r') as f:
+        return [line.strip().split("|")[1].upper() for line in f]
 
-# Intialise EPO OPS client
-# Load Dogpile if it exists - if not just use Throttler
-try:
-    middlewares = [
-        epo_ops.middlewares.Dogpile(),
-        epo_ops.middlewares.Throttler(),
-    ]
-except:
-    middlewares = [
-        epo_ops.middlewares.Throttler()
-    ]
+def get_stopwords():
+    """ Company and country stopwords removed from applicant names. """
+    return company_stopwords + get_countries()
+
+@lru_cache(maxsize=None)
+def get_credentials():
+    """ Load Key and Secret from config file called "config.ini" 
+    return: (consumer key, consumer secret)"""
+    parser = configparser.ConfigParser()
+    parser.read(os.path.abspath(os.path.join(data_dir, 'config.ini')))
+    return (
+        parser.get('Login Parameters', 'C_KEY'), 
+        parser.get('Login Parameters', 'C_SECRET')
+    )
+
+def get_client():
+    """ Return the EPO OPS client, initialising it on first use. """
+    global _client
+    with _client_lock:
+        if _client is None:
+            # Load Dogpile if it exists - if not just use Throttler
+            try:
+                middlewares = [
+                    epo_ops.middlewares.Dogpile(),
+                    epo_ops.middlewares.Throttler(),
+                ]
+            except:
+                middlewares = [
+                    epo_ops.middlewares.Throttler()
+                ]
+            consumer_key, consumer_secret = get_credentials()
+            _client = OPSClient(
+                key=consumer_key, 
+                secret=consumer_secret, 
+                accept_type='json',
+                middlewares=middlewares)
+        return _client
+
+def __getattr__(name):
+    # Module attributes of earlier versions, now loaded on first use
+    lazy_attributes = {
+        "countries": get_countries,
+        "stopwords": get_stopwords,
+        "consumer_key": lambda: get_credentials()[0],
+        "consumer_secret": lambda: get_credentials()[1],
+        "registered_client": get_client
+    }
+    if name in lazy_attributes:
+        return lazy_attributes[name]()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+class NameNormaliser(object):
+    """ Clean applicant names for better search, e.g. for dedupe.
+
+    The stopword pattern and character tables are built once and results
+    are cached, so normalising many names costs little more than looking
+    up the names already seen."""
 
-registered_client = epo_ops.RegisteredClient(
-    key=consumer_key, 
-    secret=consumer_secret, 
-    accept_type='json',
-    middlewares=middlewares)
+    def __init__(self, stopwords, cache_size=100000):
+        """ param list stopwords: words removed from names, in order
+        param int cache_size: number of normalised names kept """
+        # Delete certain characters and change others to spaces
+        table = {ord(char): None for char in chars_to_delete}
+        table.update({ord(char): " " for char in chars_to_space})
+        self.table = table
+        self.pattern = re.compile(r'\b(' + r'|'.join(stopwords) + r')\b\s*')
+        self.normalise = lru_cache(maxsize=cache_size)(self._normalise)
 
+    def _normalise(self, name):
+        """ Clean one applicant name. """
+        # Capitalise and remove text to the right of any comma
+        processed_name = name.upper().split(',')[0].translate(self.table)
+        # Remove bracketed words
+        processed_name = utils.remove_bracketed(processed_name)
+        # Delete stopwords
+        processed_name = self.pattern.sub('', processed_name)
+        # Get rid of double spaces
+        return processed_name.replace("  ", " ").strip()
+
+    def normalise_many(self, names):
+        """ Clean a list of applicant names. """
+        normalise = self.normalise
+        return [normalise(name) for name in names]
+
+@lru_cache(maxsize=None)
+def get_normaliser():
+    """ Return the shared NameNormaliser for company and country stopwords. """
+    return NameNormaliser(get_stopwords())
 
 def process_name(name):
     """ Clean applicant name for better search."""
-    # Capitalise
-    name = name.upper()
-    # Remove text to the right of any comma
-    processed_name = name.split(',')[0]
-    # Delete certain characters
-    for char in chars_to_delete:
-        processed_name = processed_name.replace(char, "")
-    # Change certain characters to spaces
-    for char in chars_to_space:
-        processed_name = processed_name.replace(char, " ")
-    # Remove bracketed words
-    processed_name = utils.remove_bracketed(processed_name)   
-    # Delete stopwords 
-    pattern = re.compile(r'\b(' + r'|'.join(stopwords) + r')\b\s*')
-    processed_name = pattern.sub('', processed_name)
-    # Get rid of double spaces
-    processed_name = processed_name.replace("  ", " ")
-    return processed_name.strip()
+    return get_normaliser().normalise(name)
+
+def process_names(names):
+    """ Clean a list of applicant names for better search."""
+    return get_normaliser().normalise_many(names)
 
 def generate_search_string(applicant_name, year=None, country="EP"):
     """ Return cql search string given a name string and year. """
@@ -92,52 +162,44 @@ def generate_search_string(applicant_name, year=None, country="EP"):
         search_string = " and ".join([search_string, "pd within {0}""".format(year)])
     return search_string
 
-def get_search(raw_companies_list):
-    """ Get search results for companies in raw_companies_list. """
+def get_search(raw_companies_list, output=None, checkpoint=None, workers=4):
+    """ Get search results for companies in raw_companies_list. 
+    
+    Each company's results are paged through in full and appended to 
+    output as a line of JSON as soon as they are retrieved. Companies 
+    already in the checkpoint file are skipped, so an interrupted run 
+    can be restarted with the same output.
+    
+    param list raw_companies_list: applicant names
+    param string output: JSON lines file, by default a new file in savedata
+    param string checkpoint: file of completed companies
+    param int workers: number of companies searched at once
+    return: number of companies written"""
 
     # Initialise year
     year = utils.get_current_year()
-    # Intialise data dump
-    data = []
+    if not output:
+        time_string = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        output = "".join(["savedata/", time_string, "BiblioSearch.jsonl"])
     
-    for company in raw_companies_list:
-        company_name = process_name(company)
+    queries = []
+    company_names = process_names(raw_companies_list)
+    for company, company_name in zip(raw_companies_list, company_names):
         search_string = generate_search_string(company_name, year)
         logging.info("Processing {0} with Search String: {1}".format(company, search_string))
-        try:
-            results = registered_client.published_data_search(search_string, range_begin=1, range_end=100)
-            results_json = results.json()['ops:world-patent-data']['ops:biblio-search']
-           
-            total_results = utils.safeget(results_json, '@total-result-count')
-            logging.info("Total results: {0}".format(total_results))
-            number_objects = utils.check_list(utils.safeget(results_json,'ops:search-result','ops:publication-reference'))
-            if number_objects:
-                numbers = [utils.safeget(result,'document-id','country','$') + utils.safeget(result, 'document-id', 'doc-number','$') for result in number_objects]
-            else:
-                numbers = []
-            data.append({
-                    "applicant": company_name, 
-                    "raw_applicant":company, 
-                    "total_results":total_results, 
-                    "numbers":numbers,
-                    "raw_data": results_json
-                })
-        except KeyError:
-            data.append({
-                    "applicant": company_name, 
-                    "raw_applicant":company, 
-                    "total_results":"", 
-                    "numbers":"",
-                    "raw_data": results_json
-                })
-        except:
-            logging.info("Status error: {0}".format(results.status_code))
-            logging.info("Response dump: {0}".format(results.text))
-            logging.info("Unexpected error:", sys.exc_info()[0])
-        
-        time.sleep(1)
+        queries.append((
+            company, 
+            search_string, 
+            {"applicant": company_name, "raw_applicant": company}
+        ))
     
-    save_data("BiblioSearch", data)
+    # Searches share one rate limiter, which adapts to OPS throttling
+    consumer_key, consumer_secret = get_credentials()
+    fetcher = ConcurrentFetcher(
+        consumer_key, consumer_secret, workers, accept_type='json'
+    )
+    runner = SearchRunner(fetcher, output, checkpoint, workers)
+    return runner.run(queries)
 
 def search_applicant_ops(applicant_name, country="EP", year=None):
     pass
@@ -159,7 +221,7 @@ def get_register(number):
     (e.g. EP3065066) """
     # Add here to first check cached data? - do this externally to function?
     try:
-        register_search = registered_client.register("publication", Epodoc(number))
+        register_search = get_client().register("publication", Epodoc(number))
         return register_search.json()
     except:
         return None
@@ -188,87 +250,139 @@ def get_agent_class(results_json):
         result_dict = None
     return result_dict
 
-def save_register(number):
-    """Save agent / class data for PatentPublication object number."""
-    
-    session = datamodels.Session()
-    cachesession = datacache.Session()
-    
-    publication_number = number.pub_no
-    print("Getting register data for {0}".format(publication_number))
+def fetch_register(number, fetcher):
+    """ Get EP Register data for a publication no. within OPS quotas. """
+    try:
+        return fetcher.request('other', 'register', "publication", Epodoc(number)).json()
+    except:
+        return None
+
+def fetch_registers(numbers, fetcher):
+    """ Get EP Register data for several publication nos. concurrently.
+    return: dict of publication no. to register JSON or None"""
+    with ThreadPoolExecutor(fetcher.workers) as pool:
+        results = pool.map(lambda number: fetch_register(number, fetcher), numbers)
+        return dict(zip(numbers, results))
 
-    # Check for number in cache
-    in_cache = cachesession.query(datacache.RegisterCache).filter(datacache.RegisterCache.pub_no == publication_number).first()
+def apply_agent_class(publication, result_dict):
+    """ Store agent / classification details on a PatentPublication. 
+    The publication is left unchanged if the details cannot be processed. """
+    # Build classification records first so errors don't leave partial changes
+    classifications = [
+        datamodels.Classification(**c) 
+        for c in process_classification(result_dict["classification"] or "")
+    ]
+    publication.raw_agent = result_dict["agent"]
+    publication.raw_agent_first_address = result_dict["agent_first_address"]
+    publication.raw_agent_country = result_dict["agent_country"]
+    publication.raw_classification = result_dict["classification"]
+    publication.classifications = classifications
 
-    if not in_cache:
-        # Perform an OPS query
-        print("Querying EPO OPS")
+def enrich_registers(publications, session=None, cachesession=None, 
+                     fetcher=None, processes=None, batch_size=100, max_age=None):
+    """ Save agent / class data for many PatentPublication objects.
+    
+    Register data is loaded from the cache in bulk, numbers not cached 
+    are fetched concurrently within OPS quotas and cached in one 
+    transaction, agent and classification details are extracted in a 
+    pool of worker processes and publications are updated batch_size 
+    per transaction. Publications whose details cannot be processed are 
+    logged and skipped.
     
-        json_result = get_register(publication_number)
+    param list publications: PatentPublication objects
+    param session: datamodels session, by default that of the publications
+    param cachesession: datacache session
+    param fetcher: ConcurrentFetcher requesting JSON
+    param int processes: worker processes for parsing, None for all CPUs
+    param int batch_size: publications updated per transaction
+    param timedelta max_age: fetch again cached data older than this
+    return: number of publications updated"""
+    publications = list(publications)
+    if not publications:
+        return 0
+    if session is None:
+        session = object_session(publications[0]) or datamodels.Session()
+    close_cache = cachesession is None
+    if close_cache:
+        cachesession = datacache.Session()
+    if fetcher is None:
+        consumer_key, consumer_secret = get_credentials()
+        fetcher = ConcurrentFetcher(consumer_key, consumer_secret, accept_type='json')
     
-        if json_result:
-            # Store result in cache
+    numbers = list(dict.fromkeys(p.pub_no for p in publications))
+    results = datacache.RegisterCache.get_many(cachesession, numbers, max_age)
+    logging.info("Register data cached for {0} of {1}".format(len(results), len(numbers)))
+    
+    missing = [number for number in numbers if number not in results]
+    fetched = {
+        number: json_result 
+        for number, json_result in fetch_registers(missing, fetcher).items() 
+        if json_result
+    }
+    try:
+        datacache.RegisterCache.store_many(cachesession, fetched)
+        cachesession.commit()
+    except:
+        logging.exception("Error saving cache")
+        cachesession.rollback()
+    finally:
+        if close_cache:
+            cachesession.close()
+    results.update(fetched)
+    
+    # Extract agent and classification data
+    numbers = [number for number in numbers if number in results]
+    result_dicts = dict(zip(numbers, utils.parallel_map(
+        get_agent_class, [results[number] for number in numbers], processes, 
+        max(1, batch_size // 10)
+    )))
+    
+    updated = 0
+    pending = 0
+    try:
+        for publication in publications:
+            result_dict = result_dicts.get(publication.pub_no)
+            if not result_dict:
+                continue
             try:
-                cache_to_store = datacache.RegisterCache(publication_number, json_result)
-                cachesession.add(cache_to_store)
-                cachesession.commit()
-            except:
-                print("Error saving cache")
-                cachesession.rollback()
-        time.sleep(1)
-    else:
-        # Load json from cache
-        print("Loading from cache")
-        json_result = in_cache.loadresponse()
+                apply_agent_class(publication, result_dict)
+            except Exception:
+                logging.exception("Error processing register data for {0}".format(publication.pub_no))
+                continue
+            updated += 1
+            pending += 1
+            if pending >= batch_size:
+                session.commit()
+                pending = 0
+        session.commit()
+    except:
+        session.rollback()
+        logging.exception("Error updating Publications")
+        raise
+    return updated
 
-    if json_result:
-        # Extract agent and classification data
-        result_dict = get_agent_class(json_result)
-    else:
-        result_dict = None
-    
-    if result_dict:
-        # Store agent / classification details
-        try:
-            number.raw_agent = result_dict["agent"]
-            number.raw_agent_first_address = result_dict["agent_first_address"]
-            number.raw_agent_country = result_dict["agent_country"]
-            number.raw_classification = result_dict["classification"]
-            # Add classification records
-            number.classifications = [
-                datamodels.Classification(**c) 
-                for c in patentdata.process_classification(number.raw_classification)
-            ]
-            session.commit()
-            print("Agent - {0}, {1}".format(number.raw_agent, number.raw_agent_first_address))
-            print("Agent Country - {0}".format(number.raw_agent_country))
-            print("Classification - {0}".format(number.raw_classification))
-          
-        except:
-            session.rollback()
-            print("Error updating Publication")
-            raise
-            
-    session.close()
+def save_register(number):
+    """Save agent / class data for PatentPublication object number."""
+    enrich_registers([number], processes=1)
 
-def getall_registers():
+def getall_registers(processes=None):
     """ Get register details for samples of each applicant in PatentSearch. """
     # Define number of samples for each applicant
     no_of_samples = 10
     
     session = datamodels.Session()
     
-    # Cycle through companies and record agent / classification
+    # Cycle through companies and collect samples of publications
+    samples = []
     for entity in session.query(datamodels.PatentSearch).all():
         # Sample publication objects if greater than defined number
         if len(entity.publications) > no_of_samples:
-            samples = random.sample(entity.publications,no_of_samples)
+            samples.extend(random.sample(entity.publications,no_of_samples))
         else:
-            samples = entity.publications
-        
-        for sample in samples:
-            save_register(sample)
+            samples.extend(entity.publications)
     
+    # Record agent / classification
+    enrich_registers(samples, session, processes=processes)
     session.close()
 
 def get_agent_list(session):
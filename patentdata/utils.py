@@ -2,7 +2,12 @@
 import datetime
 import re
 import os
+import sys
+import threading
+import time
 from bisect import bisect_left
+from collections import deque
+from multiprocessing import Pool
 
 
 # Common useful utilities
@@ -47,23 +52,37 @@ def keysearch(d, key):
 
 # Define helper function to remove text in parenthesis
 # From http://stackoverflow.com/questions/14596884/remove-text-between-and-in-python
+BRACKETS_RE = re.compile(r'[\[\]()]')
+
 def remove_bracketed(test_str):
-    """ Remove bracketed text from string. """
-    ret = ''
+    """ Remove bracketed text from string. Unmatched closing brackets 
+    outside any brackets are kept. """
+    if '[' not in test_str and '(' not in test_str:
+        return test_str
+    kept = []
     skip1c = 0
     skip2c = 0
-    for i in test_str:
-        if i == '[':
+    start = 0
+    # Text between brackets is kept or dropped as a whole
+    for match in BRACKETS_RE.finditer(test_str):
+        i = match.start()
+        if skip1c == 0 and skip2c == 0:
+            kept.append(test_str[start:i])
+        char = test_str[i]
+        if char == '[':
             skip1c += 1
-        elif i == '(':
+        elif char == '(':
             skip2c += 1
-        elif i == ']' and skip1c > 0:
+        elif char == ']' and skip1c > 0:
             skip1c -= 1
-        elif i == ')'and skip2c > 0:
+        elif char == ')' and skip2c > 0:
             skip2c -= 1
         elif skip1c == 0 and skip2c == 0:
-            ret += i
-    return ret
+            kept.append(char)
+        start = i + 1
+    if skip1c == 0 and skip2c == 0:
+        kept.append(test_str[start:])
+    return ''.join(kept)
 
 # Get current year and look for publications in that year
 def get_current_year():
@@ -133,3 +152,330 @@ def process_classification(class_string):
             ]
             for match in p.finditer(class_string)]
     return classifications
+
+
+# Default cap on file data held by a ReadAhead of (id, filedata) tuples
+READ_AHEAD_BYTES = 64 * 1024 * 1024
+
+
+def filedata_size(item):
+    """ Return the size of the file data in an (id, filedata) tuple. """
+    filedata = item[1]
+    return len(filedata) if filedata else 0
+
+
+class ReadAhead:
+    """ Iterate over an iterable in a background thread.
+
+    Up to depth items, and at most max_bytes of them as measured by
+    sizeof, are held ready so reading and decompressing files overlaps
+    with parsing in the consuming thread. Exceptions raised while
+    reading are re-raised to the consumer.
+
+    metrics() reports how often each side had to wait: a reader that is
+    often blocked on a full queue means the consumer is the bottleneck
+    (CPU bound); a consumer often waiting on an empty queue means
+    reading is (I/O bound).
+    """
+
+    def __init__(self, iterable, depth=8, max_bytes=None, sizeof=None):
+        """ Start reading.
+
+        :param iterable: items to read ahead
+        :param depth: maximum number of items held
+        :type depth: int
+        :param max_bytes: maximum total size of items held; a single
+        larger item is still passed through
+        :type max_bytes: int
+        :param sizeof: function returning the size of an item in bytes
+        :type sizeof: callable
+        :return: None
+        """
+        self.depth = max(1, depth)
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda item: 0)
+        self.items = deque()
+        self.held_bytes = 0
+        self.finished = False
+        self.error = None
+        self.stopped = False
+        self.condition = threading.Condition()
+        # Metrics
+        self.count = 0
+        self.total_bytes = 0
+        self.reader_waits = 0
+        self.consumer_waits = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self.max_held_bytes = 0
+        self.thread = threading.Thread(
+            target=self._read, args=(iterable,), daemon=True
+        )
+        self.thread.start()
+
+    def _full(self, size):
+        """ Check if an item of size would exceed the limits. """
+        if len(self.items) >= self.depth:
+            return True
+        return bool(
+            self.max_bytes and self.items and
+            self.held_bytes + size > self.max_bytes
+        )
+
+    def _read(self, iterable):
+        """ Fill the buffer from iterable in the background thread. """
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                size = self.sizeof(item)
+                with self.condition:
+                    if self._full(size) and not self.stopped:
+                        self.reader_waits += 1
+                        while self._full(size) and not self.stopped:
+                            self.condition.wait()
+                    if self.stopped:
+                        break
+                    self.items.append((item, size))
+                    self.held_bytes += size
+                    self.max_held_bytes = max(
+                        self.max_held_bytes, self.held_bytes
+                    )
+                    self.condition.notify_all()
+        except Exception as e:
+            with self.condition:
+                self.error = e
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.condition:
+            if not self.items and not self.finished:
+                self.consumer_waits += 1
+                while not self.items and not self.finished:
+                    self.condition.wait()
+            if not self.items:
+                if self.error is not None:
+                    error, self.error = self.error, None
+                    raise error
+                raise StopIteration
+            self.depth_total += len(self.items)
+            self.max_depth = max(self.max_depth, len(self.items))
+            item, size = self.items.popleft()
+            self.held_bytes -= size
+            self.count += 1
+            self.total_bytes += size
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        """ Stop reading and wait for the background thread. """
+        with self.condition:
+            self.stopped = True
+            self.items.clear()
+            self.held_bytes = 0
+            self.condition.notify_all()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def metrics(self):
+        """ Return counts of items read, bytes read, waits by each side
+        and the mean and maximum number of items ready. """
+        with self.condition:
+            return {
+                'items': self.count,
+                'bytes': self.total_bytes,
+                'reader_waits': self.reader_waits,
+                'consumer_waits': self.consumer_waits,
+                'mean_depth': (
+                    self.depth_total / self.count if self.count else 0
+                ),
+                'max_depth': self.max_depth,
+                'max_held_bytes': self.max_held_bytes,
+                'bound': (
+                    'io' if self.consumer_waits > self.reader_waits
+                    else 'cpu'
+                )
+            }
+
+
+def prefetch(iterable, depth=8, max_bytes=None, sizeof=None):
+    """ Iterate over iterable in a background thread, keeping up to
+    depth items ready so file reads and parsing overlap with work done
+    on each item.
+
+    Exceptions raised by iterable are re-raised by the consumer.
+    depth of 0 or None returns the items without a thread.
+    """
+    if not depth:
+        yield from iterable
+        return
+    reader = ReadAhead(iterable, depth, max_bytes, sizeof)
+    try:
+        yield from reader
+    finally:
+        # Let the thread finish if the consumer stops early
+        reader.close()
+
+
+def parallel_map(function, iterable, processes=None, chunksize=1):
+    """ Generator of function(item) for each item in order, run across a
+    pool of worker processes.
+
+    processes of 1 runs in this process; None uses all CPUs. function
+    must be defined at module level so workers can import it.
+    """
+    if processes == 1:
+        yield from map(function, iterable)
+        return
+    pool = Pool(processes)
+    try:
+        yield from pool.imap(function, iterable, chunksize)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def format_seconds(seconds):
+    """ Format a duration in seconds as H:MM:SS. """
+    seconds = int(round(seconds))
+    return "{0}:{1:02d}:{2:02d}".format(
+        seconds // 3600, (seconds % 3600) // 60, seconds % 60
+    )
+
+
+class ProgressReporter:
+    """ Report throughput while working through archives.
+
+    Call start() as each archive begins and update() as documents are
+    processed. A line with documents/sec, MB/sec and an ETA is written
+    at most every interval seconds and when each archive finishes. The
+    ETA is for the current archive if its document total is known, and
+    otherwise for all archives from the average time per archive.
+    """
+
+    def __init__(self, archives=None, interval=5.0, stream=None):
+        """ Initialise reporter.
+
+        :param archives: total number of archives, if known
+        :type archives: int
+        :param interval: minimum seconds between reports
+        :type interval: float
+        :param stream: file to write to, defaults to sys.stderr
+        :return: None
+        """
+        self.archives = archives
+        self.interval = interval
+        self.stream = stream
+        self.archives_done = 0
+        self.documents = 0
+        self.bytes = 0
+        self.started = time.time()
+        self.archive = None
+
+    def start(self, archive, total=None):
+        """ Start reporting on archive, which has total documents. """
+        if self.archive is not None:
+            self.finish()
+        self.archive = archive
+        self.archive_total = total
+        self.archive_documents = 0
+        self.archive_bytes = 0
+        self.archive_started = time.time()
+        self.last_report = self.archive_started
+
+    def update(self, documents=1, nbytes=0):
+        """ Record documents processed and bytes read. """
+        self.documents += documents
+        self.bytes += nbytes
+        if self.archive is None:
+            self.start("")
+        self.archive_documents += documents
+        self.archive_bytes += nbytes
+        now = time.time()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def finish(self):
+        """ Report on and close the current archive. """
+        if self.archive is None:
+            return
+        self.report(finished=True)
+        self.archives_done += 1
+        self.archive = None
+
+    def eta(self):
+        """ Return estimated seconds remaining, or None if unknown. """
+        elapsed = time.time() - self.archive_started
+        if self.archive_total and self.archive_documents:
+            rate = self.archive_documents / elapsed if elapsed else 0
+            remaining = self.archive_total - self.archive_documents
+            return remaining / rate if rate else None
+        if self.archives and self.archives_done:
+            per_archive = (time.time() - self.started) / self.archives_done
+            return per_archive * (self.archives - self.archives_done)
+        return None
+
+    def report(self, finished=False):
+        """ Write a progress line for the current archive. """
+        elapsed = max(time.time() - self.archive_started, 1e-9)
+        line = "{0}: {1} docs, {2:.1f} docs/s, {3:.2f} MB/s".format(
+            self.archive or "total",
+            self.archive_documents,
+            self.archive_documents / elapsed,
+            self.archive_bytes / elapsed / 1e6
+        )
+        if self.archive_total:
+            line += " ({0}/{1})".format(
+                self.archive_documents, self.archive_total
+            )
+        if finished:
+            line += " done in {0}".format(format_seconds(elapsed))
+        else:
+            eta = self.eta()
+            if eta is not None:
+                line += ", ETA {0}".format(format_seconds(eta))
+        print(line, file=self.stream or sys.stderr, flush=True)
+
+    def summary(self):
+        """ Return totals and rates across all archives. """
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            'archives': self.archives_done,
+            'documents': self.documents,
+            'bytes': self.bytes,
+            'seconds': elapsed,
+            'docs_per_sec': self.documents / elapsed,
+            'mb_per_sec': self.bytes / elapsed / 1e6
+        }
+
+
+
+# SQLAlchemy engines shared by every user of a database file
+_engines = dict()
+_engines_lock = threading.Lock()
+
+
+def get_engine(path):
+    """ Return the shared SQLAlchemy engine, and so connection pool, for
+    the SQLite database at path. The file is created when the engine
+    first connects.
+    """
+    from sqlalchemy import create_engine
+    path = os.path.abspath(path)
+    with _engines_lock:
+        if path not in _engines:
+            _engines[path] = create_engine('sqlite:///' + path, echo=False)
+        return _engines[path]
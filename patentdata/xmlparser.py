@@ -1,7 +1,7 @@
-# Import Beautiful Soup for XML parsing
-from bs4 import BeautifulSoup
+# Beautiful Soup is imported by make_soup when XML is first parsed
 from datetime import datetime
 import logging
+import re
 
 from patentdata.utils import process_classification
 
@@ -10,11 +10,23 @@ from patentdata.models import (
                                 Claimset, PatentDoc
                             )
 
+# The log file is only created when first written
 logging.basicConfig(
-    filename="processing_class.log",
+    handlers=[logging.FileHandler("processing_class.log", delay=True)],
     format='%(asctime)s %(message)s'
 )
 
+
+# Epodoc number with an optional kind code, e.g. "EP 2979166 A1"
+EPODOC_RE = re.compile(r'^([A-Z]{2})\s*(\d+)\s*(?:[A-Z]\d?)?$')
+
+
+def make_soup(data):
+    """ Parse XML data with Beautiful Soup. """
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(data, "xml")
+
+
 class XMLDoc():
     """ Object to wrap the XML for a US Patent Document. """
 
@@ -22,11 +34,11 @@ class XMLDoc():
         """ Initialise object using either disk file data or HTML
         response data. """
         try:
-            self.soup = BeautifulSoup(filedata, "xml")
+            self.soup = make_soup(filedata)
             if not self.soup:
                 print("No soup object")
             if claimdata:
-                claimsoup = BeautifulSoup(claimdata, "xml")
+                claimsoup = make_soup(claimdata)
                 # Try to convert <claim-text>....into <claim>
                 # Maybe check if one large <claim> containing all claims
                 # or several <claim> per claim
@@ -139,6 +151,15 @@ class XMLDoc():
         except:
             return None
 
+    def abstract(self):
+        """ Return abstract text. """
+        try:
+            return self.soup.find(
+                ["abstract", "subdoc-abstract"]
+            ).text.strip()
+        except:
+            return None
+
     def all_text(self):
         """ Return description and claim text. """
         desc = self.description_text()
@@ -213,10 +234,14 @@ class XMLDoc():
 class XMLRegisterData():
     """ Wrapper for Register XML Data. """
     def __init__(self, data):
-        """ Initialise object using either disk file data or HTML
-        response data. """
+        """ Initialise object using either disk file data, HTML
+        response data or an already parsed element. """
+        from bs4 import Tag
+        if isinstance(data, Tag):
+            self.soup = data
+            return
         try:
-            self.soup = BeautifulSoup(data, "xml")
+            self.soup = make_soup(data)
         except:
             print("Error could not read file")
             raise
@@ -238,6 +263,31 @@ class XMLRegisterData():
         else:
             return None
 
+    def get_publication_details(self):
+        """
+        Return the Epodoc publication number and date as a dictionary,
+        or None if there is no publication reference.
+        """
+        try:
+            return get_epodoc_from_soup(
+                self.soup.find("publication-reference")
+            )
+        except:
+            return None
+
+    def get_title(self, lang="en"):
+        """
+        Return the title in language lang, or the first title if there
+        is none in that language.
+        """
+        titles = self.soup.find_all("invention-title")
+        for title in titles:
+            if title.attrs.get("lang", "").lower() == lang:
+                return title.text
+        if titles:
+            return titles[0].text
+        return None
+
     def get_citations(self):
         """
         Search for citations and return in a friendly format.
@@ -275,16 +325,51 @@ def get_epodoc_from_soup(soup):
 
 def extract_pub_no(response):
     """ Extract publication numbers from a response."""
-    soup = BeautifulSoup(response, "xml")
+    soup = make_soup(response)
     try:
         return get_epodoc_from_soup(soup.find("publication-reference"))
     except:
         return None
 
 
+def epodoc_number(number):
+    """ Normalise an Epodoc number as OPS returns it as a doc-number,
+    e.g. "ep 2979166 A1" to "EP2979166". Numbers of other forms are
+    returned stripped and in upper case. """
+    number = number.strip().upper()
+    match = EPODOC_RE.match(number)
+    if match:
+        return match.group(1) + match.group(2)
+    return number
+
+
+def split_exchange_documents(response, reference_type="publication"):
+    """ Split a response for several documents into one
+    XMLRegisterData per document.
+
+    :param reference_type: "publication" or "application", the
+    reference whose Epodoc number is used as the key
+    :type reference_type: str
+    :return: dictionary of Epodoc number, normalised by epodoc_number,
+    to XMLRegisterData, keeping the first document for each number
+    """
+    soup = make_soup(response)
+    documents = dict()
+    for document in soup.find_all("exchange-document"):
+        try:
+            number = epodoc_number(get_epodoc_from_soup(
+                document.find(reference_type + "-reference")
+            )['number'])
+        except:
+            continue
+        if number not in documents:
+            documents[number] = XMLRegisterData(document)
+    return documents
+
+
 def get_epodoc(response):
     """ Get the epodoc number from response data. """
-    soup = BeautifulSoup(response, "xml")
+    soup = make_soup(response)
     try:
         return get_epodoc_from_soup(soup)['number']
     except:
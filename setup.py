@@ -28,6 +28,12 @@ setup(
         'python-epo-ops-client>=2.1.0',
         'requests>=2.13.0',
         'six>=1.10.0'
-    ]
+    ],
+    extras_require={
+        'parquet': ['pyarrow>=7.0.0']
+    },
+    entry_points={
+        'console_scripts': ['patentdata=patentdata.cli:main']
+    }
     #packages=['patentdata']
 )
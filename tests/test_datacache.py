@@ -0,0 +1,85 @@
+from patentdata import datacache
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+import json
+import sqlite3
+import pytest
+
+
+class TestRegisterCache(object):
+    """ Test the compressed, indexed register cache. """
+
+    @pytest.fixture(autouse=True)
+    def set_common_fixtures(self, tmpdir):
+        self.db_path = str(tmpdir.join("patentcache.db"))
+        self.engine = create_engine('sqlite:///' + self.db_path)
+
+    def session(self):
+        datacache.Base.metadata.create_all(self.engine)
+        return sessionmaker(bind=self.engine)()
+
+    def test_get_many(self):
+        """ Test bulk loading, replacing and expiry. """
+        session = self.session()
+        datacache.RegisterCache.store_many(session, {
+            "EP{0}".format(i): {"reg:number": i} for i in range(1200)
+        })
+        session.commit()
+        results = datacache.RegisterCache.get_many(
+            session, ["EP5", "EP1100", "EP5", "EP9999"]
+        )
+        assert results == {
+            "EP5": {"reg:number": 5}, "EP1100": {"reg:number": 1100}
+        }
+
+        datacache.RegisterCache.store_many(session, {"EP5": {"new": True}})
+        session.commit()
+        assert session.query(datacache.RegisterCache).count() == 1200
+        row = session.query(datacache.RegisterCache).filter_by(
+            pub_no="EP5"
+        ).one()
+        assert row.loadresponse() == {"new": True}
+
+        row.fetched_at = datetime.utcnow() - timedelta(days=10)
+        session.commit()
+        results = datacache.RegisterCache.get_many(
+            session, ["EP5", "EP6"], max_age=timedelta(days=7)
+        )
+        assert list(results) == ["EP6"]
+        session.close()
+
+    def test_unique_index(self):
+        """ Test pub_no is indexed and unique. """
+        self.session().close()
+        indexes = inspect(self.engine).get_indexes("registercache")
+        assert any(
+            index["column_names"] == ["pub_no"] and index["unique"]
+            for index in indexes
+        )
+
+    def test_migrate(self):
+        """ Test migrating a cache of uncompressed responses. """
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "CREATE TABLE registercache (id INTEGER PRIMARY KEY, "
+            "pub_no VARCHAR(128), raw_response VARCHAR)"
+        )
+        conn.executemany(
+            "INSERT INTO registercache (pub_no, raw_response) VALUES (?, ?)",
+            [
+                ("EP1", json.dumps({"version": 1})),
+                ("EP2", json.dumps({"version": 1})),
+                ("EP1", json.dumps({"version": 2}))
+            ]
+        )
+        conn.commit()
+        conn.close()
+
+        assert datacache.migrate(self.engine) == 2
+        assert datacache.migrate(self.engine) == 0
+        session = self.session()
+        assert datacache.RegisterCache.get_many(session, ["EP1", "EP2"]) == {
+            "EP1": {"version": 2}, "EP2": {"version": 1}
+        }
+        session.close()
@@ -1,6 +1,244 @@
 from patentdata.corpus import EPOOPS
+from patentdata.corpus.epo.cache import ResponseCache
+from patentdata.corpus.epo.search import SearchRunner
+from patentdata.corpus.epo.fetcher import (
+    ConcurrentFetcher, RateLimiter, parse_throttling_control
+)
+import json
+import re
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 import pytest
 
+THROTTLING = (
+    "idle (images=green:200, inpadoc=green:60, other=green:1000, "
+    "retrieval=green:6000, search=green:30)"
+)
+
+STUB_DESCRIPTION = """<ops:world-patent-data xmlns:ops="http://ops.epo.org">
+<description><p id="p-0001">A widget for {0}.</p></description>
+</ops:world-patent-data>"""
+
+STUB_CLAIMS = """<ops:world-patent-data xmlns:ops="http://ops.epo.org">
+<claims><claim><claim-text>1. A widget for {0}.</claim-text></claim></claims>
+</ops:world-patent-data>"""
+
+STUB_BIBLIO = """<ops:world-patent-data xmlns:ops="http://ops.epo.org">
+<invention-title lang="de">Vorrichtung</invention-title>
+<invention-title lang="en">Widget {0}</invention-title>
+</ops:world-patent-data>"""
+
+
+class StubOPSHandler(BaseHTTPRequestHandler):
+    """ Answer OPS auth and published-data requests. """
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(
+            int(self.headers.get('Content-Length', 0))
+        ).decode('utf-8').strip('()')
+        if self.path.startswith('/auth'):
+            return self.respond(
+                json.dumps({'access_token': 'token', 'expires_in': '1199'}),
+                'application/json'
+            )
+        self.server.requests.append((self.path, body))
+        endpoint = self.path.rstrip('/').split('/')[-1]
+        if body == 'EP0000404' and endpoint == 'claims':
+            self.send_response(404)
+            self.end_headers()
+            return
+        template = {
+            'description': STUB_DESCRIPTION,
+            'claims': STUB_CLAIMS,
+            'biblio': STUB_BIBLIO
+        }[endpoint]
+        self.respond(template.format(body), 'application/xml')
+
+    def respond(self, text, content_type):
+        data = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-Throttling-Control', THROTTLING)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubOPSServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestConcurrentFetcher(object):
+    """ Test fetching documents from a local stub OPS server. """
+
+    @pytest.fixture(autouse=True)
+    def set_common_fixtures(self):
+        self.server = StubOPSServer(('127.0.0.1', 0), StubOPSHandler)
+        self.server.requests = list()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = "http://127.0.0.1:{0}".format(self.server.server_port)
+        self.fetcher = ConcurrentFetcher(
+            'key', 'secret', workers=4,
+            service_url=url + "/rest-services",
+            auth_url=url + "/auth"
+        )
+        yield
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_parse_throttling_control(self):
+        """ Test reading the throttling header. """
+        state, services = parse_throttling_control(THROTTLING)
+        assert state == "idle"
+        assert services['search'] == ('green', 30)
+        assert services['retrieval'] == ('green', 6000)
+
+    def test_rate_limiter(self):
+        """ Test limits adapt to throttling headers. """
+        limiter = RateLimiter()
+        assert limiter.interval('search') == 2.0
+        limiter.update({
+            'X-Throttling-Control':
+                "busy (retrieval=yellow:100, search=black:0)",
+            'Retry-After': '30000'
+        }, 'search')
+        assert limiter.interval('retrieval') == 60.0 / 100 * 2.0 * 1.5
+        assert limiter.next_start['search'] > 0
+
+    def test_iter_patentdocs(self):
+        """ Test documents are built from concurrent responses. """
+        numbers = ["EP{0:07d}".format(i) for i in range(1, 9)]
+        docs = list(self.fetcher.iter_patentdocs(numbers))
+        assert sorted(doc.number for doc in docs) == numbers
+        doc = [d for d in docs if d.number == "EP0000003"][0]
+        assert doc.title == "Widget EP0000003"
+        assert "EP0000003" in doc.description.text
+        # Three endpoints per number
+        assert len(self.server.requests) == 24
+        assert self.fetcher.limiter.limits['retrieval'] == 6000
+
+    def test_duplicate_numbers(self):
+        """ Test repeated numbers are fetched and yielded once. """
+        docs = list(self.fetcher.iter_patentdocs(
+            ["EP0000001", "EP0000001", "EP0000002"]
+        ))
+        assert sorted(doc.number for doc in docs) == [
+            "EP0000001", "EP0000002"
+        ]
+        assert len(self.server.requests) == 6
+
+    def test_missing_document(self):
+        """ Test documents without claims are skipped with a warning. """
+        with pytest.warns(UserWarning):
+            docs = list(
+                self.fetcher.iter_patentdocs(["EP0000404", "EP0000001"])
+            )
+        assert [doc.number for doc in docs] == ["EP0000001"]
+
+    def test_patentdoc_generator(self):
+        """ Test EPOOPS generates documents with the fetcher. """
+        epo_client = EPOOPS('key', 'secret', workers=2)
+        epo_client._fetcher = self.fetcher
+        docs = list(epo_client.patentdoc_generator(
+            ["EP0000001", "EP0000002", "EP0000003"], sample_size=2
+        ))
+        assert len(docs) == 2
+        with pytest.warns(UserWarning):
+            assert list(epo_client.patentdoc_generator()) == []
+
+    def test_cached_fetch(self, tmpdir):
+        """ Test cached responses are not requested again. """
+        self.fetcher.cache = ResponseCache(str(tmpdir.join("ops.db")))
+        numbers = ["EP0000001", "EP0000002"]
+        first = list(self.fetcher.iter_patentdocs(numbers))
+        second = list(self.fetcher.iter_patentdocs(numbers))
+        assert len(self.server.requests) == 6
+        assert (
+            sorted(d.title for d in first) == sorted(d.title for d in second)
+        )
+        assert self.fetcher.cache.stats()['hits'] == 6
+
+
+class TestResponseCache(object):
+    """ Test the on-disk OPS response cache. """
+
+    @pytest.fixture(autouse=True)
+    def set_common_fixtures(self, tmpdir):
+        self.path = str(tmpdir.join("ops.db"))
+        self.cache = ResponseCache(self.path, max_bytes=None)
+        yield
+        self.cache.close()
+
+    def test_middlewares(self):
+        """ Test Dogpile is only used without a response cache. """
+        names = [
+            type(m).__name__ for m in
+            EPOOPS('key', 'secret', cache=self.cache)
+            .registered_client.middlewares
+        ]
+        assert names == ['Throttler']
+
+    def test_get_set(self):
+        """ Test storing and reading responses. """
+        assert self.cache.get('claims', 'EP1000000') is None
+        self.cache.set('claims', 'EP1000000', "<claims>one</claims>")
+        assert self.cache.get('claims', 'EP1000000') == "<claims>one</claims>"
+        assert self.cache.get('description', 'EP1000000') is None
+        stats = self.cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+        assert stats['entries'] == 1
+        # Persisted between instances
+        cache = ResponseCache(self.path)
+        assert cache.get('claims', 'EP1000000') == "<claims>one</claims>"
+        assert cache.stats()['bytes'] == stats['bytes']
+
+    def test_ttl(self):
+        """ Test expired responses are missing. """
+        self.cache.ttls['claims'] = -1
+        self.cache.set('claims', 'EP1000000', "<claims/>")
+        self.cache.set('number', 'EP13880507.2', "<number/>")
+        assert self.cache.get('claims', 'EP1000000') is None
+        assert self.cache.get('number', 'EP13880507.2') == "<number/>"
+
+    def test_eviction(self):
+        """ Test least recently used responses are evicted. """
+        texts = {
+            "EP{0}".format(i): "<claims>{0}</claims>".format(i) * 100
+            for i in range(1, 4)
+        }
+        self.cache.set('claims', 'EP1', texts['EP1'])
+        self.cache.set('claims', 'EP2', texts['EP2'])
+        self.cache.get('claims', 'EP1')
+        # Room for two responses
+        self.cache.max_bytes = self.cache.size + 10
+        self.cache.set('claims', 'EP3', texts['EP3'])
+        assert self.cache.get('claims', 'EP2') is None
+        assert self.cache.get('claims', 'EP1') == texts['EP1']
+        assert self.cache.get('claims', 'EP3') == texts['EP3']
+        assert self.cache.stats()['evictions'] == 1
+
+    def test_epoops_cache(self):
+        """ Test EPOOPS requests go through the cache. """
+        epo_client = EPOOPS('key', 'secret', cache=self.cache)
+        calls = list()
+
+        def fetch():
+            calls.append(1)
+            return "<biblio/>"
+
+        for _ in range(3):
+            assert epo_client._request('biblio', 'EP1', fetch) == "<biblio/>"
+        assert len(calls) == 1
+
+
 #Need to setup mock for EPOOPS tests
 
 #class TestGeneral(object):
@@ -68,3 +306,319 @@ import pytest
         #assert citations[0]['category'] == 'I'
 
 
+
+
+APPLICATION_BIBLIO = """<exchange-document>
+<bibliographic-data>
+<publication-reference><document-id document-id-type="epodoc">
+<doc-number>{1}</doc-number><date>20160203</date>
+</document-id></publication-reference>
+<application-reference><document-id document-id-type="epodoc">
+<doc-number>{0}</doc-number><date>20130329</date>
+</document-id></application-reference>
+<references-cited><citation><patcit>
+<document-id document-id-type="epodoc">
+<doc-number>NL9400663</doc-number><date>19950516</date>
+</document-id></patcit><category>X</category></citation></references-cited>
+</bibliographic-data>
+</exchange-document>"""
+
+NUMBER_RESPONSE = """<ops:world-patent-data xmlns:ops="http://ops.epo.org">
+<ops:output><document-id document-id-type="epodoc">
+<doc-number>{0}</doc-number><date>20130329</date>
+</document-id></ops:output></ops:world-patent-data>"""
+
+
+class FakeResponse(object):
+    def __init__(self, text):
+        self.text = text
+
+
+def http_error(status_code):
+    """ Return the error epo_ops raises for a response status. """
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(
+        "{0} Client Error".format(status_code), response=response
+    )
+
+
+class FakeClient(object):
+    """ Answer application biblio and number requests, recording them.
+    """
+
+    def __init__(self, publications, conversions=None, invalid=()):
+        self.publications = publications
+        self.conversions = conversions or dict()
+        self.invalid = invalid
+        self.status = None
+        self.requests = list()
+
+    def published_data(self, reference_type, input, endpoint):
+        inputs = input if isinstance(input, list) else [input]
+        self.requests.append(('biblio', [i.number for i in inputs]))
+        if self.status:
+            raise http_error(self.status)
+        # OPS ignores spaces and kind codes
+        numbers = [
+            re.sub(r'(?<=\d)[A-Z]\d?$', '', i.number.replace(' ', ''))
+            for i in inputs
+        ]
+        if set(numbers) & set(self.invalid):
+            raise http_error(400)
+        documents = [
+            APPLICATION_BIBLIO.format(application, publication)
+            for application, publication in self.publications.items()
+            if (
+                application if reference_type == 'application'
+                else publication
+            ) in numbers
+        ]
+        if not documents:
+            raise http_error(404)
+        return FakeResponse(
+            "<ops:world-patent-data xmlns:ops=\"http://ops.epo.org\">" +
+            "".join(documents) + "</ops:world-patent-data>"
+        )
+
+    def number(self, reference_type, input, output_format):
+        self.requests.append(('number', input.number))
+        if input.number not in self.conversions:
+            raise http_error(404)
+        return FakeResponse(
+            NUMBER_RESPONSE.format(self.conversions[input.number])
+        )
+
+
+class TestNumberResolution(object):
+    """ Test application numbers are only resolved once. """
+
+    @pytest.fixture(autouse=True)
+    def set_common_fixtures(self):
+        self.epo_client = EPOOPS('key', 'secret')
+        self.client = FakeClient(
+            {
+                'EP20130880507': 'EP2979166',
+                'EP20120000001': 'EP2600001',
+                'EP20120000002': 'EP2600002'
+            },
+            {'13880507.2': 'EP20130880507'}
+        )
+        self.epo_client.registered_client = self.client
+
+    def test_get_publication_no(self):
+        """ Test lookups are remembered, including failures. """
+        pub_no = self.epo_client.get_publication_no("13880507.2", "EP")
+        assert pub_no.number == "EP2979166"
+        assert self.epo_client.get_publication_no("13880507.2", "EP") is pub_no
+        # Epodoc biblio, convert, biblio for the converted number
+        assert len(self.client.requests) == 3
+
+        assert self.epo_client.get_publication_no("99999999.9", "EP") is None
+        requests = len(self.client.requests)
+        assert self.epo_client.get_publication_no("99999999.9", "EP") is None
+        assert len(self.client.requests) == requests
+
+    def test_errors_not_remembered(self):
+        """ Test failed requests are raised and tried again. """
+        self.client.invalid = ['EP20120000001']
+        with pytest.raises(requests.HTTPError):
+            self.epo_client.get_publication_no("EP20120000001", "EP")
+        self.client.invalid = ()
+        pub_no = self.epo_client.get_publication_no("EP20120000001", "EP")
+        assert pub_no.number == "EP2600001"
+
+    def test_resolve_many(self):
+        """ Test applications are resolved in a single request. """
+        numbers = [
+            'EP20120000001', 'EP20120000002', '13880507.2', 'EP20120000001'
+        ]
+        results = self.epo_client.resolve_many(numbers, "EP")
+        assert results['EP20120000001'].number == 'EP2600001'
+        assert results['EP20120000002'].number == 'EP2600002'
+        assert results['13880507.2'].number == 'EP2979166'
+        # One bulk request, then conversion of the number not found
+        assert self.client.requests[0] == (
+            'biblio', ['EP20120000001', 'EP20120000002', '13880507.2']
+        )
+        assert len(self.client.requests) == 3
+        self.epo_client.resolve_many(numbers, "EP")
+        assert len(self.client.requests) == 3
+
+
+class TestBulkBiblio(object):
+    """ Test retrieving biblio data for many documents at once. """
+
+    @pytest.fixture(autouse=True)
+    def set_common_fixtures(self):
+        self.epo_client = EPOOPS('key', 'secret')
+        self.publications = {
+            'EP2{0:06d}'.format(i): 'EP2012{0:07d}'.format(i)
+            for i in range(250)
+        }
+        self.applications = {a: p for p, a in self.publications.items()}
+        self.client = FakeClient(
+            self.applications, invalid=['EP2000123']
+        )
+        self.epo_client.registered_client = self.client
+
+    def test_get_biblio_many(self, caplog):
+        """ Test responses are split per document and only the failed
+        members are retried. """
+        numbers = sorted(self.publications) + ['EP9999999']
+        biblio = self.epo_client.get_biblio_many(numbers)
+        assert "EP2000123" in caplog.text and "EP9999999" in caplog.text
+        assert len(biblio) == 251
+        assert biblio['EP2000007'].get_publication_details()['number'] == (
+            'EP2000007'
+        )
+        assert biblio['EP2000123'] is None
+        assert biblio['EP9999999'] is None
+        # Three batches, halving the failed batch down to the bad number,
+        # then one retry of the number missing from a response
+        assert len(self.client.requests) < 25
+        retried = [n for _, batch in self.client.requests for n in batch]
+        assert retried.count('EP2000007') == 1
+        assert retried.count('EP9999999') == 2
+
+    def test_get_biblio_many_errors(self):
+        """ Test throttling errors are raised without splitting. """
+        self.client.status = 403
+        with pytest.raises(requests.HTTPError):
+            self.epo_client.get_biblio_many(sorted(self.publications))
+        assert len(self.client.requests) == 1
+
+    def test_get_biblio_many_formats(self):
+        """ Test numbers with kind codes match their documents. """
+        biblio = self.epo_client.get_biblio_many(
+            ['EP2000007A1', 'EP 2000008 B1']
+        )
+        assert biblio['EP2000007A1'].get_publication_details()['number'] == (
+            'EP2000007'
+        )
+        assert biblio['EP 2000008 B1'] is not None
+        assert len(self.client.requests) == 1
+
+    def test_get_biblio_many_cache(self, tmpdir):
+        """ Test split documents are cached individually. """
+        self.epo_client.cache = ResponseCache(str(tmpdir.join("ops.db")))
+        numbers = sorted(self.publications)[:10]
+        self.epo_client.get_biblio_many(numbers)
+        biblio = self.epo_client.get_biblio_many(numbers)
+        assert len(self.client.requests) == 1
+        assert biblio['EP2000003'].get_publication_details()['number'] == (
+            'EP2000003'
+        )
+
+    def test_get_citations_many(self):
+        """ Test citations are returned for each publication. """
+        citations = self.epo_client.get_citations_many(['EP2000001', 'EP1'])
+        assert citations['EP1'] == []
+        assert citations['EP2000001'][0]['number'] == 'NL9400663'
+        assert citations['EP2000001'][0]['category'] == 'X'
+        assert len(self.client.requests) == 2
+
+
+class FakeSearchResponse(object):
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSearchFetcher(object):
+    """ Answer searches with total results given by the query. """
+
+    def __init__(self, fail=(), broken=()):
+        self.fail = fail
+        self.broken = broken
+        self.requests = list()
+
+    def request(self, service, method, cql, range_begin, range_end):
+        self.requests.append((cql, range_begin, range_end))
+        if cql in self.fail:
+            raise http_error(503)
+        if cql in self.broken and range_begin > 1:
+            return FakeSearchResponse({'ops:world-patent-data': {}})
+        total = int(cql)
+        if not total:
+            # OPS answers searches without results with a 404
+            raise http_error(404)
+        references = [
+            {'document-id': {
+                'country': {'$': 'EP'}, 'doc-number': {'$': str(i)}
+            }}
+            for i in range(range_begin, min(range_end, total) + 1)
+        ]
+        search = {'@total-result-count': str(total)}
+        if references:
+            search['ops:search-result'] = {
+                'ops:publication-reference': (
+                    references if len(references) > 1 else references[0]
+                )
+            }
+        return FakeSearchResponse(
+            {'ops:world-patent-data': {'ops:biblio-search': search}}
+        )
+
+
+class TestSearchRunner(object):
+    """ Test paged, checkpointed searches. """
+
+    @pytest.fixture(autouse=True)
+    def set_common_fixtures(self, tmpdir):
+        self.output = str(tmpdir.join("search.jsonl"))
+
+    def read_output(self):
+        with open(self.output) as f:
+            return {
+                record['applicant']: record
+                for record in map(json.loads, f)
+            }
+
+    def test_paging(self):
+        """ Test all pages are retrieved, up to the OPS limit. """
+        fetcher = FakeSearchFetcher()
+        runner = SearchRunner(fetcher, self.output, workers=2)
+        results = runner.search("250")
+        assert results['total_results'] == 250
+        assert results['numbers'][-1] == "EP250"
+        assert len(results['numbers']) == 250
+        assert len(results['raw_data']) == 3
+        assert len(runner.search("1")['numbers']) == 1
+        assert runner.search("0") == {
+            "total_results": 0, "numbers": [], "raw_data": []
+        }
+        runner.fetcher = FakeSearchFetcher(broken=["250"])
+        with pytest.raises(ValueError):
+            runner.search("250")
+        assert len(runner.search("5000")['numbers']) == 2000
+
+    def test_checkpoint(self):
+        """ Test failed searches are retried on the next run. """
+        queries = [
+            (name, total, {'applicant': name})
+            for name, total in [('A', '3'), ('B', '150'), ('C', '7')]
+        ]
+        fetcher = FakeSearchFetcher(fail=['150'])
+        runner = SearchRunner(fetcher, self.output, workers=3)
+        assert runner.run(queries) == 2
+        assert sorted(self.read_output()) == ['A', 'C']
+        assert runner.completed() == {'A', 'C'}
+
+        runner.fetcher = FakeSearchFetcher()
+        assert runner.run(queries) == 1
+        assert [r[0] for r in runner.fetcher.requests] == ['150', '150']
+        records = self.read_output()
+        assert len(records['B']['numbers']) == 150
+        assert records['C']['total_results'] == 7
+
+    def test_no_results(self):
+        """ Test searches without results are written and checkpointed.
+        """
+        queries = [('A', '0', {'applicant': 'A'})]
+        runner = SearchRunner(FakeSearchFetcher(), self.output)
+        assert runner.run(queries) == 1
+        assert self.read_output()['A']['total_results'] == 0
+        assert runner.run(queries) == 0
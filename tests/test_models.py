@@ -1,7 +1,11 @@
 import pytest
 from patentdata.models import (
-    PatentDoc, Description, Figures, Claimset, Claim, Classification
+    PatentDoc, Description, Paragraph, Figures, Claimset, Claim,
+    Classification, TfidfMatrix, PatentCorpus
 )
+from patentdata.models.lib.dependency_graph import dependency_statistics
+from patentdata.models.lib.claim_nlp import ClaimPipeline
+from nltk.tag import DefaultTagger, UnigramTagger
 from patentdata.corpus import USPublications
 import os
 
@@ -32,6 +36,55 @@ class TestGeneral(object):
         assert "Claim 5 has an x" in claimset.get_claim(5).text
         assert isinstance(claimset.claims[2], Claim)
 
+    def test_claimset_from_string(self, monkeypatch):
+        """ Test the regex extractor is used without running nltk. """
+        from patentdata.models.lib import utils_claimset
+
+        def fail(text):
+            raise AssertionError("nltk extractor should not run")
+
+        monkeypatch.setattr(utils_claimset, "nltk_extract_claims", fail)
+        text = "\n".join([
+            "1. A widget comprising a lever.",
+            "2. The widget of claim 1, wherein the lever is red.",
+            "3. A method of making a widget."
+            ])
+        claimset = Claimset(text)
+        assert claimset.claim_count == 3
+        assert claimset.get_claim(3).number == 3
+        assert claimset.get_claim(2).text.startswith("The widget")
+
+    def test_claimset_from_list(self, monkeypatch):
+        """ Test passed numbering is preferred for list input. """
+        from patentdata.models.lib import utils_claimset
+
+        def fail(text):
+            raise AssertionError("regex extractor should not run")
+
+        monkeypatch.setattr(utils_claimset, "regex_extract_claims", fail)
+        claims = utils_claimset.clean_data([
+            "1. A widget comprising a lever.",
+            "2. The widget of claim 1, wherein the lever is red."
+            ])
+        assert [(c.number, c.text) for c in claims] == [
+            (1, "1. A widget comprising a lever."),
+            (2, "2. The widget of claim 1, wherein the lever is red.")
+            ]
+
+    def test_appears_in(self):
+        """ Test term lookups through the inverted index. """
+        claims = [
+            Claim("A widget has a Lever.", 1),
+            Claim("The widget of claim 1 has a spring.", 2),
+            Claim("A gadget has a spring.", 3)
+            ]
+        claimset = Claimset(claims)
+        assert claimset.appears_in("lever") == [claims[0]]
+        assert claimset.appears_in("Spring") == claims[1:]
+        assert claimset.appears_in("sprocket") == []
+        assert claimset.term_index["widget"] == [0, 1]
+        assert claims[0].appears_in("LEVER")
+
     def test_init(self):
         """ Test all objects initialise. """
         claims = [
@@ -59,6 +112,72 @@ class TestGeneral(object):
         assert pd1.reading_time() > 0 and \
             pd1.reading_time() < pd2.reading_time()
 
+    def test_claim_attributes(self):
+        """ Test claims accept caller data and retokenise changed text. """
+        claim = Claim("A widget.", 1)
+        claim.word_data = [("A", "DT", "B-NP"), ("widget", "NN", "I-NP")]
+        claim.mapping_dict = {}
+        claim.features = []
+        assert claim.json()["claim"]["words"][1] == {
+            "id": 1, "word": "widget", "pos": "NN", "np": "I-NP"
+        }
+        assert claim.appears_in("widget")
+        claim.text = "A gadget."
+        assert "gadget" in claim.words and not claim.appears_in("widget")
+
+    def test_cached_text(self):
+        """ Test document text is cached until units change. """
+        claimset = Claimset([Claim("A widget.", 1), Claim("A gadget.", 2)])
+        desc = Description(["one", "two"])
+        pd = PatentDoc(claimset, desc)
+        assert pd.text is pd.text
+        assert pd.reading_time(1) == 8
+        claimset.units = [Claim("A sprocket.", 1)]
+        assert pd.text == "one\ntwo\n\nA sprocket."
+        assert claimset.count == 1 and "gadget" not in claimset.term_index
+        desc.units.append(Paragraph("three"))
+        desc.invalidate()
+        assert pd.text.startswith("one\ntwo\nthree\n\n")
+
+    def test_patent_corpus(self):
+        """ Test a corpus held in memory. """
+        docs = [
+            PatentDoc(
+                Claimset([Claim("A widget {0}.".format(num), 1)]),
+                Description(["one"]), number=num
+            )
+            for num in range(3)
+        ]
+        corpus = PatentCorpus(docs)
+        assert len(corpus) == 3
+        assert list(corpus.map(lambda doc: doc.number)) == [0, 1, 2]
+        odd = corpus.filter(lambda doc: doc.number % 2)
+        assert [doc.number for doc in odd] == [1]
+        assert corpus.char_stats()["w"] == 3
+        with pytest.raises(TypeError):
+            len(odd)
+        with pytest.raises(ValueError):
+            PatentCorpus(["not a document"])
+
+    def test_compact(self):
+        """ Test holding document text in one buffer. """
+        claims = [
+            Claim("Claim {0} has an x.".format(num), num)
+            for num in range(1, 4)
+            ]
+        desc = Description(["One. Two.", "three"])
+        pd = PatentDoc(Claimset(claims), desc, number="US1")
+        text = pd.text
+        pd.compact()
+        assert pd.text == text
+        assert pd.description.text == "One. Two.\nthree"
+        assert pd.claimset.text.startswith("Claim 1 has an x.\n")
+        assert pd.claimset.get_claim(2).text == "Claim 2 has an x."
+        assert pd.claimset.get_claim(3).get_span()[0] is pd.text
+        assert desc.get_paragraph(1).sentences[1].text == "Two."
+        assert "x" in pd.claimset.get_claim(1).words
+        assert not hasattr(claims[0], "__dict__")
+
 
 class TestDescription(object):
     """ Test description functions. """
@@ -83,6 +202,22 @@ class TestDescription(object):
     def test_paragraphs(self):
         pass
 
+    def test_segment(self, description):
+        """ Test batch sentence segmentation. """
+        expected = [
+            [s.text for s in para.sentences]
+            for para in Description(description).paragraphs
+            ]
+        desc = Description(description)
+        desc.segment(processes=2, spans_only=True)
+        para = desc.get_paragraph(2)
+        assert not hasattr(para, "_sentences")
+        assert desc.sentence_count == sum(len(e) for e in expected)
+        assert [s.text for s in para.sentences] == expected[1]
+        desc.segment(processes=1)
+        para = desc.get_paragraph(1)
+        assert [s.text for s in para.sentences] == expected[0]
+
     def test_bag_of_words(self, description):
         """ Test returning a bag of words. """
         desc = Description(description)
@@ -94,6 +229,131 @@ class TestDescription(object):
         assert "sed" in bow
 
 
+class TestDependencyGraph(object):
+    """ Test claim dependency queries. """
+
+    @pytest.fixture()
+    def claimset(self):
+        dependencies = [0, 1, 2, 1, 0, 5, 9, 6]
+        return Claimset([
+            Claim("Claim {0}.".format(num), num, dependency)
+            for num, dependency in enumerate(dependencies, 1)
+            ])
+
+    def test_roots_and_groups(self, claimset):
+        """ Test root, group and descendant queries. """
+        assert claimset.get_root_claim_parent(3) == 1
+        assert claimset.get_root_claim_parent(8) == 5
+        assert claimset.get_dependency_groups() == {
+            1: [1, 2, 3, 4], 5: [5, 6, 8], 7: [7]
+            }
+        assert [c.number for c in claimset.get_dependent_claims(1)] == [
+            2, 3, 4
+            ]
+        assert claimset.get_dependent_claims(claimset.get_claim(3)) == []
+        assert claimset.dependency_graph.get_depth(3) == 2
+        # Forward dependency of claim 7 is treated as independent
+        assert claimset.dependency_graph.invalid == [7]
+        assert [c.number for c in claimset.independent_claims()] == [
+            1, 5, 7
+            ]
+
+    def test_statistics(self, claimset):
+        """ Test aggregate statistics over several claimsets. """
+        stats = dependency_statistics([claimset, claimset.claims[:4]])
+        assert stats['claimsets'] == 2
+        assert stats['claims'] == 12
+        assert stats['independent'] == 4
+        assert stats['max_depth'] == 2
+
+
+class TestClaimPipeline(object):
+    """ Test cached tagging and noun phrase labelling. """
+
+    @pytest.fixture()
+    def pipeline(self):
+        tagger = UnigramTagger(
+            model={"A": "DT", "a": "DT", "the": "DT", "red": "JJ",
+                   "has": "VBZ", ".": "."},
+            backoff=DefaultTagger("NN")
+            )
+        return ClaimPipeline(tagger=tagger, cache_size=2)
+
+    def test_set_pos(self, pipeline):
+        """ Test batch tagging of claims and caching. """
+        claims = [
+            Claim("A widget comprising a red lever.", 1),
+            Claim("The widget has a lever.", 2)
+            ]
+        pipeline.set_pos(claims)
+        assert ("comprising", "VBG") in claims[0].pos
+        assert ("red", "JJ") in claims[0].pos
+        assert len(pipeline.cache) == 2
+        pipeline.tag_texts(["A spring."])
+        # Least recently used entry is evicted
+        assert len(pipeline.cache) == 2
+
+    def test_label_supplied_pos(self, pipeline):
+        """ Test supplied tags are used even if the text is cached. """
+        text = "A red lever."
+        cached = pipeline.label_text(text)
+        pos = [("A", "DT"), ("red", "NN"), ("lever", "NN"), (".", ".")]
+        labels = pipeline.label_text(text, pos)
+        assert [word[1] for word in labels[0]] == ["DT", "NN", "NN", "."]
+        assert pipeline.label_text(text) == cached
+
+    def test_extract_entities(self, pipeline):
+        """ Test noun phrase mapping across texts. """
+        texts = ["A widget has a red lever.", "A lever has a spring."]
+        entities = pipeline.extract_entities(texts, processes=1)
+        assert entities[0] == {"widget": 1, "red lever": 2}
+        assert entities[1] == {"lever": 1, "spring": 2}
+        assert pipeline.extract_entities(texts, processes=2) == entities
+
+
+class TestTfidf(object):
+    """ Test corpus level TF-IDF matrix. """
+
+    @pytest.fixture()
+    def documents(self):
+        texts = [
+            ["A widget has a lever.", "The lever is red."],
+            ["A gadget has a spring.", "The spring is red."],
+            ["A widget has a spring."]
+        ]
+        return [
+            PatentDoc(
+                Claimset([
+                    Claim(text, num) for num, text in enumerate(claims, 1)
+                    ]),
+                Description(["Field of the invention."]),
+                number="US{0}".format(i)
+                )
+            for i, claims in enumerate(texts)
+        ]
+
+    def test_fit(self, documents):
+        """ Test building the matrix from a stream of documents. """
+        matrix = TfidfMatrix().fit(iter(documents))
+        assert matrix.shape == (3, len(matrix.vocabulary))
+        assert matrix.doc_ids == ["US0", "US1", "US2"]
+        assert len(matrix.indptr) == 4
+        assert matrix.indptr[-1] == len(matrix.indices) == len(matrix.data)
+        red = matrix.document_frequency[matrix.vocabulary["red"]]
+        assert red == 2
+        assert matrix.idf("lever") > matrix.idf("red") > matrix.idf("field")
+
+    def test_claim_tf_idf(self, documents):
+        """ Test claim_tf_idf backed by corpus IDF. """
+        matrix = TfidfMatrix().fit(documents)
+        claimset = documents[0].claimset
+        results = claimset.claim_tf_idf(1, tfidf=matrix)
+        assert results[0]['term'] == "lever"
+        assert set(r['term'] for r in results) == set(
+            ["widget", "lever"]
+            )
+
+
 class TestOnData(object):
     """ Testing functions on Patent Example."""
 
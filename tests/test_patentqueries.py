@@ -0,0 +1,256 @@
+from patentdata import datacache, datamodels, patentqueries
+import patentdata.utils as utils
+import os
+import random
+import re
+import subprocess
+import sys
+import pytest
+
+
+class TestLazyResources(object):
+    """ Test databases, data files and clients are loaded on first use.
+    """
+
+    def test_import_creates_no_files(self, tmpdir):
+        """ Test importing the modules leaves the working directory empty.
+        """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root)
+        subprocess.check_call([
+            sys.executable, "-c",
+            "import patentdata.patentqueries, patentdata.datamodels, "
+            "patentdata.datacache"
+        ], cwd=str(tmpdir), env=env)
+        assert tmpdir.listdir() == []
+
+    def test_configure(self, tmpdir):
+        """ Test sessions use the configured database files. """
+        data_path = str(tmpdir.join("data.db"))
+        cache_path = str(tmpdir.join("cache.db"))
+        datamodels.configure(data_path)
+        datacache.configure(cache_path)
+        try:
+            session = datamodels.Session()
+            session.add(datamodels.PatentSearch(name="Widget Co"))
+            session.commit()
+            session.close()
+            assert datamodels.Session().query(
+                datamodels.PatentSearch
+            ).count() == 1
+            assert datamodels.engine is utils.get_engine(data_path)
+
+            cachesession = datacache.Session()
+            datacache.RegisterCache.store_many(cachesession, {"EP1": {}})
+            cachesession.commit()
+            cachesession.close()
+            assert os.path.exists(cache_path)
+        finally:
+            datamodels.configure()
+            datacache.configure()
+
+    def test_data_files(self, tmpdir):
+        """ Test countries and credentials are read from data_dir. """
+        tmpdir.join("countries.txt").write("GB|United Kingdom\nFR|France\n")
+        tmpdir.join("config.ini").write(
+            "[Login Parameters]\nC_KEY = key\nC_SECRET = secret\n"
+        )
+        data_dir = patentqueries.data_dir
+        patentqueries.data_dir = str(tmpdir)
+        patentqueries.get_countries.cache_clear()
+        patentqueries.get_credentials.cache_clear()
+        patentqueries.get_normaliser.cache_clear()
+        try:
+            assert patentqueries.countries == ["UNITED KINGDOM", "FRANCE"]
+            assert patentqueries.consumer_key == "key"
+            assert patentqueries.get_credentials() == ("key", "secret")
+            assert patentqueries.process_name("Widget Ltd (France)") == (
+                "WIDGET"
+            )
+        finally:
+            patentqueries.data_dir = data_dir
+            patentqueries.get_countries.cache_clear()
+            patentqueries.get_credentials.cache_clear()
+            patentqueries.get_normaliser.cache_clear()
+
+
+def reference_process_name(name, stopwords):
+    """ Applicant name cleaning before names were normalised in batches. """
+    processed_name = name.upper().split(',')[0]
+    for char in patentqueries.chars_to_delete:
+        processed_name = processed_name.replace(char, "")
+    for char in patentqueries.chars_to_space:
+        processed_name = processed_name.replace(char, " ")
+    processed_name = reference_remove_bracketed(processed_name)
+    pattern = re.compile(r'\b(' + r'|'.join(stopwords) + r')\b\s*')
+    processed_name = pattern.sub('', processed_name)
+    processed_name = processed_name.replace("  ", " ")
+    return processed_name.strip()
+
+def reference_remove_bracketed(test_str):
+    """ Character by character version of utils.remove_bracketed. """
+    ret = ''
+    skip1c = 0
+    skip2c = 0
+    for i in test_str:
+        if i == '[':
+            skip1c += 1
+        elif i == '(':
+            skip2c += 1
+        elif i == ']' and skip1c > 0:
+            skip1c -= 1
+        elif i == ')' and skip2c > 0:
+            skip2c -= 1
+        elif skip1c == 0 and skip2c == 0:
+            ret += i
+    return ret
+
+
+class TestNameNormaliser(object):
+    """ Test compiled applicant name normalisation. """
+
+    stopwords = patentqueries.company_stopwords + ["UNITED KINGDOM", "FRANCE"]
+
+    names = [
+        "Widget Ltd (France)",
+        "Acme Gmbh & Co. KG, Munich",
+        "Smith+Jones-Brown Inc",
+        "A.B.C. [Holdings] (UK) Ltd",
+        "Nested ((one) two) three] Ltd)",
+        "Open (bracket never closed",
+        "  United Kingdom  Widgets   plc ",
+        "Société Générale S.A.",
+        "Llc-Ltd/Plc",
+        "",
+        ",",
+    ]
+
+    def test_matches_reference(self):
+        """ Test names are cleaned exactly as before. """
+        normaliser = patentqueries.NameNormaliser(self.stopwords)
+        rng = random.Random(50)
+        alphabet = "abcAB .,&/+-()[] "
+        names = self.names + [
+            "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+            for _ in range(500)
+        ] + [
+            " ".join(rng.choice(self.stopwords + ["Widget", "(x)"])
+                     for _ in range(4))
+            for _ in range(200)
+        ]
+        expected = [reference_process_name(n, self.stopwords) for n in names]
+        assert normaliser.normalise_many(names) == expected
+        assert [normaliser.normalise(n) for n in names] == expected
+        for name in names:
+            assert utils.remove_bracketed(name) == (
+                reference_remove_bracketed(name)
+            )
+
+    def test_cache(self):
+        """ Test repeated names are served from the cache. """
+        normaliser = patentqueries.NameNormaliser(self.stopwords, cache_size=2)
+        assert normaliser.normalise_many(["Widget Ltd"] * 3) == ["WIDGET"] * 3
+        info = normaliser.normalise.cache_info()
+        assert (info.hits, info.misses, info.maxsize) == (2, 1, 2)
+
+
+def register_json(agent, classification):
+    """ Return Register JSON with an agent and a classification. """
+    return {"reg:register-document": {
+        "reg:agents": {"reg:agent": {
+            "reg:name": {"$": agent},
+            "reg:address-1": {"$": "1 High Street"},
+            "reg:country": {"$": "GB"}
+        }},
+        "reg:classifications-ipcr": {"reg:classification-ipcr": {
+            "reg:text": {"$": classification}
+        }}
+    }}
+
+
+class FakeRegisterResponse(object):
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeRegisterFetcher(object):
+    """ Answer register requests from a dictionary, recording them. """
+
+    workers = 2
+
+    def __init__(self, registers):
+        self.registers = registers
+        self.requests = []
+
+    def request(self, service, method, reference_type, number):
+        self.requests.append(number.number)
+        return FakeRegisterResponse(self.registers[number.number])
+
+
+class TestEnrichRegisters(object):
+    """ Test adding register details to publications in bulk. """
+
+    @pytest.fixture(autouse=True)
+    def set_common_fixtures(self, tmpdir):
+        datamodels.configure(str(tmpdir.join("data.db")))
+        datacache.configure(str(tmpdir.join("cache.db")))
+        yield
+        datamodels.configure()
+        datacache.configure()
+
+    def test_enrich_registers(self):
+        """ Test cached data is used, misses are fetched and cached and
+        updates are committed in batches. """
+        numbers = ["EP{0}".format(i) for i in range(1, 6)]
+        registers = {
+            number: register_json("Agent " + number, "A47C21/08")
+            for number in numbers
+        }
+        # A classification without a group separator cannot be processed
+        registers["EP5"] = register_json("Agent EP5", "A47C21")
+        cachesession = datacache.Session()
+        datacache.RegisterCache.store_many(
+            cachesession, {"EP1": registers["EP1"]}
+        )
+        cachesession.commit()
+        cachesession.close()
+
+        session = datamodels.Session()
+        search = datamodels.PatentSearch(name="Widget Co")
+        search.publications = [
+            datamodels.PatentPublication(pub_no=number) for number in numbers
+        ]
+        session.add(search)
+        session.commit()
+        commits = []
+        commit = session.commit
+        session.commit = lambda: (commits.append(1), commit())
+
+        fetcher = FakeRegisterFetcher(registers)
+        updated = patentqueries.enrich_registers(
+            search.publications, session, fetcher=fetcher, processes=1,
+            batch_size=2
+        )
+        assert updated == 4
+        assert sorted(fetcher.requests) == numbers[1:]
+        # Two full batches of two then the final commit
+        assert len(commits) == 3
+        cachesession = datacache.Session()
+        assert sorted(datacache.RegisterCache.get_many(
+            cachesession, numbers
+        )) == numbers
+        cachesession.close()
+        session.close()
+
+        session = datamodels.Session()
+        publications = {
+            p.pub_no: p
+            for p in session.query(datamodels.PatentPublication)
+        }
+        assert publications["EP2"].raw_agent == "Agent EP2"
+        assert publications["EP2"].classifications[0].maingroup == 21
+        assert publications["EP5"].raw_agent is None
+        session.close()
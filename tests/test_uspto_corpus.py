@@ -1,7 +1,16 @@
 from patentdata.corpus import USPublications
+from patentdata.corpus import shards
+from patentdata.cli import main, build_parser
+from patentdata.corpus.export import export_dataset
+from patentdata.corpus.baseclasses import LocalDataSource
+from patentdata.corpus.textindex import TextIndex
+from patentdata.models import PatentCorpus
 import pytest
 
 import os
+import json
+import sqlite3
+import threading
 
 
 class TestGeneral(object):
@@ -71,6 +80,178 @@ class TestGeneral(object):
         doc = next(doc_generator)
         assert "support" in doc.title
 
+    def test_streaming_corpus(self):
+        """ Test reading a corpus lazily from the data source. """
+        corpus = USPublications(self.testfilepath)
+        corpus.process_classifications()
+        patent_corpus = PatentCorpus(datasource=corpus)
+        assert len(patent_corpus) == 1
+        assert len(patent_corpus.filter(classification=["H"])) == 0
+        titles = list(
+            patent_corpus.filter(classification=["A", "47"])
+            .map(lambda doc: doc.title)
+        )
+        assert "support" in titles[0]
+        xml_corpus = PatentCorpus(datasource=corpus, xml=True, prefetch=0)
+        assert "support" in next(iter(xml_corpus)).title()
+
+    def test_shards(self):
+        """ Test indexing archives in shards and merging them. """
+        for k in [1, 2]:
+            shard = USPublications(self.testfilepath, shard="{0}/2".format(k))
+            shard.index()
+            del shard
+        shard_paths = shards.shard_files(self.testfilepath)
+        assert len(shard_paths) == 2
+        merged = os.path.join(self.testfilepath, "fileindexes.merged.db")
+        try:
+            assert shards.merge_shards(
+                self.testfilepath, output="fileindexes.merged.db") == 1
+            # Merging again adds nothing
+            assert shards.merge_shards(
+                self.testfilepath, output="fileindexes.merged.db") == 0
+            conn = sqlite3.connect(merged)
+            records = conn.execute("SELECT pub_no FROM files").fetchall()
+            assert records == [("US20060085912A1",)]
+            conn.close()
+        finally:
+            for filepath in shard_paths + [merged]:
+                os.remove(filepath)
+        with pytest.raises(ValueError):
+            shards.parse_shard("3/2")
+
+    def test_cli(self, capsys, tmpdir):
+        """ Test the command line interface. """
+        assert main(["index", self.testfilepath]) == 0
+        assert "2006/I20060427.zip: 3 docs" in capsys.readouterr().err
+        args = build_parser().parse_args(
+            ["index", self.testfilepath, "--batch-size", "1"]
+        )
+        assert args.function(args)['bytes'] > 0
+        capsys.readouterr()
+        main(["classify", self.testfilepath, "--processes", "1"])
+        capsys.readouterr()
+        main(["sample", self.testfilepath, "--classification", "A", "47"])
+        assert capsys.readouterr().out == "US20060085912A1\n"
+        output = str(tmpdir.join("export.jsonl"))
+        main([
+            "export", self.testfilepath, output, "--processes", "1",
+            "--no-text"
+        ])
+        with open(output) as f:
+            record = json.loads(f.readline())
+        assert record["pub_no"] == "US20060085912A1"
+        assert record["year"] == 2006 and record["section"] == "A"
+        assert "claims" not in record
+
+    def test_export_dataset(self, tmpdir):
+        """ Test exporting a partitioned dataset incrementally. """
+        corpus = USPublications(self.testfilepath)
+        output = str(tmpdir.join("dataset"))
+        with pytest.raises(ValueError):
+            export_dataset(corpus, output, "csv")
+        pa = pytest.importorskip("pyarrow")
+        import pyarrow.dataset
+        corpus.process_classifications()
+        assert export_dataset(corpus, output, processes=1) == 1
+        assert os.path.isdir(os.path.join(output, "year=2006", "section=A"))
+        # Documents already exported are skipped
+        assert export_dataset(corpus, output, processes=1) == 0
+        table = pa.dataset.dataset(
+            output, format="parquet", partitioning="hive"
+        ).to_table()
+        assert table.column("pub_no").to_pylist() == ["US20060085912A1"]
+        assert table.column("claim_count").to_pylist() == [39]
+
+    def test_text_index(self):
+        """ Test indexing claims and paragraphs for term lookups. """
+        corpus = USPublications(self.testfilepath)
+        corpus.process_classifications()
+        corpus.text_index.add_patentdocs(corpus.patentdoc_generator())
+        assert "US20060085912A1" in corpus.text_index
+        assert "US20060085912A1" in corpus.text_index.documents_with(
+            "siderail", unit_type="claim"
+            )
+        assert corpus.text_index.documents_with("xyzzyqwerty") == []
+        # Adding again is a no-op
+        assert corpus.text_index.add_patentdocs(
+            corpus.patentdoc_generator()) == 0
+
+    def test_search(self):
+        """ Test building and searching the full text index. """
+        corpus = USPublications(self.testfilepath)
+        corpus.process_classifications()
+        corpus.index_text(processes=2)
+        results = corpus.search("siderail")
+        assert results[0] == "US20060085912A1"
+        assert corpus.search("siderail", classification=["A", "47"])
+        assert corpus.search("siderail", classification=["H"]) == []
+        # Re-running only processes new publications
+        assert corpus.index_text(processes=1) == 0
+        doc = next(corpus.patentdoc_generator(publication_numbers=results))
+        assert "support" in doc.title
+
+    def test_thread_cursors(self):
+        """ Test each thread queries with its own cursor. """
+        corpus = USPublications(self.testfilepath)
+        cursors = []
+        thread = threading.Thread(target=lambda: cursors.append(corpus.c))
+        thread.start()
+        thread.join()
+        assert corpus.c is corpus.c
+        assert cursors[0] is not corpus.c
+        assert corpus.c.execute("SELECT COUNT(*) FROM files").fetchone()
+
+    def test_index_text_closes_reader(self, monkeypatch):
+        """ Test the read ahead thread stops if indexing fails. """
+        corpus = USPublications(self.testfilepath)
+        readers = []
+        iter_read = corpus.iter_read
+
+        def record_reader(filelist):
+            readers.append(iter_read(filelist))
+            return readers[-1]
+
+        def fail(*args):
+            raise KeyboardInterrupt
+
+        monkeypatch.setattr(corpus, "iter_read", record_reader)
+        monkeypatch.setattr(corpus.text_index, "build", fail)
+        with pytest.raises(KeyboardInterrupt):
+            corpus.index_text(processes=1)
+        readers[0].thread.join(5)
+        assert readers[0].stopped and not readers[0].thread.is_alive()
+
+    def test_build_records_failures(self):
+        """ Test documents that cannot be parsed are not parsed again. """
+        text_index = TextIndex(sqlite3.connect(":memory:"))
+        assert text_index.build([("US1", b"")], processes=1) == 0
+        assert text_index.conn.execute(
+            "SELECT pub_no FROM documents_indexed"
+        ).fetchall() == [("US1",)]
+
+    def test_local_subclass(self):
+        """ Test sources without a full text index can be created. """
+        class Source(LocalDataSource):
+            def get_patentdoc(self, publication_number):
+                pass
+
+            def patentdoc_generator(
+                self, publication_numbers=None, sample_size=None
+            ):
+                pass
+
+            def index(self, publication_number):
+                pass
+
+            def xmldoc_generator(
+                self, publication_numbers=None, sample_size=None
+            ):
+                pass
+
+        with pytest.raises(NotImplementedError):
+            Source().index_text()
+
     #def test_class_match(self):
         #""" Test matching of classifications. """
         #class1 = corpus.m.Classification("G", "06", "F", "10", "22")
@@ -3,6 +3,17 @@ from patentdata.models.lib.utils import (
     remove_stopwords,
     stem
 )
+from patentdata.models.lib.utils_claim import (
+    SuffixTrie,
+    ends_with,
+    analyse_claims
+)
+from patentdata.utils import ReadAhead, prefetch, ProgressReporter
+import io
+import os
+import subprocess
+import sys
+import pytest
 
 class TestUtils(object):
     """ Set of tests to test utility functions."""
@@ -31,3 +42,92 @@ class TestUtils(object):
         assert set(
             ["jump", "pass", "coupl"]
             ).issubset(processed)
+
+    def test_ends_with(self):
+        """ Test suffix matching. """
+        assert ends_with("the first widget", "widget")
+        assert ends_with("the first widget\n", "widget")
+        assert not ends_with("the widget lever", "widget")
+
+    def test_suffix_trie(self):
+        """ Test suffix trie keeps first added match. """
+        trie = SuffixTrie(["lever", "red lever", "widget"])
+        assert trie.first_suffix("the red lever") == "lever"
+        assert [s for _, s in trie.suffixes_of("red lever")] == [
+            "lever", "red lever"
+            ]
+        assert trie.first_suffix("a spring") is None
+        assert len(trie) == 3
+
+    def test_analyse_claims(self):
+        """ Test analysing a set of claims in one pass. """
+        analysis = analyse_claims([
+            "1. A method of making a widget.",
+            "2. The method of claim 1, wherein the widget is red.",
+            "3. A widget according to any preceding claims."
+            ])
+        assert [a['number'] for a in analysis] == [1, 2, 3]
+        assert [a['dependency'] for a in analysis] == [0, 1, 1]
+        assert [a['category'] for a in analysis] == [
+            "method", "method", "system"
+            ]
+
+    def test_read_ahead(self):
+        """ Test reading items in a background thread. """
+        items = [b"x" * size for size in [10, 20, 30, 40]]
+        reader = ReadAhead(items, depth=2, max_bytes=35, sizeof=len)
+        assert list(reader) == items
+        metrics = reader.metrics()
+        assert metrics['items'] == 4 and metrics['bytes'] == 100
+        assert metrics['max_held_bytes'] <= 40
+        assert metrics['max_depth'] <= 2
+
+        def failing():
+            yield 1
+            raise ValueError("read error")
+
+        with pytest.raises(ValueError):
+            list(ReadAhead(failing()))
+
+        # Stopping early ends the thread
+        reader = ReadAhead(iter(range(1000)), depth=4)
+        assert next(reader) == 0
+        reader.close()
+        assert not reader.thread.is_alive()
+        assert list(prefetch(range(5), depth=2)) == list(range(5))
+
+    def test_progress_reporter(self):
+        """ Test reporting throughput per archive. """
+        stream = io.StringIO()
+        progress = ProgressReporter(archives=2, interval=0, stream=stream)
+        progress.start("a.zip", total=4)
+        progress.update(2, 1000000)
+        assert "a.zip: 2 docs" in stream.getvalue()
+        assert "(2/4), ETA" in stream.getvalue()
+        progress.start("b.zip")
+        progress.finish()
+        summary = progress.summary()
+        assert summary['archives'] == 2 and summary['documents'] == 2
+        assert summary['bytes'] == 1000000
+
+
+
+class TestImports(object):
+    """ Guard against slow dependencies loading at import. """
+
+    def test_lazy_dependencies(self):
+        """ Test nltk and bs4 are only loaded when first needed. """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        loaded = subprocess.check_output([
+            sys.executable, "-c",
+            "import sys; import patentdata.corpus, patentdata.models; "
+            "print(','.join(m for m in ('nltk', 'bs4') if m in sys.modules))"
+        ], cwd=root).decode().strip()
+        assert loaded == ""
+
+    def test_stopwords(self):
+        """ Test stopwords are loaded on first use. """
+        from patentdata.models.lib import utils
+        assert "the" in utils.get_stopwords()
+        assert isinstance(utils.ENG_STOPWORDS, list)
+        assert set(utils.ENG_STOPWORDS) == utils.get_stopwords()